@@ -1,7 +1,7 @@
 #!/bin/sh
 
-# This is just a wrapper that passes on the call to filterFDR.py after converting bam files for
-# the current sample to sam if necessary, and then removes the temporary sam files after completion.
+# This is just a wrapper that passes on the call to filterFDR.py with the options for the current sample.
+# Bam files are read directly by filterFDR.py, so they are not converted to sam first.
 
 # store commandline params and look up job info in txt file
 CLUSTER_TYPE=$1
@@ -31,59 +31,11 @@ ALIGNED_SAMPLE_MATE_ID=`echo ${SAMPLE_MATE_ID} | sed 's/unaligned_//'`
 if [ "$READ_NUM" -eq 1 ]
 then
   
-  # convert sample bam files to sam if necessary. just checking for a single sam file, not all, assume if 1 exists they all will
-  f=`find ${ALIGN_PARDIR}/${DATASET_NAME}/orig/junction -type f -name ${ALIGNED_SAMPLE_ID}_junction_output.sam`
+  # filterFDR.py reads bam files directly when there is no sam file, so nothing is converted here
 
   # if paired end, we will need the mate too. If mate doesn't exist, assume we are working with single-end reads
   f2=`find ${ALIGN_PARDIR}/${DATASET_NAME}/orig/junction -type f -name ${ALIGNED_SAMPLE_MATE_ID}_junction_output.*`
-
-  if [ ! -f "$f" ]
-  then
-    DO_CONVERT=true
-    
-    # if read1 file was stored as bam, assume read2 is too if it exists
-    if [ -f "$f2" ]
-    then
-      DO_CONVERT_2=true
-    fi
-  fi
-
-  if [[ $MODE = *unaligned* ]]
-  then
-    if [ "$DO_CONVERT" = true ]
-    then
-      # need Rd1 unaligned bam file converted to sam for analysis
-      samtools view ${ALIGN_PARDIR}/${DATASET_NAME}/orig/denovo/${SAMPLE_ID}_denovo_output.bam > ${ALIGN_PARDIR}/${DATASET_NAME}/orig/denovo/${SAMPLE_ID}_denovo_output.sam
-    fi
-
-    if [ "$DO_CONVERT_2" = true ]
-    then
-      # need Rd2 too
-      samtools view ${ALIGN_PARDIR}/${DATASET_NAME}/orig/denovo/${SAMPLE_MATE_ID}_denovo_output.bam > ${ALIGN_PARDIR}/${DATASET_NAME}/orig/denovo/${SAMPLE_MATE_ID}_denovo_output.sam
-      
-      # need Rd2 genome, reg, and junction
-      samtools view ${ALIGN_PARDIR}/${DATASET_NAME}/orig/genome/${ALIGNED_SAMPLE_MATE_ID}_genome_output.bam > ${ALIGN_PARDIR}/${DATASET_NAME}/orig/genome/${ALIGNED_SAMPLE_MATE_ID}_genome_output.sam
-      samtools view ${ALIGN_PARDIR}/${DATASET_NAME}/orig/junction/${ALIGNED_SAMPLE_MATE_ID}_junction_output.bam > ${ALIGN_PARDIR}/${DATASET_NAME}/orig/junction/${ALIGNED_SAMPLE_MATE_ID}_junction_output.sam
-      samtools view ${ALIGN_PARDIR}/${DATASET_NAME}/orig/reg/${ALIGNED_SAMPLE_MATE_ID}_reg_output.bam > ${ALIGN_PARDIR}/${DATASET_NAME}/orig/reg/${ALIGNED_SAMPLE_MATE_ID}_reg_output.sam
-    fi
-  else
   
-    if [ "$DO_CONVERT" = true ]
-    then
-      # need Rd1 regular and junction bam files converted to sam for analysis 
-      samtools view ${ALIGN_PARDIR}/${DATASET_NAME}/orig/junction/${SAMPLE_ID}_junction_output.bam > ${ALIGN_PARDIR}/${DATASET_NAME}/orig/junction/${SAMPLE_ID}_junction_output.sam
-      samtools view ${ALIGN_PARDIR}/${DATASET_NAME}/orig/reg/${SAMPLE_ID}_reg_output.bam > ${ALIGN_PARDIR}/${DATASET_NAME}/orig/reg/${SAMPLE_ID}_reg_output.sam
-    
-      if [ "$DO_CONVERT_2" = true ]
-      then
-        # need Rd2 genome, reg, and junction
-        samtools view ${ALIGN_PARDIR}/${DATASET_NAME}/orig/genome/${SAMPLE_MATE_ID}_genome_output.bam > ${ALIGN_PARDIR}/${DATASET_NAME}/orig/genome/${SAMPLE_MATE_ID}_genome_output.sam
-        samtools view ${ALIGN_PARDIR}/${DATASET_NAME}/orig/junction/${SAMPLE_MATE_ID}_junction_output.bam > ${ALIGN_PARDIR}/${DATASET_NAME}/orig/junction/${SAMPLE_MATE_ID}_junction_output.sam
-        samtools view ${ALIGN_PARDIR}/${DATASET_NAME}/orig/reg/${SAMPLE_MATE_ID}_reg_output.bam > ${ALIGN_PARDIR}/${DATASET_NAME}/orig/reg/${SAMPLE_MATE_ID}_reg_output.sam
-      fi
-    fi
-  fi
-    
   # set up alternate python arguments based on parameters passed
   if [ $# -eq 8 ]
   then
@@ -110,34 +62,12 @@ then
     OPT_ARGS=`echo ${OPT_ARGS} -u`
   fi
   
-  python filterFDR.py -p ${ALIGN_PARDIR}/${DATASET_NAME} -s ${SAMPLE_ID} -o ${OUTDIR_NAME} -q ${READ_TYPE} -oh ${OVERLAP} -v ${OPT_ARGS}
-  
-  if [[ $MODE = *unaligned* ]]
+  # junction metadata tables created with the junction indices, so junction ids can be looked up instead of parsed
+  JUNC_METADATA=`ls ../index/*_metadata.npy 2>/dev/null`
+  if [ -n "${JUNC_METADATA}" ]
   then
-    if [ "$DO_CONVERT" = true ]
-    then
-      rm ${ALIGN_PARDIR}/${DATASET_NAME}/orig/denovo/${SAMPLE_ID}_denovo_output.sam
-    fi
-    
-    if [ "$DO_CONVERT_2" = true ]
-    then
-      rm ${ALIGN_PARDIR}/${DATASET_NAME}/orig/denovo/${SAMPLE_MATE_ID}_denovo_output.sam
-      rm ${ALIGN_PARDIR}/${DATASET_NAME}/orig/genome/${ALIGNED_SAMPLE_MATE_ID}_genome_output.sam
-      rm ${ALIGN_PARDIR}/${DATASET_NAME}/orig/junction/${ALIGNED_SAMPLE_MATE_ID}_junction_output.sam
-      rm ${ALIGN_PARDIR}/${DATASET_NAME}/orig/reg/${ALIGNED_SAMPLE_MATE_ID}_reg_output.sam 
-    fi
-  else
-    # delete those sam files when we're done with them
-    if [ "$DO_CONVERT" = true ]
-    then 
-      rm ${ALIGN_PARDIR}/${DATASET_NAME}/orig/junction/${SAMPLE_ID}_junction_output.sam
-      rm ${ALIGN_PARDIR}/${DATASET_NAME}/orig/reg/${SAMPLE_ID}_reg_output.sam
-    fi
-    if [ "$DO_CONVERT_2" = true ]
-    then
-      rm ${ALIGN_PARDIR}/${DATASET_NAME}/orig/genome/${SAMPLE_MATE_ID}_genome_output.sam
-      rm ${ALIGN_PARDIR}/${DATASET_NAME}/orig/junction/${SAMPLE_MATE_ID}_junction_output.sam
-      rm ${ALIGN_PARDIR}/${DATASET_NAME}/orig/reg/${SAMPLE_MATE_ID}_reg_output.sam
-    fi
+    OPT_ARGS=`echo ${OPT_ARGS} -m ${JUNC_METADATA}`
   fi
+  
+  python filterFDR.py -p ${ALIGN_PARDIR}/${DATASET_NAME} -s ${SAMPLE_ID} -o ${OUTDIR_NAME} -q ${READ_TYPE} -oh ${OVERLAP} -v ${OPT_ARGS}
 fi
@@ -0,0 +1,247 @@
+# Reading of BAM files directly, so alignments stored as BAM do not have to be converted to a
+# temporary SAM file with samtools view before they are parsed.
+#
+# A BAM file is a series of BGZF blocks, each a complete gzip member holding up to 64KB of data.
+# Blocks are read from the file in batches and the batch is decompressed on a pool of threads
+# (zlib releases the GIL while it inflates) while the records of the previous batch are decoded.
+# Each record is turned back into the SAM line samtools view would have printed for it, so the
+# rest of the analysis code works the same on SAM and BAM input.
+#
+# Can also be run as a script to print the SAM lines of a BAM file to stdout, like samtools view:
+#   python utils_bam.py -b sample_genome_output.bam | awk ...
+
+import argparse
+import binascii
+import os
+import struct
+import sys
+import zlib
+from multiprocessing.pool import ThreadPool
+
+NUM_THREADS = 4  # threads used to decompress blocks
+BLOCKS_PER_BATCH = 64  # blocks handed to the threads at a time
+
+BGZF_HEADER = struct.Struct("<4BI2BH")  # ID1, ID2, CM, FLG, MTIME, XFL, OS, XLEN
+BGZF_FOOTER = struct.Struct("<II")  # CRC32, ISIZE
+BAM_CORE = struct.Struct("<iiBBHHHiiii")  # refID, pos, l_read_name, mapq, bin, n_cigar_op, flag, l_seq, next_refID, next_pos, tlen
+INT32 = struct.Struct("<i")
+
+CIGAR_OPS = "MIDNSHP=X"
+SEQ_CHARS = "=ACMGRSVTWYHKDBN"  # 4-bit base code: base
+# bases are packed 2 per byte, so the hex digits of the packed bytes are the base codes in order
+HEX_TO_SEQ = "".join(SEQ_CHARS["0123456789abcdef".index(chr(i))] if chr(i) in "0123456789abcdef" else chr(i) for i in xrange(256))
+QUAL_TO_SAM = "".join(chr((i + 33) % 256) for i in xrange(256))  # phred score: SAM quality character
+TAG_INT_TYPES = {"c": struct.Struct("<b"), "C": struct.Struct("<B"), "s": struct.Struct("<h"), "S": struct.Struct("<H"),
+                 "i": struct.Struct("<i"), "I": struct.Struct("<I")}
+ARRAY_TYPES = {"c": "b", "C": "B", "s": "h", "S": "H", "i": "i", "I": "I", "f": "f"}  # B tag subtype: struct format
+
+# return: generator of (compressed data, uncompressed size) for each BGZF block in the file
+def bgzfBlocks(handle):
+    while True:
+        header = handle.read(BGZF_HEADER.size)
+        if not header:
+            break
+        if len(header) < BGZF_HEADER.size:
+            raise IOError("truncated BGZF block header")
+        id1, id2, cm, flg, mtime, xfl, osType, xlen = BGZF_HEADER.unpack(header)
+        if id1 != 31 or id2 != 139 or not flg & 4:
+            raise IOError("not a BGZF block")
+
+        # the BC subfield of the extra field has the total block size - 1
+        extra = handle.read(xlen)
+        blockSize = None
+        i = 0
+        while i + 4 <= xlen:
+            subLen = struct.unpack("<H", extra[i + 2:i + 4])[0]
+            if extra[i:i + 2] == "BC":
+                blockSize = struct.unpack("<H", extra[i + 4:i + 6])[0] + 1
+            i += 4 + subLen
+        if blockSize is None:
+            raise IOError("BGZF block without a block size")
+
+        rest = handle.read(blockSize - BGZF_HEADER.size - xlen)
+        if len(rest) < blockSize - BGZF_HEADER.size - xlen:
+            raise IOError("truncated BGZF block")
+        crc, size = BGZF_FOOTER.unpack(rest[-BGZF_FOOTER.size:])
+        yield rest[:-BGZF_FOOTER.size], size
+
+# return: decompressed data for a block from bgzfBlocks
+def inflateBlock(block):
+    data = zlib.decompress(block[0], -15)
+    if len(data) != block[1]:
+        raise IOError("BGZF block did not decompress to the expected size")
+    return data
+
+# return: generator of the decompressed data of each block in a BGZF file
+# param numThreads: number of threads to decompress with, 1 to decompress in the calling thread
+def bgzfData(fileName, numThreads=NUM_THREADS):
+    handle = open(fileName, "rb")
+
+    if numThreads <= 1:
+        for block in bgzfBlocks(handle):
+            yield inflateBlock(block)
+    else:
+        pool = ThreadPool(numThreads)
+        try:
+            # the next batch is decompressed while the data from the previous one is used
+            pending = None
+            batch = []
+            for block in bgzfBlocks(handle):
+                batch.append(block)
+                if len(batch) == BLOCKS_PER_BATCH:
+                    nextPending = pool.map_async(inflateBlock, batch)
+                    if pending:
+                        for data in pending.get():
+                            yield data
+                    pending = nextPending
+                    batch = []
+            if pending:
+                for data in pending.get():
+                    yield data
+            for data in pool.map(inflateBlock, batch):
+                yield data
+        finally:
+            pool.terminate()
+
+    handle.close()
+
+# Decompressed BAM data, read as needed from the BGZF blocks
+class bamStream:
+    def __init__(self, fileName, numThreads):
+        self.blocks = bgzfData(fileName, numThreads)
+        self.buf = ""
+        self.pos = 0
+
+    # return: next n bytes, or fewer only at the end of the file
+    def read(self, n):
+        while len(self.buf) - self.pos < n:
+            try:
+                data = next(self.blocks)
+            except StopIteration:
+                break
+            self.buf = self.buf[self.pos:] + data
+            self.pos = 0
+        chunk = self.buf[self.pos:self.pos + n]
+        self.pos += len(chunk)
+        return chunk
+
+# return: SAM formatted tag fields for the tags of a BAM record
+# param data: the tag part of the record
+def formatTags(data):
+    tags = []
+    i = 0
+    while i < len(data):
+        tag = data[i:i + 2]
+        valType = data[i + 2]
+        i += 3
+        if valType in TAG_INT_TYPES:
+            val = TAG_INT_TYPES[valType].unpack_from(data, i)[0]
+            i += TAG_INT_TYPES[valType].size
+            tags.append(tag + ":i:" + str(val))
+        elif valType == "Z" or valType == "H":
+            end = data.index("\x00", i)
+            tags.append(tag + ":" + valType + ":" + data[i:end])
+            i = end + 1
+        elif valType == "A":
+            tags.append(tag + ":A:" + data[i])
+            i += 1
+        elif valType == "f":
+            tags.append(tag + ":f:" + "%g" % struct.unpack_from("<f", data, i)[0])
+            i += 4
+        elif valType == "B":
+            subType = data[i]
+            count = INT32.unpack_from(data, i + 1)[0]
+            vals = struct.unpack_from("<" + str(count) + ARRAY_TYPES[subType], data, i + 5)
+            i += 5 + struct.calcsize("<" + str(count) + ARRAY_TYPES[subType])
+            if subType == "f":
+                tags.append(",".join([tag + ":B:f"] + ["%g" % val for val in vals]))
+            else:
+                tags.append(",".join([tag + ":B:" + subType] + [str(val) for val in vals]))
+        else:
+            raise IOError("unknown BAM tag type " + valType)
+    return tags
+
+# return: SAM line, including the newline, for a BAM record
+# param record: the record without its block_size
+# param refNames: names of the reference sequences from the BAM header
+def formatRecord(record, refNames):
+    refId, pos, nameLen, mapQual, binNum, numCigarOps, flag, seqLen, nextRefId, nextPos, tlen = BAM_CORE.unpack_from(record)
+
+    i = BAM_CORE.size
+    readId = record[i:i + nameLen - 1]
+    i += nameLen
+
+    if numCigarOps:
+        cigar = "".join([str(op >> 4) + CIGAR_OPS[op & 15] for op in struct.unpack_from("<" + str(numCigarOps) + "I", record, i)])
+    else:
+        cigar = "*"
+    i += 4 * numCigarOps
+
+    if seqLen:
+        seq = binascii.hexlify(record[i:i + (seqLen + 1) / 2]).translate(HEX_TO_SEQ)[:seqLen]
+        i += (seqLen + 1) / 2
+        if record[i] == "\xff":
+            qual = "*"
+        else:
+            qual = record[i:i + seqLen].translate(QUAL_TO_SAM)
+        i += seqLen
+    else:
+        seq = "*"
+        qual = "*"
+
+    if refId < 0:
+        refName = "*"
+    else:
+        refName = refNames[refId]
+
+    if nextRefId < 0:
+        nextRefName = "*"
+    elif nextRefId == refId:
+        nextRefName = "="
+    else:
+        nextRefName = refNames[nextRefId]
+
+    return "\t".join([readId, str(flag), refName, str(pos + 1), str(mapQual), cigar, nextRefName, str(nextPos + 1), str(tlen),
+                      seq, qual] + formatTags(record[i:])) + "\n"
+
+# return: generator of the SAM line for each alignment in a BAM file, header lines are not included
+# param numThreads: number of threads to decompress with
+def bamLines(fileName, numThreads=NUM_THREADS):
+    stream = bamStream(fileName, numThreads)
+
+    if stream.read(4) != "BAM\x01":
+        raise IOError("not a BAM file: " + fileName)
+    textLen = INT32.unpack(stream.read(4))[0]
+    stream.read(textLen)
+    refNames = []
+    for i in xrange(INT32.unpack(stream.read(4))[0]):
+        nameLen = INT32.unpack(stream.read(4))[0]
+        refNames.append(intern(stream.read(nameLen)[:-1]))
+        stream.read(4)  # reference length
+
+    while True:
+        blockSize = stream.read(4)
+        if not blockSize:
+            break
+        record = stream.read(INT32.unpack(blockSize)[0])
+        yield formatRecord(record, refNames)
+
+# The SAM file is used if it exists, otherwise the BAM file with the same name, read directly.
+# return: iterable of the lines of the alignment file, with a close method
+# param samFile: path to the SAM file
+# param numThreads: number of threads to decompress a BAM file with
+def openAlignments(samFile, numThreads=NUM_THREADS):
+    bamFile = os.path.splitext(samFile)[0] + ".bam"
+    if not os.path.exists(samFile) and os.path.exists(bamFile):
+        return bamLines(bamFile, numThreads)
+    else:
+        return open(samFile, "rU")
+
+if __name__  == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-b', '--bamFile', help='BAM file to print as SAM lines', required=True)
+    parser.add_argument('-t', '--numThreads', help='number of threads to decompress with', type=int, default=NUM_THREADS)
+    args = parser.parse_args()
+
+    for line in bamLines(args.bamFile, args.numThreads):
+        sys.stdout.write(line)
@@ -163,13 +163,13 @@ if [[ $MODE != *analysis* ]]
 then
   if [[ $MODE = *unaligned* ]]
   then
-    qsub -t 1-${NUM_FILES}:1 -N DeNovoAlign${DATASET_NAME}${DENOVOCIRC} -l h_vmem=6G -l h_rt=${ALIGN_MAX_RT} -wd ${CODE_DIR}/index -o ${LOG_DIR}/align/ -e ${LOG_DIR}/align/ analysis/align.sh SGE $TASK_DATA_FILE $ALIGN_PARDIR $DATASET_NAME $MODE denovo_${DATASET_NAME}_${DENOVOCIRC} denovo denovo_${DATASET_NAME}_onlycircles${DENOVOCIRC}.fa
+    qsub -t 1-${NUM_FILES}:1 -N DeNovoAlign${DATASET_NAME}${DENOVOCIRC} -l h_vmem=6G -l h_rt=${ALIGN_MAX_RT} -wd ${CODE_DIR}/index -o ${LOG_DIR}/align/ -e ${LOG_DIR}/align/ analysis/align.sh SGE $TASK_DATA_FILE $ALIGN_PARDIR $DATASET_NAME $MODE denovo_${DATASET_NAME}_${DENOVOCIRC} denovo denovo_${DATASET_NAME}_onlycircles${DENOVOCIRC}.fa ${JUNCTION_MIDPOINT} ${OVERLAP}
     depend_str="-hold_jid_ad "DeNovoAlign${DATASET_NAME}${DENOVOCIRC}
   else
     qsub -t 1-${NUM_FILES}:1 -N GenomeAlign${DATASET_NAME} -l h_vmem=${GENOME_VMEM} -l h_rt=${ALIGN_MAX_RT} -wd ${CODE_DIR}/index -o ${LOG_DIR}/align/ -e ${LOG_DIR}/align/ analysis/align.sh SGE $TASK_DATA_FILE $ALIGN_PARDIR $DATASET_NAME $MODE ${bt_prefix}_genome genome ${bt_prefix}_genome.fa
-    qsub -t 1-${NUM_FILES}:1 -N JunctionAlign${DATASET_NAME} -l h_vmem=${JUNC_VMEM} -l h_rt=${ALIGN_MAX_RT} -wd ${CODE_DIR}/index -o ${LOG_DIR}/align/ -e ${LOG_DIR}/align/ analysis/align.sh SGE $TASK_DATA_FILE $ALIGN_PARDIR $DATASET_NAME $MODE ${bt_prefix}_junctions_scrambled junction ${bt_prefix}_junctions_scrambled.fa
+    qsub -t 1-${NUM_FILES}:1 -N JunctionAlign${DATASET_NAME} -l h_vmem=${JUNC_VMEM} -l h_rt=${ALIGN_MAX_RT} -wd ${CODE_DIR}/index -o ${LOG_DIR}/align/ -e ${LOG_DIR}/align/ analysis/align.sh SGE $TASK_DATA_FILE $ALIGN_PARDIR $DATASET_NAME $MODE ${bt_prefix}_junctions_scrambled junction ${bt_prefix}_junctions_scrambled.fa ${JUNCTION_MIDPOINT} ${OVERLAP}
     qsub -t 1-${NUM_FILES}:1 -N RiboAlign${DATASET_NAME} -l h_vmem=${RIBO_VMEM} -l h_rt=${ALIGN_MAX_RT} -wd ${CODE_DIR}/index -o ${LOG_DIR}/align/ -e ${LOG_DIR}/align/ analysis/align.sh SGE $TASK_DATA_FILE $ALIGN_PARDIR $DATASET_NAME $MODE ${bt_prefix}_ribosomal ribo ${bt_prefix}_ribosomal.fa
-    qsub -t 1-${NUM_FILES}:1 -N RegAlign${DATASET_NAME} -l h_vmem=${REG_VMEM} -l h_rt=${ALIGN_MAX_RT} -wd ${CODE_DIR}/index -o ${LOG_DIR}/align/ -e ${LOG_DIR}/align/ analysis/align.sh SGE $TASK_DATA_FILE $ALIGN_PARDIR $DATASET_NAME $MODE ${bt_prefix}_junctions_reg reg ${bt_prefix}_junctions_reg.fa
+    qsub -t 1-${NUM_FILES}:1 -N RegAlign${DATASET_NAME} -l h_vmem=${REG_VMEM} -l h_rt=${ALIGN_MAX_RT} -wd ${CODE_DIR}/index -o ${LOG_DIR}/align/ -e ${LOG_DIR}/align/ analysis/align.sh SGE $TASK_DATA_FILE $ALIGN_PARDIR $DATASET_NAME $MODE ${bt_prefix}_junctions_reg reg ${bt_prefix}_junctions_reg.fa ${JUNCTION_MIDPOINT} ${OVERLAP}
     depend_str="-hold_jid_ad "GenomeAlign${DATASET_NAME},JunctionAlign${DATASET_NAME},RiboAlign${DATASET_NAME},RegAlign${DATASET_NAME}
   fi
 fi
@@ -237,13 +237,13 @@ if [[ $MODE != *analysis* ]]
 then
   if [[ $MODE = *unaligned* ]]
   then
-    j_id=`sbatch -J DeNovoAlign${DATASET_NAME}${DENOVOCIRC} ${RESOURCE_FLAG} --array=1-${NUM_FILES} --time=${ALIGN_MAX_RT} --mem=6000 -D ${CODE_DIR}/index -o ${LOG_DIR}/align/${DATASET_NAME}AlignDeNovo${DENOVOCIRC}_%A_%a.out -e ${LOG_DIR}/align/${DATASET_NAME}AlignDeNovo${DENOVOCIRC}_%A_%a.err analysis/align.sh SLURM $TASK_DATA_FILE $ALIGN_PARDIR $DATASET_NAME $MODE denovo_${DATASET_NAME}_${DENOVOCIRC} denovo denovo_${DATASET_NAME}_onlycircles${DENOVOCIRC}.fa | awk '{print $4}'`
+    j_id=`sbatch -J DeNovoAlign${DATASET_NAME}${DENOVOCIRC} ${RESOURCE_FLAG} --array=1-${NUM_FILES} --time=${ALIGN_MAX_RT} --mem=6000 -D ${CODE_DIR}/index -o ${LOG_DIR}/align/${DATASET_NAME}AlignDeNovo${DENOVOCIRC}_%A_%a.out -e ${LOG_DIR}/align/${DATASET_NAME}AlignDeNovo${DENOVOCIRC}_%A_%a.err analysis/align.sh SLURM $TASK_DATA_FILE $ALIGN_PARDIR $DATASET_NAME $MODE denovo_${DATASET_NAME}_${DENOVOCIRC} denovo denovo_${DATASET_NAME}_onlycircles${DENOVOCIRC}.fa ${JUNCTION_MIDPOINT} ${OVERLAP} | awk '{print $4}'`
     depend_str="--depend=afterok:"${j_id}
   else
     g_id=`sbatch -J GenomeAlign${DATASET_NAME} ${RESOURCE_FLAG} --array=1-${NUM_FILES} --time=${ALIGN_MAX_RT} --mem=${GENOME_VMEM} -D ${CODE_DIR}/index -o ${LOG_DIR}/align/${DATASET_NAME}AlignGenome_%A_%a.out -e ${LOG_DIR}/align/${DATASET_NAME}AlignGenome_%A_%a.err analysis/align.sh SLURM $TASK_DATA_FILE $ALIGN_PARDIR $DATASET_NAME $MODE ${bt_prefix}_genome genome ${bt_prefix}_genome.fa | awk '{print $4}'`
-    j_id=`sbatch -J JunctionAlign${DATASET_NAME} ${JUNCTION_RESOURCE_FLAG} --array=1-${NUM_FILES} --time=${JUNCTION_ALIGN_MAX_RT} --mem=${JUNC_VMEM} -D ${CODE_DIR}/index -o ${LOG_DIR}/align/${DATASET_NAME}AlignJunction_%A_%a.out -e ${LOG_DIR}/align/${DATASET_NAME}AlignJunction_%A_%a.err analysis/align.sh SLURM $TASK_DATA_FILE $ALIGN_PARDIR $DATASET_NAME $MODE ${bt_prefix}_junctions_scrambled junction ${bt_prefix}_junctions_scrambled.fa | awk '{print $4}'`
+    j_id=`sbatch -J JunctionAlign${DATASET_NAME} ${JUNCTION_RESOURCE_FLAG} --array=1-${NUM_FILES} --time=${JUNCTION_ALIGN_MAX_RT} --mem=${JUNC_VMEM} -D ${CODE_DIR}/index -o ${LOG_DIR}/align/${DATASET_NAME}AlignJunction_%A_%a.out -e ${LOG_DIR}/align/${DATASET_NAME}AlignJunction_%A_%a.err analysis/align.sh SLURM $TASK_DATA_FILE $ALIGN_PARDIR $DATASET_NAME $MODE ${bt_prefix}_junctions_scrambled junction ${bt_prefix}_junctions_scrambled.fa ${JUNCTION_MIDPOINT} ${OVERLAP} | awk '{print $4}'`
     r_id=`sbatch -J RiboAlign${DATASET_NAME} ${RESOURCE_FLAG} --array=1-${NUM_FILES} --time=${ALIGN_MAX_RT} --mem=${RIBO_VMEM} -D ${CODE_DIR}/index -o ${LOG_DIR}/align/${DATASET_NAME}AlignRibo_%A_%a.out -e ${LOG_DIR}/align/${DATASET_NAME}AlignRibo_%A_%a.err analysis/align.sh SLURM $TASK_DATA_FILE $ALIGN_PARDIR $DATASET_NAME $MODE ${bt_prefix}_ribosomal ribo ${bt_prefix}_ribosomal.fa | awk '{print $4}'`
-    reg_id=`sbatch -J RegAlign${DATASET_NAME} ${JUNCTION_RESOURCE_FLAG} --array=1-${NUM_FILES} --time=${JUNCTION_ALIGN_MAX_RT} --mem=${REG_VMEM} -D ${CODE_DIR}/index -o ${LOG_DIR}/align/${DATASET_NAME}AlignReg_%A_%a.out -e ${LOG_DIR}/align/${DATASET_NAME}AlignReg_%A_%a.err analysis/align.sh SLURM $TASK_DATA_FILE $ALIGN_PARDIR $DATASET_NAME $MODE ${bt_prefix}_junctions_reg reg ${bt_prefix}_junctions_reg.fa | awk '{print $4}'`  
+    reg_id=`sbatch -J RegAlign${DATASET_NAME} ${JUNCTION_RESOURCE_FLAG} --array=1-${NUM_FILES} --time=${JUNCTION_ALIGN_MAX_RT} --mem=${REG_VMEM} -D ${CODE_DIR}/index -o ${LOG_DIR}/align/${DATASET_NAME}AlignReg_%A_%a.out -e ${LOG_DIR}/align/${DATASET_NAME}AlignReg_%A_%a.err analysis/align.sh SLURM $TASK_DATA_FILE $ALIGN_PARDIR $DATASET_NAME $MODE ${bt_prefix}_junctions_reg reg ${bt_prefix}_junctions_reg.fa ${JUNCTION_MIDPOINT} ${OVERLAP} | awk '{print $4}'`  
     depend_str="--depend=afterok:${g_id}:${j_id}:${r_id}:${reg_id}"
   fi
 fi
@@ -9,6 +9,8 @@ MODE=$5
 INDEX=$6  # name of the bowtie index passed to bowtie2 call
 ALIGN_OUTDIR=$7  # name of directory under orig to output alignment files, also used in output file names
 FASTA=$8 # name of fasta file under index to use
+MIDPOINT=$9  # position of the junction in the junction sequences, only needed in stream mode
+OVERHANG=${10}  # bases a read must have on each side of the junction to overlap it, only needed in stream mode
 
 OUTFILE_BASE=${ALIGN_PARDIR}/${DATASET_NAME}/orig/${ALIGN_OUTDIR}/${SAMPLE_ID}_${ALIGN_OUTDIR}_output
 
@@ -32,6 +34,20 @@ then
   NFLAGS=${NFLAGS}" --phred64"
 fi
 
+# in stream mode, the junction alignments are filtered as Bowtie2 writes them instead of saving all of them:
+# streamAlignedReads.py writes the junction id file and a sam file with just the reads that overlap a junction.
+# With bam in the mode too, all of the alignments are also saved as ${OUTFILE_BASE}_all.bam (unsorted)
+if [[ "$MODE" = *stream* ]] && [ -n "$OVERHANG" ] && [ "$ALIGN_OUTDIR" = "junction" -o "$ALIGN_OUTDIR" = "reg" -o "$ALIGN_OUTDIR" = "denovo" ]
+then
+  STREAM_FLAGS="-s ${SAMPLE_ID} -a ${ALIGN_PARDIR}/${DATASET_NAME}/orig -i ${ALIGN_OUTDIR} -m ${MIDPOINT} -oh ${OVERHANG}"
+  if [[ "$MODE" = *bam* ]]
+  then
+    STREAM_FLAGS=${STREAM_FLAGS}" -b ${OUTFILE_BASE}_all.bam -f ${FASTA}"
+  fi
+  bowtie2 -x ${INDEX} -U ${READ_FILE} ${NFLAGS} | python ../analysis/streamAlignedReads.py ${STREAM_FLAGS}
+  exit
+fi
+
 bowtie2 -x ${INDEX} -U ${READ_FILE} -S ${OUTFILE_BASE}.sam ${NFLAGS}
   
 # save output as bam file of aligned reads and remove sam file
@@ -12,16 +12,73 @@
 # but should not be used as the naive method performs better. 
 
 import argparse
+import cProfile
+import cPickle
+import hashlib
 import os
+from multiprocessing import Pool
+import shutil
+import tempfile
+import utils_bam
 import utils_os
+import utils_readIds
+import utils_sortMerge
+import utils_stageStats
 from utils_juncReads_minimal import *
-from scipy.stats import scoreatpercentile
 from scipy.stats import poisson
-from math import ceil
+import numpy as np
+from math import ceil, floor
+from itertools import izip
 import sys
 
 JUNC_MIDPOINT = 150  
 
+# return: generator of the part of the read id that is the same between Rd1 and Rd2 for each line of an id file.
+def readIdsInFile(fileName):
+    numLines = 0
+    handle = open(fileName, "rU")
+    for line in handle:
+        numLines += 1
+        try:
+            if args.fastqIdStyle == "appended":
+                readBase = line.strip().split()[0][:-1]
+            else:
+                readBase = line.strip().split()[0]
+            yield readBase
+        except Exception as e:
+            print "error parsing ids for", line
+            print "error:", sys.exc_info()[0]
+    handle.close()
+    timing.addLines(numLines)
+
+# return: [ribo id file, genome id file] for this sample (or shard), the ids that go in ignoreIds
+def ignoreIdFiles():
+    return [inputFile("ribo"), inputFile("genome")]
+
+# ignoreIds only holds read id hashes, so an id can look ignored just because its hash is the same as an ignored id.
+# If exactIds was requested, the ids that look ignored are looked up in the ribo and genome id files to be sure.
+# return: the ids in testIds that are not in ignoreIds
+def notIgnored(testIds):
+    ignored = ignoreIds.contains(testIds)
+    
+    if args.exactIds and ignored.any():
+        hits = dict((testId, None) for testId, isIgnored in izip(testIds, ignored) if isIgnored)
+        confirmed = {}
+        for fileName in ignoreIdFiles():
+            try:
+                for readId in readIdsInFile(fileName):
+                    if readId in hits:
+                        confirmed[readId] = None
+            except IOError as e:
+                # no ribo ids, as in selectCandidateIds
+                print "Exception"
+                print e
+        ignored = [testId in confirmed for testId in testIds]
+        if args.verbose:
+            print "hash collisions with ignoreIds:", str(len(hits) - len(confirmed))
+    
+    return [testId for testId, isIgnored in izip(testIds, ignored) if not isIgnored]
+
 # look in the ribo id file for this sample, and in the associated genome id file for this
 # sample to find the read ids that aligned to the genome or the ribosome.
 # Then look in the associated regular junction overlapped read id file and select
@@ -30,87 +87,50 @@ JUNC_MIDPOINT = 150
 # overlapped id file and populate the global nonRegIds variable with these read ids
 # that did not align to the ribosome, genome, or regular junctions
 def selectCandidateIds():
-    
-    # add the suffix if we used an alternate overlap specification and output the overlapped ids to an alternate location
-    regIdDir = "reg" + args.junctionIdDirSuffix
-    juncIdDir = useJuncStr + args.junctionIdDirSuffix
-        
     idDir = "/".join([args.parentDir, "orig", "ids"])
     
     # only need to look for ids to exclude if we are not looking at previously unaligned reads
     if not args.unalignedMode:
+        riboFile, genomeFile = ignoreIdFiles()
+        
         # get ribo ids
         try:
-            handle = open("".join(["/".join([idDir, "ribo", args.sampleId]), "_ribo_output.txt"]), "rU")
-            if args.fastqIdStyle == "appended":
-                for line in handle:
-                    ignoreIds[line.strip().split()[0][:-1]] = None
-            else:
-                for line in handle:
-                    ignoreIds[line.strip().split()[0]] = None
-            handle.close()
+            for readId in readIdsInFile(riboFile):
+                ignoreIds.add(readId)
         except Exception as e:
             print "Exception"
             print e
-            print "parsing ribo ids for", line
+            print "parsing ribo ids"
         
         # load genome aligned id file for the same sample and add to ignoreIds
-        handle = open("".join(["/".join([idDir, "genome", args.sampleId]), "_genome_output.txt"]), "rU")
-            
-        if args.fastqIdStyle == "appended":
-            for line in handle:
-                try:
-                    ignoreIds[line.strip().split()[0][:-1]] = None
-                except TypeError as e:
-                    print "error parsing genome ids for", line
-                    print "Type error({0}): {1}".format(e.errno, e.strerror)
-                    print "error:", sys.exc_info()[0]
-                except:
-                    print "error parsing genome ids for", line
-                    print "error:", sys.exc_info()[0] 
-        else:
-            for line in handle:
-                ignoreIds[line.strip().split()[0]] = None       
-        handle.close()
-        
+        for readId in readIdsInFile(genomeFile):
+            ignoreIds.add(readId)
         
         # load reg-junction aligned id file for same sample and load ids not in ignoreIds
         try:
-            handle = open("".join(["/".join([idDir, regIdDir, args.sampleId]), "_reg_output.txt"]), "rU")
-            for line in handle:
-                if args.fastqIdStyle == "appended":
-                    testId = line.strip().split()[0][:-1]
-                else:
-                    testId = line.strip().split()[0]
-                    
-                if testId not in ignoreIds:
-                    regIds[testId] = None
-            handle.close()
+            for testId in notIgnored(list(readIdsInFile(inputFile("reg")))):
+                regIds[testId] = None
         except Exception as e:
             print "Exception"
             print e
-            print "parsing reg ids for", line
+            print "parsing reg ids"
     
     # load junction aligned id file (or de novo aligned id file) for same sample and load ids not in ignoreIds or regJuncIds
     try:
-        handle = open("_".join(["/".join([idDir, juncIdDir, args.sampleId]), useJuncStr, "output.txt"]), "rU")
-        for line in handle:
-            if args.fastqIdStyle == "appended":
-                testId = line.strip().split()[0][:-1]
-            else:
-                testId = line.strip().split()[0]
-                
-            if testId not in ignoreIds and testId not in regIds:
-                nonRegIds[testId] = None   
-        handle.close()
+        testIds = [testId for testId in readIdsInFile(inputFile("junction"))
+                   if testId not in regIds]
+        for testId in notIgnored(testIds):
+            nonRegIds[testId] = None
     except Exception as e:
         print "Exception"
         print e
-        print "error parsing junction ids for", line 
+        print "error parsing junction ids"
     
     # print out these ids for later debugging use
     try:
-        if args.unalignedMode:
+        if curShard is not None:
+            out_handle = open(shardFile("nonGR", curShard), "wb")  # combined with the other shards in mergeShards
+        elif args.unalignedMode:
             out_handle = open("".join(["/".join([idDir, "denovoNonGR", args.sampleId]), "_output.txt"]), "wb")
         else:
             out_handle = open("".join(["/".join([idDir, "juncNonGR", args.sampleId]), "_output.txt"]), "wb")
@@ -140,43 +160,60 @@ def getDecoyMismatchRate():
     numBases = 0
     
     for j in junctions:
-        for r in junctions[j].decoyReads:
-            aScore += r.readStat
-            numBases += r.juncRead.readLen
-            # this is average aScore, so it is aScore for read 1 or avg for read1 and read2 if mate is not None
-            if r.useMate != None:
-                aScore += r.readStat  # need to double the contribution of aScore since that was the avg of the 2 mates
-                numBases += r.useMate.readLen  # and need to add the length of the mate
+        # readStat is the avg aScore of read 1 and its mate, so it is counted for each of them (see juncStats)
+        aScore += junctions[j].stats.decoyStatSum
+        numBases += junctions[j].stats.decoyBases
         
     if numBases == 0:
         return None
     else:
         return (aScore / -6.0) / numBases  # this is the mismatch rate per base observed in the decoys
 
-# param alignedReads: array of juncReadObj that aligned to the junction 
-def getPval(alignedReads):
-    if len(alignedReads) > 0:
-        useMMrate = globalDecoyMMrate
-        
-        # total number of mismatches observed for all reads aligning to this junction, rounded to get integer which is required for poisson.cdf
-        num_mm = int(ceil(sum([x.readStat for x in alignedReads]) / -6.0))  
-        num_bases = sum([x.juncRead.readLen for x in alignedReads]) + sum([x.useMate.readLen for x in alignedReads if x.useMate != None])
-        
-        return 1 - poisson.cdf(num_mm, useMMrate*num_bases)
-    else:
-        return "-"
+PERCENTILES = np.arange(0, 101, 10)  # score quantiles written to the report for junctions with many reads
 
-def getReadScores(alignedReads):
+# p-values for the reads in the reportCategory of each junction, computed for all junctions at once
+# param juncIds: ids of the junctions
+#
+# return: list with the p-value for each junction, or "-" if the junction has no reads in its reportCategory
+def getPvals(juncIds):
+    stats = [junctions[j].stats for j in juncIds]
+    numReads = np.array([s.count(s.reportCategory) for s in stats])
+    
+    # total number of mismatches observed for all reads aligning to each junction, rounded to get integer which is required for poisson.cdf
+    num_mm = np.ceil(np.array([s.statSum for s in stats], dtype=float) / -6.0)
+    numBases = np.array([s.numBases for s in stats], dtype=float)
+    
+    # 1 - cdf rather than sf, so the p-values are exactly the ones written before
+    pvals = 1 - poisson.cdf(num_mm, globalDecoyMMrate * numBases)
+    return [pvals[i] if numReads[i] > 0 else "-" for i in xrange(len(stats))]
+
+# scores at each of PERCENTILES for many sets of score counts at once, same values as
+# scoreatpercentile(scores, per, interpolation_method='lower')
+# param scoreCountsList: list of dicts of score: number of reads with that score
+#
+# return: list with a list of the score at each percentile for each dict in scoreCountsList, or of None if the dict is empty
+def countsAtPercentiles(scoreCountsList):
     scores = []
-    if len(alignedReads) > 0:
-        a1Scores=[int(r.juncRead.aScore) for r in alignedReads]
-        if args.singleEnd:
-            scores = a1Scores
-        else:
-            a2Scores=[int(r.useMate.aScore) for r in alignedReads]
-            scores = zip(a1Scores, a2Scores)
+    counts = []
+    totals = []
+    for scoreCounts in scoreCountsList:
+        for score in sorted(scoreCounts):
+            scores.append(score)
+            counts.append(scoreCounts[score])
+        totals.append(sum(scoreCounts.values()))
+    
+    totals = np.array(totals, dtype=int)
+    readsBefore = np.cumsum(totals) - totals  # reads in the dicts before each one, so all dicts can be searched in 1 array
+    idx = np.floor(PERCENTILES / 100. * (totals[:, None] - 1)).astype(int)  # 0-based position in the sorted scores of the dict
+    pos = np.searchsorted(np.cumsum(counts), readsBefore[:, None] + idx, side="right")
     
-    return scores
+    quantiles = []
+    for i in xrange(len(totals)):
+        if totals[i] > 0:
+            quantiles.append([float(scores[k]) for k in pos[i]])
+        else:
+            quantiles.append([None] * len(PERCENTILES))
+    return quantiles
 
 # per-junction p-value is calculated assuming number of mismatches is Poisson(0.01*avg_read_length)
 # .01 is the high end of the Illumina sequencing error rate
@@ -202,62 +239,58 @@ def reportCircularReads(cutoff):
     
     report_handle.write("\tscores\n")
     
-    for j in junctions:
+    juncIds = junctions.keys()
+    if not cutoff:
+        pvals = dict(zip(juncIds, getPvals(juncIds)))  # for the circular reads of a scrambled junction or the linear reads of a reg junction
+    
+    # if we have lots of scores for a junction, just write out the quantiles
+    manyScores = [j for j in juncIds if junctions[j].stats.count(junctions[j].stats.reportCategory) > MAX_LISTED_SCORES]
+    if manyScores:
+        quantiles1 = dict(zip(manyScores, countsAtPercentiles([junctions[j].stats.scoreCounts1 for j in manyScores])))
+        if not args.singleEnd:
+            quantiles2 = dict(zip(manyScores, countsAtPercentiles([junctions[j].stats.scoreCounts2 for j in manyScores])))
+    
+    for j in juncIds:
+        stats = junctions[j].stats
+        
         # print out the junction and read id for all good reads
         # either both mates need to pass threshold, or single-end read needs to pass Rd1 threshold
         if cutoff:
-            numGood = 0  # track any linear or circular that passed the score threshold
-            for elem in junctions[j].circularReads:
-                if int(elem.juncRead.aScore) >= int(cutoff[0]) and (args.singleEnd or int(elem.useMate.aScore) >= int(cutoff[1])):
-                    numGood += 1
-                
-            for elem in junctions[j].linearReads:
-                if int(elem.juncRead.aScore) >= int(cutoff[0]) and (args.singleEnd or int(elem.useMate.aScore) >= int(cutoff[1])):
-                    numGood += 1 
+            numGood = stats.numPassing(cutoff, args.singleEnd)  # track any linear or circular that passed the score threshold
                 
             # print out global junction reads stats
-            numCandidates = len(junctions[j].circularReads) + len(junctions[j].linearReads)
+            numCandidates = stats.count("circular") + stats.count("linear")
             numBad = numCandidates - numGood
             if numCandidates > 0:
                 sig_stat = float(numBad) / numCandidates
             else:
                 sig_stat = "-"
-        elif "|reg|" not in junctions[j].id:  # if it's a circular junction
-            sig_stat = getPval(junctions[j].circularReads)  # p-value
-        elif "|reg|" in junctions[j].id:  # or it is a linear junction
-            sig_stat = getPval(junctions[j].linearReads)  # p-value
         else:
-            print "cound not get sig stat for", junctions[j].id
-            sig_stat = "NA"
+            sig_stat = pvals[j]
         
         report_handle.write(str(j) + "\t")
-        report_handle.write(str(len(junctions[j].linearReads)) + "\t")
-        report_handle.write(str(len(junctions[j].anomalyReads)) + "\t")
-        report_handle.write(str(len(junctions[j].unmappedReads)) + "\t")
-        report_handle.write(str(len(junctions[j].multimappedReads)) + "\t")
-        report_handle.write(str(len(junctions[j].circularReads)) + "\t")
-        report_handle.write(str(len(junctions[j].decoyReads)) + "\t")
+        report_handle.write(str(stats.count("linear")) + "\t")
+        report_handle.write(str(stats.count("anomaly")) + "\t")
+        report_handle.write(str(stats.count("unmapped")) + "\t")
+        report_handle.write(str(stats.count("multimapped")) + "\t")
+        report_handle.write(str(stats.count("circular")) + "\t")
+        report_handle.write(str(stats.count("decoy")) + "\t")
         report_handle.write(str(sig_stat) + "\t")
         
-        if "|reg|" not in junctions[j].id:  # if it's a circular junction
-            scores = getReadScores(junctions[j].circularReads)  
-        elif "|reg|" in junctions[j].id:  # or it is a linear junction
-            scores = getReadScores(junctions[j].linearReads)  # scores to print in report
-        else:
-            scores = []
-            
-        if len(scores) > 10:
+        if stats.count(stats.reportCategory) > MAX_LISTED_SCORES:
             # if we have lots of scores for this junction, just write out the quantiles
-            for i in xrange(0,101,10):    
+            for i in xrange(len(PERCENTILES)):
                 if args.singleEnd:
-                    report_handle.write(str(scoreatpercentile(scores, i, interpolation_method='lower')) + ",")
+                    report_handle.write(str(quantiles1[j][i]) + ",")
                 else:
-                    report_handle.write(str(scoreatpercentile([x[0] for x in scores], i, interpolation_method='lower')) + ":" +
-                                        str(scoreatpercentile([x[1] for x in scores], i, interpolation_method='lower')) + ",")
+                    report_handle.write(str(quantiles1[j][i]) + ":" + str(quantiles2[j][i]) + ",")
         else:
             # otherwise we have just a few so let's just print them all out
-            for s in scores:
-                report_handle.write(str(s) + ",")
+            for s in stats.scores:
+                if args.singleEnd:
+                    report_handle.write(str(s[0]) + ",")
+                else:
+                    report_handle.write(str(s) + ",")
         
         report_handle.write("\n")
     
@@ -267,166 +300,198 @@ def reportCircularReads(cutoff):
         
     report_handle.close()
             
-def reportAllReadIds2(cutoff):
+# return: True if the FDR or p-value of the junction marks its circular and linear reads as artifacts
+def isArtifact(junc, cutoff):
+    # if we pass a cutoff for read1 and read2 scores, then we are calculating an FDR which we want to keep low
+    # otherwise we are calculating a probability of observing these reads under the null that this really is a circle and then we want to get rid of those with low p-values
+    return junc.fdr and ((cutoff and float(junc.fdr) > args.reportFDR) or (not cutoff and float(junc.fdr) < args.reportFDR))
+
+# return: class for a circular or linear read that is not an artifact, prefix is "circ" or "linear"
+def scoreClass(elem, prefix, cutoff):
+    if cutoff:
+        if elem.juncRead.aScore >= int(cutoff[0]) and (args.singleEnd or elem.useMate.aScore >= int(cutoff[1])):
+            return prefix + "Strong"
+        else:
+            return prefix + "Failed"
+    else:
+        return prefix + "Strong"
+
+# return: line of the id file for a juncReadObj aligned to junction j
+def readIdLine(elem, j, readClass):
+    myInfo = "\t".join([str(elem.juncRead.offset), str(elem.juncRead.mapQual), str(elem.juncRead.aScore),
+                               str(elem.juncRead.numN), str(elem.juncRead.readLen), str(j), str(elem.juncRead.flag)])
+    if args.singleEnd or not elem.useMate:
+        pairInfo = "\t".join(["NA", "NA", "NA", "NA", "NA", "NA", "NA"])
+    else:
+        pairInfo = "\t".join([str(elem.useMate.offset),
+                               str(elem.useMate.mapQual), str(elem.useMate.aScore), str(elem.useMate.numN), str(elem.useMate.readLen),
+                               str(elem.useMate.refName), str(elem.useMate.flag)])
+    
+    return "\t".join([str(elem.juncRead.name), readClass, myInfo, pairInfo]) + "\n"
+
+def readIdFileName():
     if args.unalignedMode:
-        id_handle = open("_".join(["/".join([args.parentDir, args.outDirName, "ids", args.sampleId]), "denovo__output.txt"]), "wb")
+        return "_".join(["/".join([args.parentDir, args.outDirName, "ids", args.sampleId]), "denovo__output.txt"])
     else:
-        id_handle = open("_".join(["/".join([args.parentDir, args.outDirName, "ids", args.sampleId]), "_output.txt"]), "wb")
+        return "_".join(["/".join([args.parentDir, args.outDirName, "ids", args.sampleId]), "_output.txt"])
+
+def openReadIdFile():
+    id_handle = open(readIdFileName(), "wb")
         
     # use the column names used in R
     id_handle.write("\t".join(["id", "class", "pos", "qual", "aScore", "numN", "readLen", "junction", "strand",
                                "posR2", "qualR2", "aScoreR2", "numNR2", "readLenR2", "junctionR2", "strandR2"]) + "\n")
+    return id_handle
+            
+def reportAllReadIds2(cutoff):
+    id_handle = openReadIdFile()
     
     for j in junctions:
         # print circular read ids
         for elem in junctions[j].circularReads:
-            # if we pass a cutoff for read1 and read2 scores, then we are calculating an FDR which we want to keep low
-            # otherwise we are calculating a probability of observing these reads under the null that this really is a circle and then we want to get rid of those with low p-values
-            if junctions[j].fdr and ((cutoff and float(junctions[j].fdr) > args.reportFDR)
-                or (not cutoff and float(junctions[j].fdr) < args.reportFDR)):
+            if isArtifact(junctions[j], cutoff):
                 readClass = "circArtifact"
-            elif cutoff:
-                if int(elem.juncRead.aScore) >= int(cutoff[0]) and (args.singleEnd or int(elem.useMate.aScore) >= int(cutoff[1])):
-                    readClass = "circStrong"
-                else:
-                    readClass = "circFailed"
             else:
-                readClass = "circStrong"
-                
-            myInfo = "\t".join([str(elem.juncRead.offset), str(elem.juncRead.mapQual), str(elem.juncRead.aScore),
-                                       str(elem.juncRead.numN), str(elem.juncRead.readLen), str(j), str(elem.juncRead.flag)])
-            if args.singleEnd:
-                pairInfo = "\t".join(["NA", "NA", "NA", "NA", "NA", "NA", "NA"])
-            else:
-                pairInfo = "\t".join([str(elem.useMate.offset),
-                                       str(elem.useMate.mapQual), str(elem.useMate.aScore), str(elem.useMate.numN), str(elem.useMate.readLen),
-                                       str(elem.useMate.refName), str(elem.useMate.flag)])
-            
-            id_handle.write("\t".join([str(elem.juncRead.name), readClass, myInfo, pairInfo]) + "\n")
+                readClass = scoreClass(elem, "circ", cutoff)
+            id_handle.write(readIdLine(elem, j, readClass))
         
         # print linear read ids
         for elem in junctions[j].linearReads:
-            if junctions[j].fdr and ((cutoff and float(junctions[j].fdr) > args.reportFDR)
-                or (not cutoff and float(junctions[j].fdr) < args.reportFDR)):
+            if isArtifact(junctions[j], cutoff):
                 readClass = "linearArtifact"
-            elif cutoff:
-                if int(elem.juncRead.aScore) >= int(globalCutOff[0]) and (args.singleEnd or int(elem.useMate.aScore) >= int(globalCutOff[1])):
-                    readClass = "linearStrong"
-                else:
-                    readClass = "linearFailed"
-            else:
-                readClass = "linearStrong"
-            
-            myInfo = "\t".join([str(elem.juncRead.offset), str(elem.juncRead.mapQual), str(elem.juncRead.aScore),
-                                       str(elem.juncRead.numN), str(elem.juncRead.readLen), str(j), str(elem.juncRead.flag)])
-            if args.singleEnd:
-                pairInfo = "\t".join(["NA", "NA", "NA", "NA", "NA", "NA", "NA"])
             else:
-                pairInfo = "\t".join([str(elem.useMate.offset),
-                                       str(elem.useMate.mapQual), str(elem.useMate.aScore), str(elem.useMate.numN), str(elem.useMate.readLen),
-                                       str(elem.useMate.refName), str(elem.useMate.flag)])
-            
-            id_handle.write("\t".join([str(elem.juncRead.name), readClass, myInfo, pairInfo]) + "\n")
+                readClass = scoreClass(elem, "linear", cutoff)
+            id_handle.write(readIdLine(elem, j, readClass))
             
         # print multimapped read ids
         for elem in junctions[j].multimappedReads:
-            myInfo = "\t".join([str(elem.juncRead.offset), str(elem.juncRead.mapQual), str(elem.juncRead.aScore),
-                                       str(elem.juncRead.numN), str(elem.juncRead.readLen), str(j), str(elem.juncRead.flag)])
-            if args.singleEnd or not elem.useMate:
-                pairInfo = "\t".join(["NA", "NA", "NA", "NA", "NA", "NA", "NA"])
-            else:
-                pairInfo = "\t".join([str(elem.useMate.offset),
-                                       str(elem.useMate.mapQual), str(elem.useMate.aScore), str(elem.useMate.numN), str(elem.useMate.readLen),
-                                       str(elem.useMate.refName), str(elem.useMate.flag)])
+            id_handle.write(readIdLine(elem, j, "multimapped"))
             
-            id_handle.write("\t".join([str(elem.juncRead.name), "multimapped", myInfo, pairInfo]) + "\n")
-            
-        # print decoy read ids
+        # print decoy, anomaly, and unmapped read ids
         if not args.singleEnd:
             for elem in junctions[j].decoyReads:
-                myInfo = "\t".join([str(elem.juncRead.offset), str(elem.juncRead.mapQual), str(elem.juncRead.aScore),
-                                       str(elem.juncRead.numN), str(elem.juncRead.readLen), str(j), str(elem.juncRead.flag)])
-
-                pairInfo = "\t".join([str(elem.useMate.offset),
-                                       str(elem.useMate.mapQual), str(elem.useMate.aScore), str(elem.useMate.numN), str(elem.useMate.readLen),
-                                       str(elem.useMate.refName), str(elem.useMate.flag)])
-        
-                id_handle.write("\t".join([str(elem.juncRead.name), "decoy", myInfo, pairInfo]) + "\n")
-                
-            # print anomaly read ids
+                id_handle.write(readIdLine(elem, j, "decoy"))
             for elem in junctions[j].anomalyReads:
-                myInfo = "\t".join([str(elem.juncRead.offset), str(elem.juncRead.mapQual), str(elem.juncRead.aScore),
-                                       str(elem.juncRead.numN), str(elem.juncRead.readLen), str(j), str(elem.juncRead.flag)])
-
-                pairInfo = "\t".join([str(elem.useMate.offset),
-                                       str(elem.useMate.mapQual), str(elem.useMate.aScore), str(elem.useMate.numN), str(elem.useMate.readLen),
-                                       str(elem.useMate.refName), str(elem.useMate.flag)])
-        
-                id_handle.write("\t".join([str(elem.juncRead.name), "anomaly", myInfo, pairInfo]) + "\n")
-                
-            # print unmapped read ids
+                id_handle.write(readIdLine(elem, j, "anomaly"))
             for elem in junctions[j].unmappedReads:
-                myInfo = "\t".join([str(elem.juncRead.offset), str(elem.juncRead.mapQual), str(elem.juncRead.aScore),
-                                       str(elem.juncRead.numN), str(elem.juncRead.readLen), str(j), str(elem.juncRead.flag)])
-                pairInfo = "\t".join(["NA", "NA", "NA", "NA", "NA", "NA", "NA"])
-                id_handle.write("\t".join([str(elem.juncRead.name), "unmapped", myInfo, pairInfo]) + "\n")
+                id_handle.write(readIdLine(elem, j, "unmapped"))
             
     id_handle.close()
 
-# loop through sam file, either creating a juncReadObj & juncObj (if this is read1s)
-# or updating mateGenome, mateJunction, or mateRegJunction if this is an alignment file from read2
-# to genome, all junctions, or regular junctions respectively.
+# loop through sam file for read1s, creating a juncReadObj & juncObj for each read.
 # The sam file may contain both aligned and unaligned reads. Only aligned reads will actually be stored.
-# param readType: "r1rj" is Rd1 to regular junction index, "r1j" is Rd1 to all junction,
-#                 "gMate" is Rd2 to genome, "jMate" is Rd2 to all junction, "rjMate" is Rd2 to regular junction
+# If there is no sam file, the bam file with the same name is read directly.
+# param readType: "r1rj" is Rd1 to regular junction index, "r1j" is Rd1 to all junction
 def parseSam(samFile, readType):
     if args.verbose:
         print "samFile:" + samFile
         print "readType:" + readType
         
-    handle = open(samFile, "rU")
+    numLines = 0
+    handle = utils_bam.openAlignments(samFile, args.bamThreads)
 
     for line in handle:
+        numLines += 1
         if not line.startswith("@"): # ignore header lines
+            # most reads in a sam file are not stored, so check the read id before decoding the rest of the line
+            readBase = samBaseName(line, args.fastqIdStyle)
+            if readType == "r1j":
+                wanted = readBase in nonRegIds and readBase not in juncReads
+            else:
+                wanted = readBase in regIds and readBase not in juncReads
+            if not wanted:
+                continue
+            
             try:
-                read = newReadObj(line.strip().split(), args.fastqIdStyle)
+                read = newReadObj(line, args.fastqIdStyle)
                 # only need to store info if the read actually aligned 
-                if read.aScore:
+                if read.aScore is not None:
                     readBase = read.baseName  # part of the read that is the same between Rd1 and Rd2
                     # read1 that didn't map to genome, or ribo and then mapped to reg junctions or to all junctions and not to reg junction
                     # since in unaligned mode we report all reads, we want to only count the first time in the file we see it (output order is highest alignment score first)
                     if ((readType == "r1j" and readBase in nonRegIds and readBase not in juncReads) or
                         (readType == "r1rj" and readBase in regIds and readBase not in juncReads)):
                         curJuncReadObj = juncReadObj(read)  # create object for this read (mate info empty for now) to put in junction and juncReads dicts
-                        juncReads[readBase] = curJuncReadObj  # will look up this obj later to populate mates
                             
                         # this is first read aligning to this junction, need to create juncObj first
                         if not read.refName in junctions:
-                            curJuncObj = juncObj(read.refName)
+                            curJuncObj = juncObj(read.refName, not args.streamClassify)
                             junctions[read.refName] = curJuncObj
-                        # initially just append all reads to unknownReads, we will later remove some and move to circularReads, decoyReads, or unmappedReads
-                        junctions[read.refName].unknownReads.append(curJuncReadObj)
-                    elif readBase in juncReads: # this is a mate so we only care about it if it's Rd1 was stored
-                        if readType == "gMate" and not juncReads[readBase].mateGenomic:  # only if we haven't already found the primary genomic alignment
-                            juncReads[readBase].mateGenomic = read
+                        
+                        if not args.streamClassify:
+                            juncReads[readBase] = curJuncReadObj  # will look up this obj later to populate mates
+                            # initially just append all reads to unknownReads, we will later remove some and move to circularReads, decoyReads, or unmappedReads
+                            junctions[read.refName].unknownReads.append(curJuncReadObj)
+                        elif args.singleEnd:
+                            # there are no mates to wait for, so the read is classified now and not kept
+                            juncReads[readBase] = None  # still need to know this read was seen
+                            classifyRead(curJuncReadObj, idTmpFile, id_handle)
                         else:
-                            # this is a junction mate, need to check offset 
-                            if (int(read.offset) >= (JUNC_MIDPOINT - int(read.readLen) + args.overhang + 1) and
-                                int(read.offset) <= (JUNC_MIDPOINT - args.overhang + 1)):
-                                # if it overlaps the junction, add it to the appropriate mate field
-                                if readType == "jMate" and not juncReads[readBase].mateJunction:  # only if we haven't already found the primary junction alignment
-                                    juncReads[readBase].mateJunction = read
-                                elif readType == "rjMate" and not juncReads[readBase].mateRegJunction:  # only if we haven't already found the primary reg junction alignment
-                                    juncReads[readBase].mateRegJunction = read
-                                elif readType == "dMate" and not juncReads[readBase].mateDenovoJunction:  # only if we haven't already found the primary denovo junction alignment
-                                    juncReads[readBase].mateDenovoJunction = read
+                            juncReads[readBase] = curJuncReadObj  # classified once its mates are found, in classifyMatedReads
             except Exception as e:
                 print "Exception"
                 print e
                 print "parsing sam output for", line
                 
     handle.close()
+    timing.addLines(numLines)
     
+# loop through a sam file from read2 to genome, all junctions, regular junctions, or denovo junctions to find
+# the mates of the Rd1 reads in juncReads. Only juncReads is read, so this can run in a worker process.
+# If there is no sam file, the bam file with the same name is read directly.
+# param readType: "gMate" is Rd2 to genome, "jMate" is Rd2 to all junction, "rjMate" is Rd2 to regular junction,
+#                 "dMate" is Rd2 to denovo junction
+#
+# return: (dict of base read id: readObj for the first aligned Rd2 read in the file (the primary alignment),
+#         number of lines in the file). Junction alignments only count if they overlap the junction.
+def parseMateSam(samFile, readType):
+    if args.verbose:
+        print "samFile:" + samFile
+        print "readType:" + readType
+        
+    mates = {}
+    numLines = 0
+    handle = utils_bam.openAlignments(samFile, args.bamThreads)
+
+    for line in handle:
+        numLines += 1
+        if not line.startswith("@"): # ignore header lines
+            # we only care about a mate if its Rd1 was stored and we haven't already found its primary alignment
+            readBase = samBaseName(line, args.fastqIdStyle)
+            if readBase not in juncReads or readBase in mates:
+                continue
+            
+            try:
+                read = newReadObj(line, args.fastqIdStyle)
+                # only need to store info if the read actually aligned 
+                if read.aScore is not None:
+                    if readType == "gMate":
+                        mates[read.baseName] = read
+                    # this is a junction mate, need to check offset 
+                    elif (read.offset >= (JUNC_MIDPOINT - read.readLen + args.overhang + 1) and
+                          read.offset <= (JUNC_MIDPOINT - args.overhang + 1)):
+                        mates[read.baseName] = read
+            except Exception as e:
+                print "Exception"
+                print e
+                print "parsing sam output for", line
+                
+    handle.close()
+    return mates, numLines
+
+# update mateGenomic, mateJunction, mateRegJunction, or mateDenovoJunction of each juncReadObj
+# param mates: dict of mates returned by parseMateSam for readType
+def addMates(mates, readType):
+    for readBase, read in mates.iteritems():
+        if readType == "gMate":
+            juncReads[readBase].mateGenomic = read
+        elif readType == "jMate":
+            juncReads[readBase].mateJunction = read
+        elif readType == "rjMate":
+            juncReads[readBase].mateRegJunction = read
+        elif readType == "dMate":
+            juncReads[readBase].mateDenovoJunction = read
+
 def updateReads():
     
     # for each junction
@@ -435,27 +500,444 @@ def updateReads():
         while len(junctions[j].unknownReads) > 0:
             r = junctions[j].unknownReads.pop()
             r.updateInfo(junctions[j], args.singleEnd, args.unalignedMode) # figure out which mate is best, whether this means it is decoy or not
-            
-            # assign read to correct bucket
-            if r.readType == "c":
-                junctions[j].circularReads.append(r)
-            elif r.readType == "d":
-                junctions[j].decoyReads.append(r)
-            elif r.readType == "l":
-                junctions[j].linearReads.append(r)
-            elif r.readType == "a":
-                junctions[j].anomalyReads.append(r)
-            elif r.readType == "i":
-                # we are ignoring this read because Rd1 aligned to reg and Rd2 aligned to scrambled
-                pass
-            else:
-                if r.mateGenomic or r.mateJunction or r.mateRegJunction or r.mateDenovoJunction:
-                    # the mate did map, but had very poor mapping quality so we are discarding it
-                    junctions[j].multimappedReads.append(r)
-                else:
-                    # either mate was not in the file or did not align to either genome or junction index
-                    junctions[j].unmappedReads.append(r)
+            junctions[j].addRead(r, True)  # assign read to correct bucket
                     
+# assign a read whose alignments have all been found to a category of its junction, counting it in the junction stats
+# instead of keeping it, and write its line for the id file. The class of circular and linear reads depends on the FDR
+# of the junction, which is only known once all reads are counted, so their lines go to idTmpFile
+# ("junction id<tab>category<tab>id file line", see reportSortedReadIds). All other lines go straight to id_handle.
+def classifyRead(r, idTmpFile, id_handle):
+    j = r.juncRead.refName
+    
+    # this is first read aligning to this junction, need to create juncObj first
+    if not j in junctions:
+        junctions[j] = juncObj(j, False)
+    junc = junctions[j]
+    
+    r.updateInfo(junc, args.singleEnd, args.unalignedMode)
+    category = junc.addRead(r, False)
+    
+    if category == "circular":
+        idTmpFile.write("\t".join([j, category, readIdLine(r, j, scoreClass(r, "circ", globalCutOff))]))
+    elif category == "linear":
+        idTmpFile.write("\t".join([j, category, readIdLine(r, j, scoreClass(r, "linear", globalCutOff))]))
+    elif category == "multimapped" or (category and not args.singleEnd):
+        id_handle.write(readIdLine(r, j, category))
+
+# classify the reads in juncReads once all of the mate files have been parsed, each read is released as soon as it is counted
+def classifyMatedReads(idTmpFile, id_handle):
+    while juncReads:
+        readBase, r = juncReads.popitem()
+        if r:  # single-end reads were already classified in parseSam
+            classifyRead(r, idTmpFile, id_handle)
+
+# return: list of (name, file) for each id and sam file the reads are loaded from, in the order sortMergeReads merges them
+def inputFiles():
+    # add the suffix if we used an alternate overlap specification and output the overlapped ids to an alternate location
+    regIdDir = "reg" + args.junctionIdDirSuffix
+    juncIdDir = useJuncStr + args.junctionIdDirSuffix
+    idDir = "/".join([args.parentDir, "orig", "ids"])
+    
+    # Rd1 files do not need to be checked for being ribo or genome aligned in unalignedMode, and there are only Rd2 files
+    # for paired end data.
+    inputs = []
+    if not args.unalignedMode:
+        inputs.append(("ribo", "".join(["/".join([idDir, "ribo", args.sampleId]), "_ribo_output.txt"])))
+        inputs.append(("genome", "".join(["/".join([idDir, "genome", args.sampleId]), "_genome_output.txt"])))
+        inputs.append(("reg", "".join(["/".join([idDir, regIdDir, args.sampleId]), "_reg_output.txt"])))
+    inputs.append(("junction", "_".join(["/".join([idDir, juncIdDir, args.sampleId]), useJuncStr, "output.txt"])))
+    if not args.unalignedMode:
+        inputs.append(("r1rj", "".join(["/".join([args.parentDir, "orig", "reg", args.sampleId]), "_reg_output.sam"])))
+    inputs.append(("r1j", "_".join(["/".join([args.parentDir, "orig", useJuncStr, args.sampleId]), useJuncStr, "output.sam"])))
+    if not args.singleEnd:
+        if args.unalignedMode:
+            alignedMateId = args.sampleId[10:-1] + "2"  # trim off unaligned_ from start of id, change 1 to 2
+        else:
+            alignedMateId = args.sampleId[:-1] + "2"
+        inputs.append(("gMate", "".join(["/".join([args.parentDir, "orig", "genome", alignedMateId]), "_genome_output.sam"])))
+        inputs.append(("rjMate", "".join(["/".join([args.parentDir, "orig", "reg", alignedMateId]), "_reg_output.sam"])))
+        inputs.append(("jMate", "".join(["/".join([args.parentDir, "orig", "junction", alignedMateId]), "_junction_output.sam"])))
+        if args.unalignedMode:
+            inputs.append(("dMate", "".join(["/".join([args.parentDir, "orig", "denovo", args.sampleId[:-1]]), "2_denovo_output.sam"])))
+    
+    return inputs
+
+# return: path of the id or sam file with the name given in inputFiles. In a shard (see runShard), this is the part of
+#         the file with the reads of the shard, written by partitionInputs.
+def inputFile(name):
+    if curShard is not None:
+        return shardFile(name, curShard)
+    return dict(inputFiles())[name]
+
+# return: the first aligned read from a list of sam lines for the same read, or None
+# param junctionMate: True to only accept alignments that overlap the junction, as parseSam does for Rd2 junction alignments
+def firstAlignedRead(lines, junctionMate):
+    for line in lines:
+        try:
+            read = newReadObj(line, args.fastqIdStyle)
+            if read.aScore is not None and (not junctionMate or
+                                            (read.offset >= (JUNC_MIDPOINT - read.readLen + args.overhang + 1) and
+                                             read.offset <= (JUNC_MIDPOINT - args.overhang + 1))):
+                return read
+        except Exception as e:
+            print "Exception"
+            print e
+            print "parsing sam output for", line
+    return None
+
+# Sort-merge alternative to selectCandidateIds, parseSam, and updateReads that does not keep the read ids or reads in memory.
+# The id files and sam files are sorted by read id and merged, so all records for a read are seen together. Each read
+# is then assigned to a bucket and counted in the stats of its junction right away, and its line for the id file is
+# written out (see classifyRead).
+# param tmpDir: directory for the sorted files
+# param idTmpFile: file to write "junction id<tab>category<tab>id file line" to for each circular and linear read
+# param id_handle: id file, from openReadIdFile
+def sortMergeReads(tmpDir, idTmpFile, id_handle):
+    inputs = inputFiles()
+    idDir = "/".join([args.parentDir, "orig", "ids"])
+    
+    names = [name for name, fileName in inputs]
+    sortedFiles = []
+    for name, fileName in inputs:
+        if args.verbose:
+            print "sorting", fileName
+        sortedFiles.append("/".join([tmpDir, name + ".txt"]))
+        try:
+            utils_sortMerge.sortByReadBase(fileName, sortedFiles[-1], args.fastqIdStyle, tmpDir, args.bamThreads)
+        except IOError as e:
+            # selectCandidateIds also carries on without these id files
+            if name not in ["ribo", "reg", "junction"]:
+                raise
+            print "Exception"
+            print e
+            print "parsing", name, "ids"
+            open(sortedFiles[-1], "wb").close()
+    
+    # ids are printed out for later debugging use, as in selectCandidateIds
+    if args.unalignedMode:
+        out_handle = open("".join(["/".join([idDir, "denovoNonGR", args.sampleId]), "_output.txt"]), "wb")
+    else:
+        out_handle = open("".join(["/".join([idDir, "juncNonGR", args.sampleId]), "_output.txt"]), "wb")
+    
+    for readBase, groups in utils_sortMerge.mergeByReadBase(sortedFiles):
+        records = dict(zip(names, groups))
+        
+        # only reads that did not align to the ribosome or genome, and aligned to reg junctions, or to all junctions and not reg junctions
+        if records.get("ribo") or records.get("genome"):
+            continue
+        if records.get("reg"):
+            read = firstAlignedRead(records["r1rj"], False)
+        elif records["junction"]:
+            read = firstAlignedRead(records["r1j"], False)
+        else:
+            continue
+        out_handle.write(readBase)
+        out_handle.write("\n")
+        
+        if not read:
+            continue
+        
+        r = juncReadObj(read)
+        if not args.singleEnd:
+            r.mateGenomic = firstAlignedRead(records["gMate"], False)
+            r.mateRegJunction = firstAlignedRead(records["rjMate"], True)
+            r.mateJunction = firstAlignedRead(records["jMate"], True)
+            if args.unalignedMode:
+                r.mateDenovoJunction = firstAlignedRead(records["dMate"], True)
+        
+        classifyRead(r, idTmpFile, id_handle)
+        
+    out_handle.close()
+
+# select the candidate reads, load their Rd1 and Rd2 alignments, and assign them to categories of their junctions.
+# In streamClassify mode the reads are only counted in the stats of their junction, and their id file lines are
+# written to idTmpFile and id_handle as they are assigned (see classifyRead).
+def loadReads():
+    global ignoreIds, regIds, nonRegIds
+    
+    # populate the ignoreIds, regIds, nonRegIds for this file and also print out regIds and nonRegIds to juncNonGR file
+    ignoreIds = utils_readIds.readIdSet() # ribo and genome aligned, hashed since this is most reads in the sample
+    regIds = {} # regular junction overlapped and not ribo or genome aligned (aligned to reg-only index)
+    nonRegIds = {} # junction overlapped and not ribo or genome aligned or regular-junction aligned
+
+    timing.start("selectCandidateIds")
+    selectCandidateIds()
+    timing.stop(ignoreIds=len(ignoreIds), regIds=len(regIds), nonRegIds=len(nonRegIds))
+
+    if args.verbose:
+        print "ignoreIds (aligned to genome):", str(len(ignoreIds))
+        print "linearIds:", str(len(regIds))
+        print "scrambledIds:", str(len(nonRegIds))
+
+    if not args.unalignedMode:
+        # make a pass through the sam file for read 1 to regular junctions to populate dict with juncReadObjs (key is portion of read id shared by Rd1 and Rd2)
+        #     and at the same time create entry in junction dictionary and add this read obj to the junction list of reads
+        timing.start("parseSam r1rj")
+        parseSam(inputFile("r1rj"), "r1rj")
+        timing.stop(juncReads=len(juncReads), junctions=len(junctions))
+
+    # make a pass through the sam for read 1 to all junctions file to populate dict with juncReadObjs (key is portion of read id shared by Rd1 and Rd2)
+    #     and at the same time create entry in junction dictionary and add this read obj to the junction list of reads
+    timing.start("parseSam r1j")
+    parseSam(inputFile("r1j"), "r1j")
+    timing.stop(juncReads=len(juncReads), junctions=len(junctions))
+
+    # get mate alignment data if this is from paired end sequencing
+    if not args.singleEnd:
+        # Rd2 to genome, regular junction, junction, and (in unaligned mode) de novo sam files to update mateGenomic,
+        #     mateRegJunction, mateJunction, and mateDenovoJunction in each juncReadObj
+        mateTypes = ["gMate", "rjMate", "jMate"]
+        if args.unalignedMode:
+            mateTypes.append("dMate")
+        mateFiles = [(inputFile(readType), readType) for readType in mateTypes]
+
+        if args.workers > 1 and curShard is None:
+            # the files are independent, so scan them at the same time. Workers are forked after juncReads is
+            # populated so they all share it, and send back only the mates they found. A shard is already
+            # running in a worker process, which cannot start its own.
+            timing.start("parseMateSam")
+            pool = Pool(min(args.workers, len(mateFiles)))
+            results = [pool.apply_async(parseMateSam, mateFile) for mateFile in mateFiles]
+            pool.close()
+            for (samFile, readType), result in zip(mateFiles, results):
+                mates, numLines = result.get()
+                timing.addLines(numLines)
+                addMates(mates, readType)
+            pool.join()
+            timing.stop()
+        else:
+            for samFile, readType in mateFiles:
+                timing.start("parseMateSam " + readType)
+                mates, numLines = parseMateSam(samFile, readType)
+                timing.addLines(numLines)
+                addMates(mates, readType)
+                timing.stop(mates=len(mates))
+
+    if args.verbose:
+        print "sample id:", str(args.sampleId)
+        print "single end?", str(args.singleEnd)
+        print "num junctions with aligned reads:", str(len(junctions))
+        print "num reads:", str(len(juncReads))
+
+    if args.streamClassify:
+        timing.start("classifyMatedReads")
+        classifyMatedReads(idTmpFile, id_handle)
+    else:
+        timing.start("updateReads")
+        updateReads()  # assign reads to categories based on alignment data (circular, linear, decoy, etc)
+    timing.stop(junctions=len(junctions))
+
+# return: path of a file written for a shard in tmpDir
+# param name: kind of file, "readIds" and "ids" for the id file lines (see classifyRead), "nonGR" for the candidate ids,
+#             or the name of an input file in inputFiles for the part of it with the reads of the shard
+def shardFile(name, shard):
+    return "/".join([tmpDir, name + "_" + str(shard) + ".txt"])
+
+# split one input file into the files of the shards, see partitionInputs. Can run in a worker process.
+# return: number of lines read from the input file
+def partitionInput(name, fileName):
+    try:
+        return utils_sortMerge.partitionByReadBase(fileName, [shardFile(name, shard) for shard in xrange(args.numShards)],
+                                                   args.fastqIdStyle, args.bamThreads)
+    except IOError as e:
+        # no shard files are written, so each shard reports the missing file when it is read, as without shards
+        if args.verbose:
+            print "not partitioning", fileName
+            print e
+        return 0
+
+# read each id and sam file in inputFiles once and split it into the files of the shards by the hash of the base read
+# id, so each shard only reads the lines of its own reads
+def partitionInputs():
+    inputs = inputFiles()
+    if args.workers > 1:
+        # the files are independent, so split them at the same time
+        pool = Pool(min(args.workers, len(inputs)))
+        results = [pool.apply_async(partitionInput, (name, fileName)) for name, fileName in inputs]
+        pool.close()
+        for result in results:
+            timing.addLines(result.get())
+        pool.join()
+    else:
+        for name, fileName in inputs:
+            timing.addLines(partitionInput(name, fileName))
+
+# load and classify the reads whose base read id hashes to shard from the files of the shard written by
+# partitionInputs, run in a worker process. Only the ids and reads in the shard are held in memory, and the id file
+# lines are written to the files of the shard.
+#
+# return: (dict of junction id: juncStats for the reads in the shard, stages timed in the shard)
+def runShard(shard):
+    global curShard, juncReads, junctions, idTmpFile, id_handle, timing
+    
+    curShard = shard
+    timing = utils_stageStats.stageStats()
+    juncReads = {}
+    junctions = {}
+    idTmpFile = open(shardFile("readIds", shard), "wb")
+    id_handle = open(shardFile("ids", shard), "wb")
+    
+    loadReads()
+    
+    idTmpFile.close()
+    id_handle.close()
+    for name, fileName in inputFiles():
+        if os.path.exists(shardFile(name, shard)):
+            os.remove(shardFile(name, shard))  # no longer needed, free the disk space
+    return dict((j, junctions[j].stats) for j in junctions), timing.stages
+
+# add the junction stats of a shard returned by runShard to junctions
+def mergeShardStats(shardStats):
+    for j, stats in shardStats.iteritems():
+        if not j in junctions:
+            junctions[j] = juncObj(j, False)
+        junctions[j].stats.merge(stats)
+
+# combine the candidate ids of the shards into the juncNonGR (or denovoNonGR) id file, and add the id file lines
+# written straight to the id file of each shard to id_handle. The circular and linear read lines of the shards
+# are added by reportSortedReadIds.
+def mergeShards(id_handle):
+    idDir = "/".join([args.parentDir, "orig", "ids"])
+    if args.unalignedMode:
+        out_handle = open("".join(["/".join([idDir, "denovoNonGR", args.sampleId]), "_output.txt"]), "wb")
+    else:
+        out_handle = open("".join(["/".join([idDir, "juncNonGR", args.sampleId]), "_output.txt"]), "wb")
+    
+    for shard in xrange(args.numShards):
+        for fileName, handle in [(shardFile("nonGR", shard), out_handle), (shardFile("ids", shard), id_handle)]:
+            shard_handle = open(fileName, "rb")
+            shutil.copyfileobj(shard_handle, handle)
+            shard_handle.close()
+    
+    out_handle.close()
+
+# finish the id file with the circular and linear read lines written to idTmpFile by classifyRead, now that the FDR
+# of each junction is known
+def reportSortedReadIds(cutoff, idTmpFileName, id_handle):
+    tmp_handle = open(idTmpFileName, "rU")
+    for line in tmp_handle:
+        j, category, line = line.split("\t", 2)
+        if isArtifact(junctions[j], cutoff):
+            name, readClass, info = line.split("\t", 2)
+            if category == "circular":
+                line = "\t".join([name, "circArtifact", info])
+            else:
+                line = "\t".join([name, "linearArtifact", info])
+        id_handle.write(line)
+    tmp_handle.close()
+
+# return: path of a file written next to the report, like the stage stats
+# param name: end of the file name
+def reportSidecarFileName(name):
+    if args.unalignedMode:
+        return "_".join(["/".join([args.parentDir, args.outDirName, "reports", args.sampleId]), "denovo", name])
+    else:
+        return "_".join(["/".join([args.parentDir, args.outDirName, "reports", args.sampleId]), name])
+
+# A checkpoint lets a run that failed after the reads were loaded and classified, or a rerun with a different reportFDR
+# or seqErrorRate, redo only the reports. It is saved to checkpointDir as junctions.pkl, with the key of the inputs
+# and the junctions, and in sortMerge and streamClassify mode the id file lines written so far.
+
+CHECKPOINT_SAMPLE_BYTES = 1024 * 1024  # bytes read from the start and the end of each input for the checkpoint key
+
+# return: directory the checkpoint of this sample is saved in
+def checkpointDir():
+    return "/".join([args.parentDir, args.outDirName, "checkpoints", args.sampleId])
+
+# return: md5 of the size and the first and last CHECKPOINT_SAMPLE_BYTES of a file, so a file that was rewritten
+#         with the same size and mtime (e.g. copied with its timestamps kept) does not look like the same input
+def fileFingerprint(fileName):
+    fingerprint = hashlib.md5()
+    size = os.path.getsize(fileName)
+    fingerprint.update(str(size))
+    
+    handle = open(fileName, "rb")
+    fingerprint.update(handle.read(CHECKPOINT_SAMPLE_BYTES))
+    if size > CHECKPOINT_SAMPLE_BYTES:
+        handle.seek(max(CHECKPOINT_SAMPLE_BYTES, size - CHECKPOINT_SAMPLE_BYTES))
+        fingerprint.update(handle.read(CHECKPOINT_SAMPLE_BYTES))
+    handle.close()
+    
+    return fingerprint.hexdigest()
+
+# return: hash of the options the read categories depend on and the path, size, mtime, and fingerprint of each
+#         input file, so a checkpoint is only used for the same inputs
+def getCheckpointKey():
+    key = hashlib.md5()
+    key.update(repr([args.fastqIdStyle, args.overhang, args.junctionIdDirSuffix, args.singleEnd, args.unalignedMode,
+                     args.aScore1, args.aScore2, args.exactIds, args.sortMerge or args.streamClassify]))
+    
+    for fileName in [f for name, f in inputFiles()] + args.juncMetadata:
+        bamFile = os.path.splitext(fileName)[0] + ".bam"
+        if not os.path.exists(fileName) and os.path.exists(bamFile):
+            fileName = bamFile  # read instead of the sam file, see utils_bam.openAlignments
+        if os.path.exists(fileName):
+            info = os.stat(fileName)
+            key.update(repr([fileName, info.st_size, info.st_mtime, fileFingerprint(fileName)]))
+        else:
+            key.update(repr([fileName, None]))
+    
+    return key.hexdigest()
+
+# return: True if a checkpoint was saved for inputs with this key
+def checkpointMatches(key):
+    try:
+        handle = open("/".join([checkpointDir(), "junctions.pkl"]), "rb")
+        savedKey = cPickle.load(handle)
+        handle.close()
+        return savedKey == key
+    except (IOError, EOFError, cPickle.UnpicklingError):
+        return False
+
+# save junctions, and the id file lines written so far, to checkpointDir. junctions.pkl is written last, under a
+# temporary name until it is complete, so a checkpoint that was not completely saved is never loaded.
+# param idTmpFileNames: files with the circular and linear read lines (see reportSortedReadIds), moved to checkpointDir
+# param id_handle: id file with the other lines, None if the whole id file is written at the end by reportAllReadIds2
+#
+# return: the new paths of the files in idTmpFileNames
+def saveCheckpoint(key, idTmpFileNames, id_handle):
+    ckDir = checkpointDir()
+    utils_os.createDirectory(ckDir)
+    ckFile = "/".join([ckDir, "junctions.pkl"])
+    if os.path.exists(ckFile):
+        os.remove(ckFile)  # the old checkpoint is no longer complete once its files are replaced
+    
+    if id_handle:
+        id_handle.flush()
+        shutil.copyfile(id_handle.name, "/".join([ckDir, "ids.txt"]))
+    savedNames = []
+    for i, fileName in enumerate(idTmpFileNames):
+        savedNames.append("/".join([ckDir, "readIds_" + str(i) + ".txt"]))
+        shutil.move(fileName, savedNames[-1])
+    
+    handle = open(ckFile + ".tmp", "wb")
+    cPickle.dump(key, handle, cPickle.HIGHEST_PROTOCOL)
+    cPickle.dump(len(savedNames), handle, cPickle.HIGHEST_PROTOCOL)
+    cPickle.dump(junctions, handle, cPickle.HIGHEST_PROTOCOL)
+    handle.close()
+    os.rename(ckFile + ".tmp", ckFile)
+    
+    return savedNames
+
+# return: (junctions, files with the circular and linear read lines, id file) from the checkpoint. In sortMerge and
+#         streamClassify mode the id file is started again with the lines that were saved, otherwise it is None.
+def loadCheckpoint():
+    ckDir = checkpointDir()
+    handle = open("/".join([ckDir, "junctions.pkl"]), "rb")
+    cPickle.load(handle)  # key, already checked by checkpointMatches
+    numIdTmpFiles = cPickle.load(handle)
+    savedJunctions = cPickle.load(handle)
+    handle.close()
+    
+    if args.sortMerge or args.streamClassify:
+        id_handle = open(readIdFileName(), "wb")
+        saved_handle = open("/".join([ckDir, "ids.txt"]), "rb")
+        shutil.copyfileobj(saved_handle, id_handle)
+        saved_handle.close()
+    else:
+        id_handle = None
+    
+    return savedJunctions, ["/".join([ckDir, "readIds_" + str(i) + ".txt"]) for i in xrange(numIdTmpFiles)], id_handle
 
 if __name__  == "__main__":
     parser = argparse.ArgumentParser()
@@ -471,9 +953,23 @@ if __name__  == "__main__":
     parser.add_argument('-j', '--junctionIdDirSuffix', help='suffix appended to junc and reg to find overlapped reads for this run', default='')
     parser.add_argument('-se', '--singleEnd', help='is this single end read data', action='store_true')
     parser.add_argument('-u', '--unalignedMode', help='is this an unaligned mode run', action='store_true')
+    parser.add_argument('-m', '--juncMetadata', help='junction metadata tables (_metadata.npy) created with the junction indices, used to look up junction info', nargs='*', default=[])
+    parser.add_argument('-sm', '--sortMerge', help='sort the id and sam files by read id and merge them instead of loading the reads into memory', action='store_true')
+    parser.add_argument('-sc', '--streamClassify', help='assign each read to a category as soon as its mates are found instead of keeping all reads until the end', action='store_true')
+    parser.add_argument('-st', '--sortTmpDir', help='directory for temporary files in sortMerge and streamClassify mode, defaults to the output directory')
+    parser.add_argument('-w', '--workers', help='number of Rd2 sam files, or of shards and the input files they are split from, to process at once in worker processes', default=1, type=int)
+    parser.add_argument('-ns', '--numShards', help='split the reads into this many shards by read id hash, each loaded and classified on its own to bound memory', default=1, type=int)
+    parser.add_argument('-bt', '--bamThreads', help='number of threads used to decompress bam files that are read instead of sam files', type=int, default=utils_bam.NUM_THREADS)
+    parser.add_argument('-ck', '--checkpoint', help='save the classified reads to a checkpoint, and only redo the reports if it was saved for the same inputs', action='store_true')
+    parser.add_argument('-x', '--exactIds', help='check reads that look ribo or genome aligned against the id files, in case of read id hash collisions', action='store_true')
+    parser.add_argument('-pr', '--profile', help='write a cProfile dump of the run (without worker processes) to the reports directory', action='store_true')
     parser.add_argument('-v', '--verbose', help='print extra debugging info', action='store_true')
     args = parser.parse_args()
     
+    # shards only send back junction stats, so their reads are always classified as soon as their mates are found
+    if args.numShards > 1 and not args.sortMerge:
+        args.streamClassify = True
+    
     if args.verbose:
         print "parentDir:", args.parentDir
         print "sampleId:", args.sampleId
@@ -484,6 +980,12 @@ if __name__  == "__main__":
         print "overhang:", args.overhang
         print "id dir suffix:", args.junctionIdDirSuffix
         print "unaligned:", args.unalignedMode
+        print "junction metadata:", args.juncMetadata
+        print "sort-merge:", args.sortMerge
+        print "stream classify:", args.streamClassify
+        print "shards:", args.numShards
+        print "checkpoint:", args.checkpoint
+        print "profile:", args.profile
     
     # make output dirs if they don't exist
     utils_os.createDirectory("/".join([args.parentDir, args.outDirName]))
@@ -491,78 +993,116 @@ if __name__  == "__main__":
     utils_os.createDirectory("/".join([args.parentDir, args.outDirName, "glmReports"])) # GLM will be run later and those reports will be stored here
     utils_os.createDirectory("/".join([args.parentDir, args.outDirName, "glmModels"]))  # GLM will be run later and those models will be stored here
     utils_os.createDirectory("/".join([args.parentDir, args.outDirName, "ids"]))  # txt files of read ids assigned to circular or linear category
+    
+    # junction ids found in these are looked up instead of parsed
+    for metadataFile in args.juncMetadata:
+        loadJuncMetadata(metadataFile)
+        
     # just doing read1s 
     if args.sampleId.endswith("1"):
+        timing = utils_stageStats.stageStats()  # time and memory use of each stage, written next to the report
+        if args.profile:
+            profiler = cProfile.Profile()
+            profiler.enable()
     
         try:
-            # populate the ignoreIds, regIds, nonRegIds for this file and also print out regIds and nonRegIds to juncNonGR file
-            ignoreIds = {} # ribo and genome aligned 
-            regIds = {} # regular junction overlapped and not ribo or genome aligned (aligned to reg-only index)
-            nonRegIds = {} # junction overlapped and not ribo or genome aligned or regular-junction aligned
-            
             # we treat denovo reads as the equivalent of the junction reads in unalignedMode
             if args.unalignedMode:
                 useJuncStr = "denovo"
             else:
                 useJuncStr = "junction"
-                
-            selectCandidateIds()
             
-            if args.verbose:
-                print "ignoreIds (aligned to genome):", str(len(ignoreIds))
-                print "linearIds:", str(len(regIds))
-                print "scrambledIds:", str(len(nonRegIds))
+            # a global alignment score cutoff can be specified instead of the naive method, only for SE 
+            if args.singleEnd and args.aScore1 and args.aScore2:
+                globalCutOff = (args.aScore1, args.aScore2)
+            else:
+                globalCutOff = None
                 
             juncReads = {}  # base read id: juncReadObj
+            curShard = None  # shard of the reads loaded in this process (see runShard), None if the reads are not sharded
             junctions = {}  # junction id: list of juncObjs mapping to this junction
-                
-            if not args.unalignedMode:
-                # make a pass through the sam file for read 1 to regular junctions to populate dict with juncReadObjs (key is portion of read id shared by Rd1 and Rd2)
-                #     and at the same time create entry in junction dictionary and add this read obj to the junction list of reads
-                parseSam("".join(["/".join([args.parentDir, "orig", "reg", args.sampleId]), "_reg_output.sam"]), "r1rj")
             
-            # make a pass through the sam for read 1 to all junctions file to populate dict with juncReadObjs (key is portion of read id shared by Rd1 and Rd2)
-            #     and at the same time create entry in junction dictionary and add this read obj to the junction list of reads
-            parseSam("_".join(["/".join([args.parentDir, "orig", useJuncStr, args.sampleId]), useJuncStr, "output.sam"]), "r1j")
+            tmpDir = None  # for temporary files in sortMerge and streamClassify mode
+            idTmpFileNames = []  # files with the circular and linear read lines for the id file, see reportSortedReadIds
+            id_handle = None  # id file in sortMerge and streamClassify mode, lines are written to it as reads are classified
             
-            # get mate alignment data if this is from paired end sequencing
-            if not args.singleEnd:
-                if args.unalignedMode:
-                    alignedMateId = args.sampleId[10:-1] + "2"  # trim off unaligned_ from start of id, change 1 to 2
+            if args.checkpoint:
+                checkpointKey = getCheckpointKey()
+                resumed = checkpointMatches(checkpointKey)
+            else:
+                resumed = False
+            
+            if resumed:
+                # the reads were already loaded and classified for the same inputs, only the reports need to be redone
+                if args.verbose:
+                    print "loading checkpoint from", checkpointDir()
+                timing.start("loadCheckpoint")
+                junctions, idTmpFileNames, id_handle = loadCheckpoint()
+                timing.stop(junctions=len(junctions))
+            else:
+                if args.sortMerge or args.streamClassify:
+                    # reads are assigned to categories as soon as all of their alignments have been seen and only counted
+                    # in the stats of their junction. Their lines are written to the id file right away, or to a temporary
+                    # file until the FDR of each junction is known for circular and linear reads.
+                    if args.sortTmpDir:
+                        tmpDir = tempfile.mkdtemp(dir=args.sortTmpDir)
+                    else:
+                        tmpDir = tempfile.mkdtemp(dir="/".join([args.parentDir, args.outDirName]))
+                    idTmpFileName = "/".join([tmpDir, "readIds.txt"])
+                    idTmpFile = open(idTmpFileName, "wb")
+                    idTmpFileNames.append(idTmpFileName)
+                    id_handle = openReadIdFile()
+            
+                if args.sortMerge:
+                    # stream the sorted id and sam files
+                    timing.start("sortMergeReads")
+                    sortMergeReads(tmpDir, idTmpFile, id_handle)
+                    idTmpFile.close()
+                    timing.stop(junctions=len(junctions))
+                elif args.numShards > 1:
+                    # each shard of the reads is loaded and classified in its own worker process, only the junction stats
+                    # of the shards are kept in this one. The id file header is flushed first so the forked workers
+                    # do not write their copy of it too.
+                    id_handle.flush()
+                    timing.start("partitionInputs")
+                    partitionInputs()
+                    timing.stop()
+                    timing.start("shards")
+                    pool = Pool(min(args.workers, args.numShards))
+                    results = [pool.apply_async(runShard, (shard,)) for shard in xrange(args.numShards)]
+                    pool.close()
+                    shardStages = []
+                    for shard in xrange(args.numShards):
+                        shardStats, stages = results.pop(0).get()
+                        mergeShardStats(shardStats)  # the stats of each shard are released once merged
+                        shardStages.append(stages)
+                    pool.join()
+                    idTmpFile.close()
+                    mergeShards(id_handle)
+                    idTmpFileNames += [shardFile("readIds", shard) for shard in xrange(args.numShards)]
+                    timing.stop(junctions=len(junctions))
+                    for shard, stages in enumerate(shardStages):
+                        timing.addStages(stages, "shard " + str(shard) + ": ")
                 else:
-                    alignedMateId = args.sampleId[:-1] + "2"
-                
-                # make a pass through Rd2 to genome sam file to update mateGenomic in each juncReadObj
-                parseSam("".join(["/".join([args.parentDir, "orig", "genome", alignedMateId]), "_genome_output.sam"]), "gMate")
-                
-                # make a pass through Rd2 to junction sam file to update mateRegJunction in each juncReadObj
-                parseSam("".join(["/".join([args.parentDir, "orig", "reg", alignedMateId]), "_reg_output.sam"]), "rjMate")
-                
-                # make a pass through Rd2 to junction sam file to update mateJunction in each juncReadObj
-                parseSam("".join(["/".join([args.parentDir, "orig", "junction", alignedMateId]), "_junction_output.sam"]), "jMate")
+                    loadReads()
+                    if args.streamClassify:
+                        idTmpFile.close()
                 
-                # make a pass through Rd2 to de novo sam file to update mateDenovo in each juncReadObj
-                if args.unalignedMode:
-                    parseSam("".join(["/".join([args.parentDir, "orig", "denovo", args.sampleId[:-1]]), "2_denovo_output.sam"]), "dMate")
-                
-            if args.verbose:
-                print "sample id:", str(args.sampleId)
-                print "single end?", str(args.singleEnd)
-                print "num junctions with aligned reads:", str(len(junctions))
-                print "num reads:", str(len(juncReads))
-
-            updateReads()  # assign reads to categories based on alignment data (circular, linear, decoy, etc)
+                if args.checkpoint:
+                    timing.start("saveCheckpoint")
+                    idTmpFileNames = saveCheckpoint(checkpointKey, idTmpFileNames, id_handle)
+                    timing.stop()
             
             # print out some alignment statistics after reads have all been assigned to a category
             if args.verbose:
                 numCirc = numDecoy = numLinear = numAnomaly = numUnmapped = numMultimapped = numUnknown = 0
                 for j in junctions:
-                    numCirc = numCirc + len(junctions[j].circularReads)
-                    numDecoy = numDecoy + len(junctions[j].decoyReads)
-                    numLinear = numLinear + len(junctions[j].linearReads)
-                    numAnomaly = numAnomaly + len(junctions[j].anomalyReads)
-                    numUnmapped = numUnmapped + len(junctions[j].unmappedReads)
-                    numMultimapped = numMultimapped + len(junctions[j].multimappedReads)
+                    numCirc = numCirc + junctions[j].stats.count("circular")
+                    numDecoy = numDecoy + junctions[j].stats.count("decoy")
+                    numLinear = numLinear + junctions[j].stats.count("linear")
+                    numAnomaly = numAnomaly + junctions[j].stats.count("anomaly")
+                    numUnmapped = numUnmapped + junctions[j].stats.count("unmapped")
+                    numMultimapped = numMultimapped + junctions[j].stats.count("multimapped")
                     numUnknown = numUnknown + len(junctions[j].unknownReads)
                 print "number of reads kept in each category after update (multimapped & unknown should be 0, anomaly & decoy should be 0 for SE data):"
                 print "circ: ", str(numCirc), ", decoy: ", str(numDecoy), ", linear: ", str(numLinear), ", anomaly: ", str(numAnomaly), ", unmapped: ", str(numUnmapped), ", multimapped: ", str(numMultimapped), ", unknown: ", str(numUnknown)
@@ -570,14 +1110,13 @@ if __name__  == "__main__":
             
             # only want to do naive method for SE, we don't use it for PE
             if args.singleEnd:
-                if args.aScore1 and args.aScore2:
-                    globalCutOff = (args.aScore1, args.aScore2)
+                timing.start("reportCircularReads")
+                if globalCutOff:
                     globalDecoyMMrate = None
                     if args.verbose:
                         print "globalCutOff specified:", globalCutOff
                 else:
                     # use decoy distribution
-                    globalCutOff = None
                     globalDecoyMMrate = getDecoyMismatchRate()
                     
                     # if there were no decoys, use the default seqErrorRate
@@ -589,9 +1128,28 @@ if __name__  == "__main__":
                         
                 
                 reportCircularReads(globalCutOff)  # output reports
-            reportAllReadIds2(globalCutOff)   # output ids used in the reports for further manual investigation if desired + GLM uses these category assignments
+                timing.stop(junctions=len(junctions))
+            
+            # output ids used in the reports for further manual investigation if desired + GLM uses these category assignments
+            timing.start("reportReadIds")
+            if args.sortMerge or args.streamClassify:
+                for idTmpFileName in idTmpFileNames:
+                    reportSortedReadIds(globalCutOff, idTmpFileName, id_handle)
+                id_handle.close()
+            else:
+                reportAllReadIds2(globalCutOff)
+            timing.stop(junctions=len(junctions))
+            
+            if tmpDir:
+                shutil.rmtree(tmpDir)
             
         except Exception as e:
             print "Exception"
             print e
+        
+        # also written if the run failed, to show how far it got
+        timing.write(reportSidecarFileName("stageStats.json"), {"sampleId": args.sampleId, "args": vars(args)})
+        if args.profile:
+            profiler.disable()
+            profiler.dump_stats(reportSidecarFileName("profile.prof"))
         
\ No newline at end of file
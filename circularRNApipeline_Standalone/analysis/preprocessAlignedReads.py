@@ -0,0 +1,215 @@
+# Create text files with ids of Ribo-aligned, genome-aligned, junction-overlapped, and reg junction-overlapped reads
+# (or de novo junction-overlapped reads for a sample id starting with unaligned_), reading each sam file once.
+# Called by preprocessAlignedReads.sh. If there is no sam file for an index, the bam file is read directly.
+#
+# Each id file line is "read id<tab>flag<tab>reference" (plus "<tab>position" for the genome), the same lines the
+# awk scans in preprocessAlignedReads.sh used to write. The counts qualityStatsSingleSample.sh reports for an id file
+# are accumulated in the same pass and written next to it, to <id file name>_stats.txt, so it does not have to
+# rescan the id files. Each line of a stats file is "name<tab>count":
+#   lines      number of lines in the id file
+#   pos, neg   reads aligned to the + or - strand of the gene (for junctions, - strand junctions are stored as the
+#              reverse complement in the index, so a - strand alignment to a - strand junction is a + strand read)
+#   hbb        genome reads aligned within the HBB CDS
+#   28S, 18S, 5.8S, 5SDNA, 5SrRNA    ribo reads for each ribosomal subunit
+#   midpoint, overhang    for junction id files, the values the junction overlap rule was applied with
+
+import argparse
+import os
+import utils_bam
+import utils_os
+
+POS_MATCH_FLAG = 0  # value used in sam file to indicate alignment to forward strand
+REV_MATCH_FLAG = 16  # value used in sam file to indicate alignment to reverse strand
+UNMAPPED_FLAG = 4  # value used in sam file to indicate the read did not align
+
+# count reads mapping with offset within HBB CDS (chr11 617350-621570) from ucsc hg19 knowngenes file
+HBB_CHR = "chr11"
+HBB_START = 617350
+HBB_END = 621570
+
+# name in the stats file: text in the id file line that marks a read aligned to the subunit
+RIBO_SUBUNITS = [("28S", "gi|224514641:112587-119176"),
+                 ("18S", "gi|224514641:109078-110946"),
+                 ("5.8S", "gi|224514641:112025-112180"),
+                 ("5SDNA", "gi|23898|emb|X12811.1|"),
+                 ("5SrRNA", "hg19_5SrRna")]
+
+# return: path of the sam file for the sample and index, whether or not it exists
+# param alignDir: directory with a subdirectory of alignment files for each index
+# param indexName: "junction", "reg", "ribo", "genome", or "denovo"
+def alignmentFileName(alignDir, sampleId, indexName):
+    return "".join(["/".join([alignDir, indexName, sampleId]), "_", indexName, "_output.sam"])
+
+# return: the sam file for the sample and index, or None if there is neither a sam nor a bam file for it
+#         (utils_bam.openAlignments reads the bam file when there is no sam file)
+def findAlignmentFile(alignDir, sampleId, indexName):
+    samFile = alignmentFileName(alignDir, sampleId, indexName)
+    if os.path.exists(samFile) or os.path.exists(os.path.splitext(samFile)[0] + ".bam"):
+        return samFile
+    return None
+
+# param idDirName: directory under alignDir/ids for the id file, the index name with the junction id dir suffix if any
+def idFileName(alignDir, idDirName, sampleId, indexName):
+    return "".join(["/".join([alignDir, "ids", idDirName, sampleId]), "_", indexName, "_output.txt"])
+
+# return: name of the stats file written for an id file
+def statsFileName(idFile):
+    return os.path.splitext(idFile)[0] + "_stats.txt"
+
+# header line streamAlignedReads.py adds to the sam files it writes, followed by "midpoint=<m> overhang=<o>"
+STREAM_COMMENT = "@CO\tstreamAlignedReads.py"
+
+# return: the header line for a sam file written by streamAlignedReads.py with the junction overlap rule it applied
+def streamComment(midpoint, overhang):
+    return STREAM_COMMENT + " midpoint=" + str(midpoint) + " overhang=" + str(overhang) + "\n"
+
+# A sam file written by streamAlignedReads.py only has the reads that overlapped a junction with the midpoint and
+# overhang used when the reads were aligned. Reads that only overlap with a different midpoint or a smaller
+# overhang are missing from it, so the id file would be incomplete.
+# param line: header line of the sam file that starts with STREAM_COMMENT
+def checkStreamComment(line, samFile, midpoint, overhang):
+    rule = dict(field.split("=") for field in line[len(STREAM_COMMENT):].split())
+    if int(rule["midpoint"]) != midpoint or int(rule["overhang"]) > overhang:
+        print "warning:", samFile, "only has the reads that overlap a junction with midpoint", rule["midpoint"],
+        print "and overhang", rule["overhang"] + ", reads that overlap with midpoint", midpoint, "and overhang", overhang, "may be missing"
+
+# param pos: 1-based leftmost position of the alignment
+# param seqLen: length of the read sequence in the sam file
+#
+# return: True if the alignment covers at least overhang bases on each side of the junction midpoint
+def overlapsJunction(pos, seqLen, midpoint, overhang):
+    return pos >= midpoint - seqLen + overhang + 1 and pos <= midpoint - overhang + 1
+
+# Writes the id file for one index from its sam lines and counts the stats for it as the lines are written.
+# indexType is "junction" for junction (reg, junction or denovo) alignments, which are written if they overlap the
+# junction, or "ribo" or "genome" for alignments that are written if the read aligned.
+class idFileWriter:
+    def __init__(self, idFile, indexType, midpoint, overhang):
+        self.idFile = idFile
+        self.indexType = indexType
+        self.midpoint = midpoint
+        self.overhang = overhang
+        self.numLines = self.numPos = self.numNeg = self.numHbb = 0
+        self.subunitCounts = [0] * len(RIBO_SUBUNITS)
+        self.out_handle = open(idFile, "wb")
+
+    # param vals: fields of a sam line that is not a header line, split on tabs
+    #
+    # return: True if the line was written to the id file
+    def add(self, vals):
+        flag = int(vals[1])
+        if self.indexType == "junction":
+            if not overlapsJunction(int(vals[3]), len(vals[9]), self.midpoint, self.overhang):
+                return False
+        elif flag == UNMAPPED_FLAG:
+            return False
+
+        if self.indexType == "genome":
+            idLine = "\t".join(vals[:4])
+        else:
+            idLine = "\t".join(vals[:3])
+        self.out_handle.write(idLine + "\n")
+        self.numLines += 1
+
+        if self.indexType == "junction" and vals[2].endswith("-"):
+            strandFlags = (REV_MATCH_FLAG, POS_MATCH_FLAG)  # - strand junctions are stored as the reverse complement
+        else:
+            strandFlags = (POS_MATCH_FLAG, REV_MATCH_FLAG)
+        if flag == strandFlags[0]:
+            self.numPos += 1
+        elif flag == strandFlags[1]:
+            self.numNeg += 1
+
+        if self.indexType == "genome" and vals[2] == HBB_CHR and HBB_START <= int(vals[3]) <= HBB_END:
+            self.numHbb += 1
+        elif self.indexType == "ribo":
+            for i, (subunit, refText) in enumerate(RIBO_SUBUNITS):
+                if refText in idLine:
+                    self.subunitCounts[i] += 1
+        return True
+
+    # close the id file and write the stats file next to it
+    def close(self):
+        self.out_handle.close()
+
+        stats = [("lines", self.numLines), ("pos", self.numPos), ("neg", self.numNeg)]
+        if self.indexType == "genome":
+            stats.append(("hbb", self.numHbb))
+        elif self.indexType == "ribo":
+            stats += zip([subunit for subunit, refText in RIBO_SUBUNITS], self.subunitCounts)
+        else:
+            # the overlap rule the id file was written with, to tell if it can be reused (see isUpToDate)
+            stats += [("midpoint", self.midpoint), ("overhang", self.overhang)]
+
+        handle = open(statsFileName(self.idFile), "wb")
+        for name, count in stats:
+            handle.write(name + "\t" + str(count) + "\n")
+        handle.close()
+
+# write the id file for a sam or bam file and count the stats for it in the same pass
+def preprocessFile(samFile, idFile, indexType, midpoint, overhang, numThreads):
+    handle = utils_bam.openAlignments(samFile, numThreads)
+    writer = idFileWriter(idFile, indexType, midpoint, overhang)
+
+    for line in handle:
+        if line.startswith(STREAM_COMMENT):
+            checkStreamComment(line, samFile, midpoint, overhang)
+        elif not line.startswith("@") and line.strip():  # ignore header lines
+            writer.add(line.split("\t", 10))
+
+    handle.close()
+    writer.close()
+
+# A junction id file written while the reads were aligned (see streamAlignedReads.py) does not need to be
+# written again from the sam file.
+#
+# return: True if the id file and its stats file were written after the sam file with the same overlap rule
+def isUpToDate(samFile, idFile, midpoint, overhang):
+    statsFile = statsFileName(idFile)
+    if not os.path.exists(idFile) or not os.path.exists(statsFile) or not os.path.exists(samFile):
+        return False
+    if os.path.getmtime(statsFile) < os.path.getmtime(samFile):
+        return False
+
+    stats = dict(line.rstrip("\n").split("\t") for line in open(statsFile, "rU"))
+    return stats.get("midpoint") == str(midpoint) and stats.get("overhang") == str(overhang)
+
+if __name__  == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--sampleId', help='string used to identify this sample', required=True)
+    parser.add_argument('-a', '--alignDir', help='path to the alignment directory for this dataset (will end with /orig)', required=True)
+    parser.add_argument('-m', '--midpoint', help='position of the junction in the junction sequences', type=int, required=True)
+    parser.add_argument('-oh', '--overhang', help='how much you want the read to overlap a junction to be considered aligned to junction', type=int, required=True)
+    parser.add_argument('-j', '--junctionIdDirSuffix', help='suffix appended to junc and reg to output overlapped reads for this run', default='')
+    parser.add_argument('-bt', '--bamThreads', help='number of threads used to decompress bam files that are read instead of sam files', type=int, default=utils_bam.NUM_THREADS)
+    args = parser.parse_args()
+
+    # index name, id directory, index type for preprocessFile
+    if args.sampleId.startswith("unaligned_"):
+        # just need to do the unaligned reads
+        indices = [("denovo", "denovo" + args.junctionIdDirSuffix, "junction")]
+    else:
+        # this is a regular first-time run, preprocess all of the genome, junction, ribo
+        indices = [("junction", "junction" + args.junctionIdDirSuffix, "junction"),
+                   ("reg", "reg" + args.junctionIdDirSuffix, "junction"),
+                   ("ribo", "ribo", "ribo"),
+                   ("genome", "genome", "genome")]
+
+    # if a directory suffix was passed, we want to output the junction overlaps to a different directory than the default
+    if args.junctionIdDirSuffix:
+        for indexName, idDirName, indexType in indices:
+            utils_os.createDirectory("/".join([args.alignDir, "ids", idDirName]))
+        utils_os.createDirectory("/".join([args.alignDir, "ids", "juncNonGR" + args.junctionIdDirSuffix]))
+
+    for indexName, idDirName, indexType in indices:
+        samFile = findAlignmentFile(args.alignDir, args.sampleId, indexName)
+        if not samFile:
+            print "no sam or bam file for", args.sampleId, "in", "/".join([args.alignDir, indexName])
+            continue
+
+        idFile = idFileName(args.alignDir, idDirName, args.sampleId, indexName)
+        if indexType == "junction" and isUpToDate(samFile, idFile, args.midpoint, args.overhang):
+            print "id file", idFile, "was already written when", args.sampleId, "was aligned"
+            continue
+
+        preprocessFile(samFile, idFile, indexType, args.midpoint, args.overhang, args.bamThreads)
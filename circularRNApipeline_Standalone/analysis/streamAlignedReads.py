@@ -0,0 +1,102 @@
+# Filter the Bowtie2 output for a junction, reg, or denovo index as it is written, so the full sam file never has to
+# be written to disk and read again. Called by align.sh in stream mode with the Bowtie2 sam output on stdin.
+#
+# Most alignments to the junction indices do not overlap the junction, and the rest of the pipeline only uses the ones
+# that do. In the same pass this:
+#   - writes the junction id file and its stats file, as preprocessAlignedReads.py would (it skips them afterwards)
+#   - writes the usual sam file with only the lines of reads that have an alignment overlapping the junction. All of
+#     the alignments of these reads are kept, so the first aligned read in the file is the same as in the full output
+#     (in unaligned mode Bowtie2 reports all alignments for a read, one after another). The midpoint and overhang
+#     are recorded in a @CO header line, the sam file can't be used with a different midpoint or a smaller overhang
+#   - writes the ids of the other aligned reads to <sam file name>_nonOverlapIds.txt, so getUnalignedReadCount.py
+#     still knows that they aligned
+#   - optionally pipes every line to samtools to keep the full alignments as <sam file name>_all.bam
+
+import argparse
+import os
+import subprocess
+import sys
+import utils_os
+from preprocessAlignedReads import alignmentFileName, idFileName, idFileWriter, streamComment
+
+# return: name of the file with the ids of the reads that aligned but do not overlap the junction
+def nonOverlapIdFileName(samFile):
+    return os.path.splitext(samFile)[0] + "_nonOverlapIds.txt"
+
+# write out the alignments of a read once all of them have been seen
+# param lines: sam lines for the read
+# param overlapped: True if any of the alignments overlapped the junction
+def writeRead(lines, overlapped):
+    if overlapped:
+        for line in lines:
+            sam_handle.write(line)
+    else:
+        nonOverlap_handle.write(lines[0].split("\t", 1)[0] + "\n")
+
+if __name__  == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--sampleId', help='string used to identify this sample', required=True)
+    parser.add_argument('-a', '--alignDir', help='path to the alignment directory for this dataset (will end with /orig)', required=True)
+    parser.add_argument('-i', '--indexName', help='index the reads are aligned to', choices=["junction", "reg", "denovo"], required=True)
+    parser.add_argument('-m', '--midpoint', help='position of the junction in the junction sequences', type=int, required=True)
+    parser.add_argument('-oh', '--overhang', help='how much you want the read to overlap a junction to be considered aligned to junction', type=int, required=True)
+    parser.add_argument('-b', '--bamFile', help='also write all of the alignments to this bam file', default=None)
+    parser.add_argument('-f', '--fasta', help='fasta file of the index, required with --bamFile', default=None)
+    args = parser.parse_args()
+
+    if args.bamFile and not args.fasta:
+        parser.error("--fasta is required with --bamFile")
+
+    samFile = alignmentFileName(args.alignDir, args.sampleId, args.indexName)
+    idFile = idFileName(args.alignDir, args.indexName, args.sampleId, args.indexName)
+    utils_os.createDirectory(os.path.dirname(idFile))
+
+    sam_handle = open(samFile, "wb")
+    nonOverlap_handle = open(nonOverlapIdFileName(samFile), "wb")
+    writer = idFileWriter(idFile, "junction", args.midpoint, args.overhang)
+    if args.bamFile:
+        bam_handle = open(args.bamFile, "wb")
+        bamProc = subprocess.Popen(["samtools", "view", "-bT", args.fasta, "-"], stdin=subprocess.PIPE, stdout=bam_handle)
+
+    curId = None
+    curLines = []
+    curOverlapped = False
+    for line in sys.stdin:
+        if args.bamFile:
+            bamProc.stdin.write(line)
+
+        if line.startswith("@"):  # header lines are kept
+            sam_handle.write(line)
+            continue
+        if not line.strip():
+            continue
+
+        if curId is None:
+            # after the Bowtie2 header lines, so preprocessAlignedReads.py can tell how the file was filtered
+            sam_handle.write(streamComment(args.midpoint, args.overhang))
+
+        vals = line.split("\t", 10)
+        if vals[0] != curId:
+            if curLines:
+                writeRead(curLines, curOverlapped)
+            curId = vals[0]
+            curLines = []
+            curOverlapped = False
+
+        curLines.append(line)
+        if writer.add(vals):
+            curOverlapped = True
+
+    if curId is None:
+        sam_handle.write(streamComment(args.midpoint, args.overhang))
+    elif curLines:
+        writeRead(curLines, curOverlapped)
+
+    sam_handle.close()
+    nonOverlap_handle.close()
+    writer.close()  # after the sam file is closed so the id file is not older than the sam file
+    if args.bamFile:
+        bamProc.stdin.close()
+        if bamProc.wait() != 0:
+            print "could not write", args.bamFile
+        bam_handle.close()
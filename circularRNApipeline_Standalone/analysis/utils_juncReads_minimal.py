@@ -1,9 +1,11 @@
 # main data structures for tracking junctions and aligned reads and their associated properties
 
+import hashlib
 import re
-from collections import namedtuple
-from collections import deque
+import struct
+from collections import Counter, namedtuple
 from numpy import mean
+import numpy as np
 
 POS_MATCH_FLAG = 0  # value used in sam file to indicate alignment to forward strand
 REV_MATCH_FLAG = 16  # value used in sam file to indicate alignment to reverse strand
@@ -19,11 +21,69 @@ BUFFER = 15  # allow wiggle room to minimize anomalies / decoys due to sequencin
 UNALIGNED_BUFFER = 50  # allow extra wiggle room for unaligned because the headers contain bins, not exact alignment positions
 JUNC_MIDPOINT = 150  # we take 150bp from each exon to create a junction sequence
 MIN_MAPQUAL = 0 # minimum mapping quality to consider a read as providing any info  
+READ_CATEGORIES = ["circular", "decoy", "linear", "anomaly", "unmapped", "multimapped"]  # buckets a read can be assigned to in a juncObj
+CATEGORY_INDEX = dict((category, i) for i, category in enumerate(READ_CATEGORIES))
+MAX_LISTED_SCORES = 10  # the report lists all alignment scores for a junction with up to this many reads, otherwise quantiles
 
 # junction ids look like chr10|TTC40:134751179|MYC1:134722640|reg|-
 # where we are interested in chr10, TTC40, 134751179, MYC1, 134722640, reg, and -
 id_patt = re.compile("(.+?)\|(.+?):(.+?)\|(.+?):(.+?)\|(.+?)\|(\-|\+)")
 
+# junction metadata tables are written with the junction index by createJunctionIndex (see utils_juncMetadata.py there)
+JUNC_TYPES = ["reg", "rev", "dup"]  # junction type for each value of the type column
+STRANDS = {1: "+", -1: "-"}  # direction for each value of the strand column
+
+# info about a junction, from a metadata table or parsed from the junction id
+juncInfo = namedtuple('juncInfo', ['chromosome', 'direction', 'juncType', 'numGenes', 'minPos', 'maxPos'])
+
+juncMetadata = []  # (table, chromosome names) for each metadata table loaded with loadJuncMetadata
+juncInfoCache = {}  # reference name: juncInfo, or None if it is not a junction id
+
+# param fileName: path to a _metadata.npy file created with a junction index. The chromosomes file is expected next to it.
+def loadJuncMetadata(fileName):
+    table = np.load(fileName, mmap_mode='r')  # only the pages searched are read
+    handle = open(fileName[:-len("_metadata.npy")] + "_chromosomes.txt", "rU")
+    chrNames = [line.rstrip("\n") for line in handle]
+    handle.close()
+    juncMetadata.append((table, chrNames))
+
+# look up the info for a junction id, first in the metadata tables and then by parsing the id.
+# Results are cached, so each reference name is only looked up once.
+#
+# return: juncInfo, or None if refName is not a junction id (for example a genome alignment)
+def getJuncInfo(refName):
+    if refName in juncInfoCache:
+        return juncInfoCache[refName]
+    
+    info = None
+    if juncMetadata:
+        key1, key2 = struct.unpack("<QQ", hashlib.md5(refName).digest())
+        for table, chrNames in juncMetadata:
+            keys = table['key1']
+            for i in xrange(keys.searchsorted(key1, side='left'), keys.searchsorted(key1, side='right')):
+                if table['key2'][i] == key2:
+                    row = table[i]
+                    info = juncInfo(chrNames[row['chr']], STRANDS[int(row['strand'])], JUNC_TYPES[row['type']],
+                                    int(row['numGenes']), int(row['minPos']), int(row['maxPos']))
+                    break
+            if info:
+                break
+    
+    # not in a table, for example de novo junctions
+    if not info:
+        match = id_patt.search(refName)
+        if match:
+            # if the 2 genes are the same, the junction involves only 1 gene
+            if match.group(G_GENE1) == match.group(G_GENE2):
+                numGenes = 1
+            else:
+                numGenes = 2
+            info = juncInfo(match.group(G_CHR), match.group(G_JUNC_STRAND), match.group(G_JUNC_TYPE), numGenes,
+                            min(int(match.group(G_POS1)), int(match.group(G_POS2))), max(int(match.group(G_POS1)), int(match.group(G_POS2))))
+    
+    juncInfoCache[refName] = info
+    return info
+
 # MD strings look like 0N0N0N0N0N0N35T0A0G0G0G1T1C29 or 35T0A0G0G0G1T1C29N0N0 with any number of 0N or N0 repeats
 # where we are interested in the repeats 0N0N0N0N0N0N and N0N0
 md_patt = re.compile("^((?:0N)*).+?((?:N0)*)$")
@@ -31,7 +91,9 @@ md_patt = re.compile("^((?:0N)*).+?((?:N0)*)$")
 # Contains read and its mates that mapped to the genome or junction database.
 # Can have mate mapping to both since the alignment of all mates is done to both
 # indexes. Also knows whether it looks like a circle or a decoy.
-class juncReadObj:
+# There is 1 of these for every junction read, so attributes are in __slots__ to keep them small.
+class juncReadObj(object):
+    __slots__ = ['juncRead', 'mateGenomic', 'mateJunction', 'mateRegJunction', 'mateDenovoJunction', 'readType', 'useMate', 'readStat']
     
     def __init__(self, read):
         self.juncRead = read  # read object that aligned to junction
@@ -62,7 +124,7 @@ class juncReadObj:
         # it will end up being placed in the multi-mapped bucket
         # so no need to take a look at mates and read types
         # otherwise, pick a mate and calculate values based on mate selected
-        if int(self.juncRead.mapQual) >= MIN_MAPQUAL:
+        if self.juncRead.mapQual >= MIN_MAPQUAL:
             if not isSingleEnd:
                 self.useMate = self.selectMate()
             self.readType = self.selectReadType(junc, isSingleEnd, isUnalignedMode)
@@ -76,16 +138,16 @@ class juncReadObj:
         possibleMates = []
         
         
-        if self.mateGenomic and int(self.mateGenomic.mapQual) >= MIN_MAPQUAL:
+        if self.mateGenomic and self.mateGenomic.mapQual >= MIN_MAPQUAL:
             possibleMates.append(self.mateGenomic)
         
-        if self.mateRegJunction and int(self.mateRegJunction.mapQual) >= MIN_MAPQUAL:
+        if self.mateRegJunction and self.mateRegJunction.mapQual >= MIN_MAPQUAL:
             possibleMates.append(self.mateRegJunction)
         
-        if self.mateJunction and int(self.mateJunction.mapQual) >= MIN_MAPQUAL:
+        if self.mateJunction and self.mateJunction.mapQual >= MIN_MAPQUAL:
             possibleMates.append(self.mateJunction)
         
-        if self.mateDenovoJunction and int(self.mateDenovoJunction.mapQual) >= MIN_MAPQUAL:
+        if self.mateDenovoJunction and self.mateDenovoJunction.mapQual >= MIN_MAPQUAL:
             possibleMates.append(self.mateDenovoJunction)
         
         # mate did not align anywhere with a good mapping quality
@@ -93,8 +155,8 @@ class juncReadObj:
             return None
         
         # only consider those mates with the maximum alignment score
-        maxAS = max(int(x.aScore) for x in possibleMates)
-        possibleMates = [x for x in possibleMates if int(x.aScore) == maxAS]
+        maxAS = max(x.aScore for x in possibleMates)
+        possibleMates = [x for x in possibleMates if x.aScore == maxAS]
         
         # if we only have one left with the max alignment score, that's the one we want
         if len(possibleMates) == 1:
@@ -117,7 +179,7 @@ class juncReadObj:
         if self.juncRead:
             # if we have a mate we are using, take the avg of the 2 reads
             if self.useMate:
-                return mean([int(self.juncRead.aScore), int(self.useMate.aScore)])
+                return mean([self.juncRead.aScore, self.useMate.aScore])
             # otherwise just use my score
             else:
                 return float(self.juncRead.aScore)
@@ -150,23 +212,23 @@ class juncReadObj:
     # this junction Rd1 is either dup or rev        
     def selectScrambledReadType(self, junc, isUnalignedMode):
         
-        myCoord = int(junc.minPos) - JUNC_MIDPOINT + int(self.juncRead.offset)
-        myEnd = myCoord + int(self.juncRead.readLen)
+        myCoord = junc.minPos - JUNC_MIDPOINT + self.juncRead.offset
+        myEnd = myCoord + self.juncRead.readLen
 
         # get info for mate 
         isGenomicMate = self.useMate == self.mateGenomic
         
         if isGenomicMate:
             mateChr = self.useMate.refName
-            mateCoord = int(self.useMate.offset)
+            mateCoord = self.useMate.offset
         else:
-            match2 = id_patt.search(self.useMate.refName)  # rd2 junction id
-            mateChr = match2.group(G_CHR)
-            minMateJunctionPos = min(int(match2.group(G_POS1)), int(match2.group(G_POS2)))
-            maxMateJunctionPos = max(int(match2.group(G_POS1)), int(match2.group(G_POS2)))
-            mateCoord = minMateJunctionPos - JUNC_MIDPOINT + int(self.useMate.offset)
+            mateInfo = getJuncInfo(self.useMate.refName)  # rd2 junction id
+            mateChr = mateInfo.chromosome
+            minMateJunctionPos = mateInfo.minPos
+            maxMateJunctionPos = mateInfo.maxPos
+            mateCoord = minMateJunctionPos - JUNC_MIDPOINT + self.useMate.offset
         
-        mateEnd = mateCoord + int(self.useMate.readLen)
+        mateEnd = mateCoord + self.useMate.readLen
         
         if isUnalignedMode:
             USE_BUFFER = UNALIGNED_BUFFER
@@ -175,17 +237,17 @@ class juncReadObj:
             
         # all info gathered, now see if it is consistent with circle or not
         # reads need to map in opposite orientation (have opposite flags) 
-        if junc.chromosome == mateChr and int(self.juncRead.flag) != int(self.useMate.flag):
+        if junc.chromosome == mateChr and self.juncRead.flag != self.useMate.flag:
             # read2 mapping to same scrambled junction as read1 is always evidence of circle
             if self.useMate.refName == self.juncRead.refName: 
                 return "c"
             # read2 mapping between read1 scrambled junction supports circle
-            elif (mateCoord >= (int(junc.minPos) - USE_BUFFER) and mateCoord <= (int(junc.maxPos) + USE_BUFFER)
-                  and mateEnd >= (int(junc.minPos) - USE_BUFFER) and mateEnd <= (int(junc.maxPos) + USE_BUFFER)):
+            elif (mateCoord >= (junc.minPos - USE_BUFFER) and mateCoord <= (junc.maxPos + USE_BUFFER)
+                  and mateEnd >= (junc.minPos - USE_BUFFER) and mateEnd <= (junc.maxPos + USE_BUFFER)):
                     return "c"
             # or Rd1 could map between bounds of a circle defined by scrambled junction-aligned Rd2
             # but we want to ignore these for now because they will be identified in a swapped run  
-            elif (not isGenomicMate and match2.group(G_JUNC_TYPE) != "reg"
+            elif (not isGenomicMate and mateInfo.juncType != "reg"
                   and myCoord >= (minMateJunctionPos - USE_BUFFER) and myCoord <= (maxMateJunctionPos + USE_BUFFER)
                   and myEnd >= (minMateJunctionPos - USE_BUFFER) and myEnd <= (maxMateJunctionPos + USE_BUFFER)):
                 return "i"
@@ -201,33 +263,32 @@ class juncReadObj:
     # since it will be picked up and considered in a swapped run (where we treat read 2 as read 1).
     def selectRegReadType(self, junc):
         
-        match1 = id_patt.search(self.juncRead.refName)  # reg junction rd1 id
-        myCoord = int(junc.minPos) - JUNC_MIDPOINT + int(self.juncRead.offset)
-        myEnd = myCoord + int(self.juncRead.readLen)
+        myCoord = junc.minPos - JUNC_MIDPOINT + self.juncRead.offset
+        myEnd = myCoord + self.juncRead.readLen
             
         # get info for mate 
         isGenomicMate = self.useMate == self.mateGenomic
         
         if isGenomicMate:
             mateChr = self.useMate.refName
-            mateCoord = int(self.useMate.offset)
+            mateCoord = self.useMate.offset
         else:
-            match2 = id_patt.search(self.useMate.refName)  # rd2 junction id
-            mateChr = match2.group(G_CHR)
-            minMateJunctionPos = min(int(match2.group(G_POS1)), int(match2.group(G_POS2)))
-            maxMateJunctionPos = max(int(match2.group(G_POS1)), int(match2.group(G_POS2)))
-            mateCoord = minMateJunctionPos - JUNC_MIDPOINT + int(self.useMate.offset)
+            mateInfo = getJuncInfo(self.useMate.refName)  # rd2 junction id
+            mateChr = mateInfo.chromosome
+            minMateJunctionPos = mateInfo.minPos
+            maxMateJunctionPos = mateInfo.maxPos
+            mateCoord = minMateJunctionPos - JUNC_MIDPOINT + self.useMate.offset
                 
-        mateEnd = mateCoord + int(self.useMate.readLen)
+        mateEnd = mateCoord + self.useMate.readLen
         
         ###### all info gathered, now see if it is consistent with circle or not
         
         # has to be on same chromosome and mates must be aligned in opposite orientation 
-        if junc.chromosome == mateChr and int(self.juncRead.flag) != int(self.useMate.flag):
+        if junc.chromosome == mateChr and self.juncRead.flag != self.useMate.flag:
             # check for evidence of linear 
-            if isGenomicMate or match2.group(G_JUNC_TYPE) == "reg":
+            if isGenomicMate or mateInfo.juncType == "reg":
                 # figure out genomic coordinate for plus and minus read
-                if int(self.juncRead.flag) == POS_MATCH_FLAG:
+                if self.juncRead.flag == POS_MATCH_FLAG:
                     plusMateCoord = myCoord 
                     minusMateCoord = mateCoord
                 else:
@@ -246,19 +307,31 @@ class juncReadObj:
             # the mate was on a different chromosome or alignment directions do not support PE read
             return "a"
 
-class juncObj:
+class juncObj(object):
+    __slots__ = ['id', 'chromosome', 'direction', 'juncType', 'numGenes', 'minPos', 'maxPos', 'circularReads', 'decoyReads',
+                 'unmappedReads', 'multimappedReads', 'linearReads', 'anomalyReads', 'unknownReads', 'fdr', 'stats']
     
-    def __init__(self, id):
+    # param keepReads: False if reads are only counted in stats (see addRead), the read lists are then left empty
+    def __init__(self, id, keepReads=True):
         self.id = id # junction id
         self.chromosome, self.direction, self.juncType, self.numGenes, self.minPos, self.maxPos = self.setInfo()
-        self.circularReads = deque([]) # will hold list of all reads spanning this junction that support circle
-        self.decoyReads = deque([]) # will hold list of all reads spanning this junction that do not support circle
-        self.unmappedReads = deque([]) # will hold list of all reads spanning this junction where mate is not mapped
-        self.multimappedReads = deque([]) # will hold list of all reads spanning this junction where mate has poor mapping quality
-        self.linearReads = deque([]) # all that look like true linear reads
-        self.anomalyReads = deque([]) # all that don't look like circular or linear
-        self.unknownReads = deque([]) # will hold list of all reads initially
+        if keepReads:
+            self.circularReads = [] # will hold list of all reads spanning this junction that support circle
+            self.decoyReads = [] # will hold list of all reads spanning this junction that do not support circle
+            self.unmappedReads = [] # will hold list of all reads spanning this junction where mate is not mapped
+            self.multimappedReads = [] # will hold list of all reads spanning this junction where mate has poor mapping quality
+            self.linearReads = [] # all that look like true linear reads
+            self.anomalyReads = [] # all that don't look like circular or linear
+            self.unknownReads = [] # will hold list of all reads initially
+        else:
+            self.circularReads = self.decoyReads = self.unmappedReads = self.multimappedReads = ()
+            self.linearReads = self.anomalyReads = self.unknownReads = ()
         self.fdr=None # will hold FDR or p-value printed in the per-junction report file  
+        # the report uses the circular reads for scrambled junctions and the linear reads for reg junctions
+        if "|reg|" in self.id:
+            self.stats = juncStats("linear")
+        else:
+            self.stats = juncStats("circular")
         
     def __str__(self):
         msg = "\nid: " + str(self.id)
@@ -279,51 +352,192 @@ class juncObj:
         return msg
     
     def setInfo(self):
-        match = id_patt.search(self.id)
-        if match:
-            # if the 2 genes are the same, the junction involves only 1 gene
-            if match.group(G_GENE1) == match.group(G_GENE2):
-                numGenes = 1
-            else:
-                numGenes = 2
-            
+        info = getJuncInfo(self.id)
+        if info:
             # chr, direction, junctionType, numGenes, minPos, maxPos
-            return match.group(G_CHR), match.group(G_JUNC_STRAND), match.group(G_JUNC_TYPE), numGenes, min(int(match.group(G_POS1)), int(match.group(G_POS2))), max(int(match.group(G_POS1)), int(match.group(G_POS2))) 
+            return info
         else:
             return None,None,None,None,0,0
-            
+    
+    # assign a read that has been through updateInfo to the bucket for its read type and count it in stats
+    # param r: juncReadObj
+    # param keepRead: False to only count the read, for junctions created with keepReads False
+    #
+    # return: the READ_CATEGORIES entry for the bucket, or None if the read is ignored
+    def addRead(self, r, keepRead):
+        if r.readType == "c":
+            category = "circular"
+            reads = self.circularReads
+        elif r.readType == "d":
+            category = "decoy"
+            reads = self.decoyReads
+        elif r.readType == "l":
+            category = "linear"
+            reads = self.linearReads
+        elif r.readType == "a":
+            category = "anomaly"
+            reads = self.anomalyReads
+        elif r.readType == "i":
+            # we are ignoring this read because Rd1 aligned to reg and Rd2 aligned to scrambled
+            return None
+        else:
+            if r.mateGenomic or r.mateJunction or r.mateRegJunction or r.mateDenovoJunction:
+                # the mate did map, but had very poor mapping quality so we are discarding it
+                category = "multimapped"
+                reads = self.multimappedReads
+            else:
+                # either mate was not in the file or did not align to either genome or junction index
+                category = "unmapped"
+                reads = self.unmappedReads
+        
+        if keepRead:
+            reads.append(r)
+        self.stats.add(r, category)
+        
+        return category
+
+# Totals for the reads assigned to a junction, everything needed to write the junction report.
+# Once there are too many reads to list their alignment scores in the report, the scores are kept
+# as counts per score, so the size does not grow with the number of reads.
+class juncStats(object):
+    __slots__ = ['reportCategory', 'numReads', 'statSum', 'numBases', 'decoyStatSum', 'decoyBases', 'scores', 'scoreCounts1',
+                 'scoreCounts2', 'pairCounts']
+    
+    # param reportCategory: category of the reads the p-value and scores in the report are based on
+    def __init__(self, reportCategory):
+        self.reportCategory = reportCategory
+        self.numReads = [0] * len(READ_CATEGORIES)  # number of reads in each category
+        self.statSum = 0  # sum of readStat for reads in reportCategory
+        self.numBases = 0  # bases in reads in reportCategory and their mates
+        self.decoyStatSum = 0  # sum of readStat for decoy reads, counted twice if the read has a mate since it is the avg of the 2
+        self.decoyBases = 0  # bases in decoy reads and their mates
+        self.scores = []  # (Rd1 score, Rd2 score or None) for the first MAX_LISTED_SCORES reads in reportCategory
+        self.scoreCounts1 = None  # Rd1 score: number of reads in reportCategory, once there are more than MAX_LISTED_SCORES
+        self.scoreCounts2 = None  # Rd2 score: number of reads in reportCategory that have a mate, same as scoreCounts1
+        self.pairCounts = Counter()  # (Rd1 score, Rd2 score or None): number of circular and linear reads
+    
+    # return: number of reads in category
+    def count(self, category):
+        return self.numReads[CATEGORY_INDEX[category]]
+    
+    def add(self, r, category):
+        self.numReads[CATEGORY_INDEX[category]] += 1
+        
+        if r.useMate:
+            mateScore = r.useMate.aScore
+        else:
+            mateScore = None
+        
+        if category == "circular" or category == "linear":
+            self.pairCounts[(r.juncRead.aScore, mateScore)] += 1
+        
+        if category == self.reportCategory:
+            self.statSum += r.readStat
+            self.numBases += r.juncRead.readLen
+            if r.useMate:
+                self.numBases += r.useMate.readLen
+            self.addScore(r.juncRead.aScore, mateScore)
+        elif category == "decoy":
+            self.decoyStatSum += r.readStat
+            self.decoyBases += r.juncRead.readLen
+            if r.useMate:
+                self.decoyStatSum += r.readStat
+                self.decoyBases += r.useMate.readLen
+    
+    # switch from listing the scores to counting them
+    def countScores(self):
+        self.scoreCounts1 = Counter([score1 for score1, mateScore in self.scores])
+        self.scoreCounts2 = Counter([mateScore for score1, mateScore in self.scores if mateScore is not None])
+        self.scores = None
+    
+    # param mateScore: Rd2 score, None if the read has no mate
+    def addScore(self, score1, mateScore):
+        if self.scoreCounts1 is None:
+            self.scores.append((score1, mateScore))
+            if len(self.scores) > MAX_LISTED_SCORES:
+                self.countScores()  # too many to list
+        else:
+            self.scoreCounts1[score1] += 1
+            if mateScore is not None:
+                self.scoreCounts2[mateScore] += 1
+    
+    # add the counts of other, the stats for the same junction from a different set of reads
+    def merge(self, other):
+        self.numReads = [n + otherN for n, otherN in zip(self.numReads, other.numReads)]
+        self.statSum += other.statSum
+        self.numBases += other.numBases
+        self.decoyStatSum += other.decoyStatSum
+        self.decoyBases += other.decoyBases
+        self.pairCounts.update(other.pairCounts)
+        
+        if other.scoreCounts1 is None:
+            for score1, mateScore in other.scores:
+                self.addScore(score1, mateScore)
+        else:
+            if self.scoreCounts1 is None:
+                self.countScores()
+            self.scoreCounts1.update(other.scoreCounts1)
+            self.scoreCounts2.update(other.scoreCounts2)
+    
+    # return: number of circular and linear reads with scores at or above the cutoff
+    # param cutoff: (Rd1 min score, Rd2 min score), Rd2 is not checked if isSingleEnd
+    def numPassing(self, cutoff, isSingleEnd):
+        return sum([n for (score1, score2), n in self.pairCounts.iteritems()
+                    if score1 >= int(cutoff[0]) and (isSingleEnd or score2 >= int(cutoff[1]))])
+    
+# a namedtuple has no per-instance dict, so a read takes no more memory than a tuple of its fields
+readObj = namedtuple('readObj', ['name', 'flag', 'refName', 'offset', 'aScore', 'nextBest', 'mapQual', 'baseName', 'readLen', 'numN'])
 
+# CIGAR operations look like 10S90M, the operations in QUERY_CIGAR_OPS use up bases of the read
+cigar_patt = re.compile("(\d+)([MIDNSHP=X])")
+QUERY_CIGAR_OPS = "MIS=X"
+cigarLengths = {}  # CIGAR string: read length, there are only a handful of distinct CIGAR strings in a file
 
+# the optional sam fields that are used, found with a single scan of the tab-separated optional fields.
+# Later occurrences of a tag replace earlier ones.
+tag_patt = re.compile("\t(AS|XS|XN|MD):[A-Za-z]:(\S*)")
 
-readObj = namedtuple('readObj', ['name', 'flag', 'refName', 'offset', 'aScore', 'nextBest', 'mapQual', 'baseName', 'readLen', 'numN'])
+# FLAG and MAPQ are always in this range, looking them up is much faster than calling int() for every read
+SMALL_INTS = dict((str(i), i) for i in xrange(4096))
+
+# return: number of bases in the read according to the CIGAR string, or None if there is no CIGAR
+def cigarReadLen(cigar):
+    if cigar == "*":
+        return None
+    readLen = sum([int(num) for num, op in cigar_patt.findall(cigar) if op in QUERY_CIGAR_OPS])
+    cigarLengths[cigar] = readLen
+    return readLen
 
-# param vals: result of calling line.strip().split() on a non-header line from sam file.
+# param line: a non-header line from sam file. Only the first 11 fields are split out, the optional fields
+#             are scanned once for the few that are used.
 # param readIdStyle: for now, options are just "appended" or "complete".
 #                    "appended" means /1 or /2 added to read 1 or read 2 respectively
 #                    "complete" means same id used in read1 and read2 files 
-# Need to store read length because trimming could result in different lengths of reads within a single dataset
-def newReadObj(vals, readIdStyle):
+# Need to store read length because trimming could result in different lengths of reads within a single dataset.
+# It is taken from the CIGAR string so the read sequence does not need to be looked at.
+#
+# return: readObj, with ints for all numeric fields. aScore and nextBest are None if the field was not present
+def newReadObj(line, readIdStyle):
+    vals = line.split("\t", 11)
+    
     numN = 0
     mmStr = ""
     myScore = None
     myNextBest = None
-    optFields = vals[11:]  
-    
-    for x in optFields:
-        curOpt = x.split(":")
-        if curOpt[0] == "AS":
-            myScore = curOpt[2]
-        elif curOpt[0] == "XS":  # next best score
-            myNextBest = curOpt[2]
-        elif curOpt[0] == "XN":  # num N in reference
-            numN = int(curOpt[2]) 
-        elif curOpt[0] == "MD":  # string representing mismatch locations
-            mmStr = curOpt[2]
+    if len(vals) > 11:
+        for tag, value in tag_patt.findall("\t" + vals[11]):
+            if tag == "AS":  # alignment score
+                myScore = int(value)
+            elif tag == "XS":  # next best score
+                myNextBest = int(value)
+            elif tag == "XN":  # num N in reference
+                numN = int(value)
+            else:  # MD, string representation of mismatch locations
+                mmStr = value
             
     # correct for N-penalty in junction alignments and update alignment score as needed
     if numN > 0:
-        match = id_patt.search(vals[2])  # if this is a junction alignment, refName will fit this pattern
-        if match:  # only want to adjust junction alignments 
+        if getJuncInfo(vals[2]):  # only want to adjust junction alignments, refName will be a junction id 
             # get MD string, string representation of where the mismatches or Ns occurred
             # if Ns are on left the pattern is 0N, if on right of match the pattern is N0
             match_md = md_patt.search(mmStr)
@@ -331,8 +545,7 @@ def newReadObj(vals, readIdStyle):
             numNinStr = match_md.group(2).count("N0")
             # confirm agreement between XN and MD string
             if numNinStr == numN or numOinStr == numN or numNinStr + numOinStr == numN: 
-                myOrigScore = myScore
-                myScore = str(int(myScore) + numN) # 1 was deducted from score for each N matched in reference so add back, keep as string for consistency
+                myScore = myScore + numN # 1 was deducted from score for each N matched in reference so add back
             else:
                 print "could not update AS for", vals[0], "MD and XN do not agree", mmStr, str(numN) 
                     
@@ -340,5 +553,23 @@ def newReadObj(vals, readIdStyle):
         myBaseName = vals[0][:-1]  # name without trailing 1 or 2 so we can quickly match up paired reads
     else:
         myBaseName = vals[0]  # or sometimes the read ids are already the same in the 2 separate files  
-        
-    return readObj(name=vals[0], flag=int(vals[1]), refName=vals[2], offset=vals[3], aScore=myScore, nextBest=myNextBest, mapQual=vals[4], baseName=myBaseName, readLen=len(vals[9]), numN=numN)
+    
+    readLen = cigarLengths.get(vals[5])
+    if readLen is None:
+        readLen = cigarReadLen(vals[5])
+        if readLen is None:
+            readLen = len(vals[9])
+    
+    # positional arguments in readObj field order, this is called for every aligned read so it is worth skipping the keywords.
+    # refName is interned so all reads to the same junction or chromosome share 1 copy of the name
+    return readObj(vals[0], SMALL_INTS[vals[1]], intern(vals[2]), int(vals[3]), myScore, myNextBest, SMALL_INTS[vals[4]], myBaseName, readLen, numN)
+
+# param line: a non-header line from sam file
+# param readIdStyle: same as for newReadObj
+#
+# return: the baseName newReadObj would give the read, without decoding the rest of the line 
+def samBaseName(line, readIdStyle):
+    if readIdStyle == "appended":
+        return line[:line.find("\t") - 1]
+    else:
+        return line[:line.find("\t")]
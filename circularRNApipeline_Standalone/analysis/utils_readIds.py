@@ -0,0 +1,57 @@
+# Compact storage for large sets of read ids, like the ids of all reads that aligned to the genome.
+#
+# Only the 64-bit hash of each read id is kept, in a sorted numpy array, so a read id takes 8 bytes instead of
+# the ~100 bytes of a string in a dict. Membership is checked for many read ids at once with searchsorted.
+# Two different read ids can have the same hash, so a read id that is not in the set may be reported as being
+# in it (but never the other way around). Callers that need to rule this out check the hits against the
+# original ids (see notIgnored in filterFDR.py).
+
+import array
+import numpy as np
+
+CHUNK_SIZE = 10000000  # hashes collected in an array before they are sorted into a numpy array
+
+# return: numpy array with the hash of each read id, python string hashes are 64 bits on 64-bit platforms
+def readIdHashes(readIds):
+    return np.fromiter((hash(readId) for readId in readIds), dtype=np.int64, count=len(readIds))
+
+class readIdSet:
+    def __init__(self):
+        self.hashes = np.zeros(0, dtype=np.int64)  # sorted, no duplicates
+        self.chunks = []  # sorted arrays of hashes added since hashes was last updated
+        self.pending = array.array("l")  # hashes added since the last chunk was made
+
+    def add(self, readId):
+        self.pending.append(hash(readId))
+        if len(self.pending) == CHUNK_SIZE:
+            self.addPending()
+
+    # sort the pending hashes into a chunk, dropping duplicates since a read can be in an id file many times
+    def addPending(self):
+        if self.pending:
+            self.chunks.append(np.unique(np.frombuffer(self.pending, dtype=np.int64)))
+            self.pending = array.array("l")
+
+    # merge everything added so far into hashes
+    def update(self):
+        self.addPending()
+        if self.chunks:
+            self.hashes = np.unique(np.concatenate([self.hashes] + self.chunks))
+            self.chunks = []
+
+    # return: numpy bool array, True for each read id that is in the set (or has the same hash as one that is)
+    def contains(self, readIds):
+        self.update()
+        queries = readIdHashes(readIds)
+        if len(self.hashes) == 0:
+            return np.zeros(len(queries), dtype=bool)
+        idx = np.searchsorted(self.hashes, queries)
+        idx[idx == len(self.hashes)] = 0
+        return self.hashes[idx] == queries
+
+    def __contains__(self, readId):
+        return bool(self.contains([readId])[0])
+
+    def __len__(self):
+        self.update()
+        return len(self.hashes)
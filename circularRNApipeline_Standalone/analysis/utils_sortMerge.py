@@ -0,0 +1,106 @@
+# Sorting and merging of read id and sam files by read id, so the records for a read can be joined
+# across files without holding the ids or alignments of all reads in memory.
+#
+# Files are sorted with the external sort command, which spills to temporary files once its buffer is full,
+# in byte order (LC_ALL=C) so the order matches python string comparison. Each line of a sorted file is
+# prefixed with the base read id (the part of the id shared by Rd1 and Rd2) and a tab.
+#
+# Files can also be split by the hash of the base read id, so all of the records for a read end up in the same part.
+
+import heapq
+import os
+import subprocess
+import utils_bam
+from itertools import groupby
+
+SORT_BUFFER = "256M"  # memory used by each sort before it spills to disk
+
+# param readId: read id as it appears in a sam or id file
+# param readIdStyle: "appended" if /1 or /2 was added to read 1 or read 2, "complete" if the ids are the same in both files
+#
+# return: the part of the read id that is the same between Rd1 and Rd2
+def readBaseName(readId, readIdStyle):
+    if readIdStyle == "appended":
+        return readId[:-1]
+    else:
+        return readId
+
+# sort the lines of a read id or sam file by base read id. Header lines starting with @ are dropped.
+# Lines for the same read stay in the order they had in inFile (the sort is stable).
+# param inFile: file with the read id in the first column. For a sam file that does not exist, the bam file
+#               with the same name is read instead (see utils_bam.openAlignments)
+# param outFile: sorted file to write
+# param tmpDir: directory for the temporary files of the sort
+# param numThreads: number of threads to decompress a bam file with
+def sortByReadBase(inFile, outFile, readIdStyle, tmpDir, numThreads=utils_bam.NUM_THREADS):
+    handle = utils_bam.openAlignments(inFile, numThreads)
+
+    env = dict(os.environ)
+    env["LC_ALL"] = "C"
+    sortProc = subprocess.Popen(["sort", "-t", "\t", "-k1,1", "-s", "-S", SORT_BUFFER, "-T", tmpDir, "-o", outFile],
+                                stdin=subprocess.PIPE, env=env)
+    for line in handle:
+        if not line.startswith("@") and line.strip():
+            sortProc.stdin.write(readBaseName(line.split(None, 1)[0], readIdStyle) + "\t" + line)
+    handle.close()
+    sortProc.stdin.close()
+
+    if sortProc.wait() != 0:
+        raise IOError("could not sort " + inFile)
+
+# split the lines of a read id or sam file into parts by the hash of the base read id. Header lines starting with @
+# are dropped. Lines for the same read go to the same part, in the order they had in inFile.
+# param inFile: file with the read id in the first column, as for sortByReadBase
+# param outFiles: file to write for each part
+#
+# return: number of lines read from inFile
+def partitionByReadBase(inFile, outFiles, readIdStyle, numThreads=utils_bam.NUM_THREADS):
+    handle = utils_bam.openAlignments(inFile, numThreads)
+
+    out_handles = [open(outFile, "wb") for outFile in outFiles]
+    numLines = 0
+    for line in handle:
+        numLines += 1
+        if not line.startswith("@") and line.strip():
+            out_handles[hash(readBaseName(line.split(None, 1)[0], readIdStyle)) % len(out_handles)].write(line)
+    handle.close()
+    for out_handle in out_handles:
+        out_handle.close()
+
+    return numLines
+
+# return: generator of (base read id, list of lines for the read) from a file written by sortByReadBase,
+#         lines are returned without the read id prefix
+def readGroups(sortedFile):
+    handle = open(sortedFile, "rU")
+    prevBase = None
+    for readBase, lines in groupby(handle, lambda line: line[:line.index("\t")]):
+        if prevBase is not None and readBase <= prevBase:
+            raise ValueError(sortedFile + " is not sorted by read id at " + readBase)
+        prevBase = readBase
+        yield readBase, [line[len(readBase) + 1:] for line in lines]
+    handle.close()
+
+# tag the groups from a sorted file with the position of the file in the merge
+def indexedGroups(sortedFile, index):
+    for readBase, lines in readGroups(sortedFile):
+        yield readBase, index, lines
+
+# k-way merge of files written by sortByReadBase.
+# param sortedFiles: list of sorted files
+#
+# return: generator of (base read id, list with the lines for the read from each file), in read id order.
+#         A read can be missing from any of the files, in which case its list of lines is empty.
+def mergeByReadBase(sortedFiles):
+    curBase = None
+    curGroups = None
+    for readBase, index, lines in heapq.merge(*[indexedGroups(f, i) for i, f in enumerate(sortedFiles)]):
+        if readBase != curBase:
+            if curBase is not None:
+                yield curBase, curGroups
+            curBase = readBase
+            curGroups = [[] for f in sortedFiles]
+        curGroups[index] = lines
+
+    if curBase is not None:
+        yield curBase, curGroups
@@ -0,0 +1,86 @@
+# Wall and CPU time, peak memory, and lines parsed for each stage of a run, written to a JSON file
+# so slow runs can be broken down and runs can be compared over time.
+#
+#   timing = stageStats()
+#   timing.start("parseSam r1j")
+#   ...  # timing.addLines(n) for the lines parsed
+#   timing.stop(junctions=len(junctions))  # object counts to record for the stage
+#   timing.write("sample_stageStats.json", {"sampleId": "sample"})
+
+import json
+import resource
+import time
+
+# return: (user + system CPU seconds, peak RSS in MB) for this process or for its finished child processes
+def usage(who):
+    info = resource.getrusage(who)
+    return info.ru_utime + info.ru_stime, info.ru_maxrss / 1024.0  # ru_maxrss is in KB on linux
+
+class stageStats:
+    def __init__(self):
+        self.stages = []  # dict of measurements for each stage, in the order they were run
+        self.cur = None  # stage that has been started and not stopped
+        self.wallStart = time.time()
+
+    # start timing a stage, the current stage is stopped first if it is still running
+    def start(self, name):
+        if self.cur:
+            self.stop()
+        self.cur = {"name": name, "lines": 0, "wall": time.time(),
+                    "cpu": usage(resource.RUSAGE_SELF)[0], "childCpu": usage(resource.RUSAGE_CHILDREN)[0]}
+
+    # param numLines: number of lines of input parsed in the current stage
+    def addLines(self, numLines):
+        if self.cur:
+            self.cur["lines"] += numLines
+
+    # stop timing the current stage
+    # param objects: name: number of objects held at the end of the stage, like the number of junctions
+    def stop(self, **objects):
+        if not self.cur:
+            return
+
+        wallSeconds = time.time() - self.cur["wall"]
+        cpu, peakRss = usage(resource.RUSAGE_SELF)
+        childCpu, childPeakRss = usage(resource.RUSAGE_CHILDREN)
+        if wallSeconds > 0:
+            linesPerSecond = self.cur["lines"] / wallSeconds
+        else:
+            linesPerSecond = None
+
+        self.stages.append({"stage": self.cur["name"],
+                            "wallSeconds": round(wallSeconds, 3),
+                            "cpuSeconds": round(cpu - self.cur["cpu"], 3),
+                            "childCpuSeconds": round(childCpu - self.cur["childCpu"], 3),  # worker processes
+                            "peakRssMB": round(peakRss, 1),  # highest so far in the run
+                            "childPeakRssMB": round(childPeakRss, 1),
+                            "lines": self.cur["lines"],
+                            "linesPerSecond": linesPerSecond and round(linesPerSecond, 1),
+                            "objects": objects})
+        self.cur = None
+
+    # add the stages timed in another process, like a worker, to these stages
+    # param prefix: prepended to the name of each stage
+    def addStages(self, stages, prefix):
+        for stage in stages:
+            stage = dict(stage)
+            stage["stage"] = prefix + stage["stage"]
+            self.stages.append(stage)
+
+    # write the stages to a JSON file, the current stage is stopped first if it is still running
+    # param info: dict of information about the run to include, like the sample id and options
+    def write(self, fileName, info):
+        self.stop()
+        cpu, peakRss = usage(resource.RUSAGE_SELF)
+        childCpu, childPeakRss = usage(resource.RUSAGE_CHILDREN)
+
+        handle = open(fileName, "wb")
+        json.dump({"info": info,
+                   "wallSeconds": round(time.time() - self.wallStart, 3),
+                   "cpuSeconds": round(cpu, 3),
+                   "childCpuSeconds": round(childCpu, 3),
+                   "peakRssMB": round(peakRss, 1),
+                   "childPeakRssMB": round(childPeakRss, 1),
+                   "stages": self.stages}, handle, indent=2, sort_keys=True)
+        handle.write("\n")
+        handle.close()
@@ -148,7 +148,7 @@ then
     echo "MODE is $MODE"
     if [[ $MODE = *unaligned* ]]
     then
-      ../analysis/align.sh $READ_FILE $SAMPLE_ID $ALIGN_PARDIR $DATASET_NAME $MODE denovo_${DATASET_NAME}_${DENOVOCIRC} denovo denovo_${DATASET_NAME}_onlycircles${DENOVOCIRC}.fa &
+      ../analysis/align.sh $READ_FILE $SAMPLE_ID $ALIGN_PARDIR $DATASET_NAME $MODE denovo_${DATASET_NAME}_${DENOVOCIRC} denovo denovo_${DATASET_NAME}_onlycircles${DENOVOCIRC}.fa ${JUNCTION_MIDPOINT} ${OVERLAP} &
       echo "Launched align into the background "`date`
     else
       ../analysis/align.sh $READ_FILE $SAMPLE_ID $ALIGN_PARDIR $DATASET_NAME $MODE ${bt_prefix}_genome genome ${bt_prefix}_genome.fa &
@@ -180,8 +180,8 @@ then
     do
       READ_FILE=`awk 'FNR == '${i}' {print $1}' $TASK_DATA_FILE`
       SAMPLE_ID=`awk 'FNR == '${i}' {print $2}' $TASK_DATA_FILE`
-      ../analysis/align.sh $READ_FILE $SAMPLE_ID $ALIGN_PARDIR $DATASET_NAME $MODE ${bt_prefix}_junctions_scrambled junction ${bt_prefix}_junctions_scrambled.fa &
-      ../analysis/align.sh $READ_FILE $SAMPLE_ID $ALIGN_PARDIR $DATASET_NAME $MODE ${bt_prefix}_junctions_reg reg ${bt_prefix}_junctions_reg.fa &
+      ../analysis/align.sh $READ_FILE $SAMPLE_ID $ALIGN_PARDIR $DATASET_NAME $MODE ${bt_prefix}_junctions_scrambled junction ${bt_prefix}_junctions_scrambled.fa ${JUNCTION_MIDPOINT} ${OVERLAP} &
+      ../analysis/align.sh $READ_FILE $SAMPLE_ID $ALIGN_PARDIR $DATASET_NAME $MODE ${bt_prefix}_junctions_reg reg ${bt_prefix}_junctions_reg.fa ${JUNCTION_MIDPOINT} ${OVERLAP} &
       echo "Launched 2 junction aligns into the background "`date`
       
       # only want to launch for 1 sample at a time and then wait for completion so we don't overwhelm the server
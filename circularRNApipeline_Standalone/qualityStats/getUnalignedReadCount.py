@@ -11,10 +11,13 @@
 import argparse
 import os
 import gzip
+import utils_bam
 from ParseFastQ import ParseFastQ
 
+# the bam file with the same name is read directly if there is no sam file. Files with just a read id on
+# each line can also be read.
 def addAlignedIds(samFile):
-    handle = open(samFile, "rU")
+    handle = utils_bam.openAlignments(samFile)
 
     for line in handle:
         if not line.startswith("@"): # ignore header lines
@@ -44,6 +47,13 @@ if __name__  == "__main__":
         addAlignedIds("".join(["/".join([args.alignmentDir, "reg", args.fileBaseName]), "_reg_output.sam"]))
         addAlignedIds("".join(["/".join([args.alignmentDir, "ribo", args.fileBaseName]), "_ribo_output.sam"]))
         
+        # in stream mode the junction sam files only have the reads that overlap a junction, the ids of the
+        # other reads that aligned to the junction indices are written to a separate file by streamAlignedReads.py
+        for indexName in ["junction", "reg"]:
+            idFile = "".join(["/".join([args.alignmentDir, indexName, args.fileBaseName]), "_", indexName, "_output_nonOverlapIds.txt"])
+            if os.path.exists(idFile):
+                addAlignedIds(idFile)
+        
         # get each id from fastq file, add it to a dict if not in the aligned dict
         parser = ParseFastQ(args.readFile)
         for (seqHeader, seqStr, qualHeader, qualStr) in parser:
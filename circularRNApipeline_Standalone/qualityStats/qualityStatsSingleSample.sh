@@ -43,81 +43,102 @@ else
 fi
 TOTAL_READS=`echo "scale=0; $TOTAL_READ_LINES/4" | bc -l`
   
+# preprocessAlignedReads.py writes the counts for each id file to a _stats.txt file next to it in the same pass
+# that writes the id file, they are read from there instead of rescanning the id file unless the id file is newer
+# usage: hasStats idFile
+hasStats() {
+  [ -f "${1%.txt}_stats.txt" ] && [ ! "$1" -nt "${1%.txt}_stats.txt" ]
+}
+
+# usage: statValue idFile name
+statValue() {
+  awk -v name="$2" '$1 == name {print $2}' "${1%.txt}_stats.txt"
+}
+
 GENOME_FILE=${ID_DIR}/${GENOME_DIRNAME}/${SAMPLE_ID}_genome_output.txt  
-TOTAL_GENOME=`wc -l $GENOME_FILE | awk '{print $1}'`
+if hasStats $GENOME_FILE
+then
+  TOTAL_GENOME=`statValue $GENOME_FILE lines`
+  GENOME_POS=`statValue $GENOME_FILE pos`
+  GENOME_NEG=`statValue $GENOME_FILE neg`
+  HBB_READS=`statValue $GENOME_FILE hbb`
+else
+  TOTAL_GENOME=`wc -l $GENOME_FILE | awk '{print $1}'`
+  GENOME_POS=`awk '$2 == 0 {print $2}' $GENOME_FILE | wc -l`
+  GENOME_NEG=`awk '$2 == 16 {print $2}' $GENOME_FILE | wc -l`
+  # count reads mapping with offset within HBB CDS (chr11 617350-621570) from ucsc hg19 knowngenes file
+  HBB_READS=`awk '$3 == "chr11" && $4 >= 617350 && $4 <= 621570 {print $1}' $GENOME_FILE | wc -l`
+fi
 PERCENT_GENOME=`echo "scale=4; $TOTAL_GENOME/$TOTAL_READS" | bc -l`
-GENOME_POS=`awk '$2 == 0 {print $2}' $GENOME_FILE | wc -l`
 GENOME_POS=`echo "scale=2; $GENOME_POS/$TOTAL_GENOME" | bc -l`
-GENOME_NEG=`awk '$2 == 16 {print $2}' $GENOME_FILE | wc -l`
 GENOME_NEG=`echo "scale=2; $GENOME_NEG/$TOTAL_GENOME" | bc -l`
   
-# count reads mapping with offset within HBB CDS (chr11 617350-621570) from ucsc hg19 knowngenes file
-HBB_READS=`awk '$3 == "chr11" && $4 >= 617350 && $4 <= 621570 {print $1}' $GENOME_FILE | wc -l`
-  
 JUNC_FILE=${ID_DIR}/${JUNC_DIRNAME}/${SAMPLE_ID}_junction_output.txt
-TOTAL_JUNC=`wc -l $JUNC_FILE | awk '{print $1}'`
+if hasStats $JUNC_FILE
+then
+  TOTAL_JUNC=`statValue $JUNC_FILE lines`
+  JUNC_POS=`statValue $JUNC_FILE pos`
+  JUNC_NEG=`statValue $JUNC_FILE neg`
+else
+  TOTAL_JUNC=`wc -l $JUNC_FILE | awk '{print $1}'`
+  # since - strand junctions are actually stored as reverse complement in index, neg alignments to - strand genes are actually pos alignments
+  JUNC_POS=`awk '($3 ~ /+$/ && $2 == 0) || ($3 ~ /-$/ && $2 == 16) {print $2}' $JUNC_FILE | wc -l`
+  JUNC_NEG=`awk '($3 ~ /+$/ && $2 == 16) || ($3 ~ /-$/ && $2 == 0) {print $2}' $JUNC_FILE | wc -l`
+fi
 PERCENT_JUNC=`echo "scale=4; $TOTAL_JUNC/$TOTAL_READS" | bc -l`
-# since - strand junctions are actually stored as reverse complement in index, neg alignments to - strand genes are actually pos alignments
-JUNC_POS=`awk '($3 ~ /+$/ && $2 == 0) || ($3 ~ /-$/ && $2 == 16) {print $2}' $JUNC_FILE | wc -l`
 JUNC_POS=`echo "scale=2; $JUNC_POS/$TOTAL_JUNC" | bc -l`
-JUNC_NEG=`awk '($3 ~ /+$/ && $2 == 16) || ($3 ~ /-$/ && $2 == 0) {print $2}' $JUNC_FILE | wc -l`
 JUNC_NEG=`echo "scale=2; $JUNC_NEG/$TOTAL_JUNC" | bc -l`
   
 REG_FILE=${ID_DIR}/${REG_DIRNAME}/${SAMPLE_ID}_reg_output.txt
-TOTAL_REG=`wc -l $REG_FILE | awk '{print $1}'`
+if hasStats $REG_FILE
+then
+  TOTAL_REG=`statValue $REG_FILE lines`
+  REG_POS=`statValue $REG_FILE pos`
+  REG_NEG=`statValue $REG_FILE neg`
+else
+  TOTAL_REG=`wc -l $REG_FILE | awk '{print $1}'`
+  REG_POS=`awk '($3 ~ /+$/ && $2 == 0) || ($3 ~ /-$/ && $2 == 16) {print $2}' $REG_FILE | wc -l`
+  REG_NEG=`awk '($3 ~ /+$/ && $2 == 16) || ($3 ~ /-$/ && $2 == 0) {print $2}' $REG_FILE | wc -l`
+fi
 PERCENT_REG=`echo "scale=4; $TOTAL_REG/$TOTAL_READS" | bc -l`
-REG_POS=`awk '($3 ~ /+$/ && $2 == 0) || ($3 ~ /-$/ && $2 == 16) {print $2}' $REG_FILE | wc -l`
 REG_POS=`echo "scale=2; $REG_POS/$TOTAL_REG" | bc -l`
-REG_NEG=`awk '($3 ~ /+$/ && $2 == 16) || ($3 ~ /-$/ && $2 == 0) {print $2}' $REG_FILE | wc -l`
 REG_NEG=`echo "scale=2; $REG_NEG/$TOTAL_REG" | bc -l`
   
 RIBO_FILE=${ID_DIR}/${RIBO_DIRNAME}/${SAMPLE_ID}_ribo_output.txt
-TOTAL_RIBO=`wc -l $RIBO_FILE | awk '{print $1}'`
+if hasStats $RIBO_FILE
+then
+  TOTAL_RIBO=`statValue $RIBO_FILE lines`
+  RIBO_POS=`statValue $RIBO_FILE pos`
+  RIBO_NEG=`statValue $RIBO_FILE neg`
+  RIBO_28S=`statValue $RIBO_FILE 28S`
+  RIBO_18S=`statValue $RIBO_FILE 18S`
+  RIBO_58S=`statValue $RIBO_FILE 5.8S`
+  RIBO_5SDNA=`statValue $RIBO_FILE 5SDNA`
+  RIBO_5SrRNA=`statValue $RIBO_FILE 5SrRNA`
+else
+  TOTAL_RIBO=`wc -l $RIBO_FILE | awk '{print $1}'`
+  RIBO_POS=`awk '$2 == 0 {print $2}' $RIBO_FILE | wc -l`
+  RIBO_NEG=`awk '$2 == 16 {print $2}' $RIBO_FILE | wc -l`
+  # parse out the reads per ribo subunit
+  RIBO_28S=`grep "gi|224514641:112587-119176" $RIBO_FILE | wc -l`
+  RIBO_18S=`grep "gi|224514641:109078-110946" $RIBO_FILE | wc -l`
+  RIBO_58S=`grep "gi|224514641:112025-112180" $RIBO_FILE | wc -l`
+  RIBO_5SDNA=`grep "gi|23898|emb|X12811.1|" $RIBO_FILE | wc -l`
+  RIBO_5SrRNA=`grep "hg19_5SrRna" $RIBO_FILE | wc -l`
+fi
 PERCENT_RIBO=`echo "scale=4; $TOTAL_RIBO/$TOTAL_READS" | bc -l`
-RIBO_POS=`awk '$2 == 0 {print $2}' $RIBO_FILE | wc -l`
 RIBO_POS=`echo "scale=2; $RIBO_POS/$TOTAL_RIBO" | bc -l`
-RIBO_NEG=`awk '$2 == 16 {print $2}' $RIBO_FILE | wc -l`
 RIBO_NEG=`echo "scale=2; $RIBO_NEG/$TOTAL_RIBO" | bc -l`
-  
-# parse out the reads per ribo subunit
-RIBO_28S=`grep "gi|224514641:112587-119176" $RIBO_FILE | wc -l`
-RIBO_18S=`grep "gi|224514641:109078-110946" $RIBO_FILE | wc -l`
-RIBO_58S=`grep "gi|224514641:112025-112180" $RIBO_FILE | wc -l`
-RIBO_5SDNA=`grep "gi|23898|emb|X12811.1|" $RIBO_FILE | wc -l`
-RIBO_5SrRNA=`grep "hg19_5SrRna" $RIBO_FILE | wc -l`
 RIBO_28S=`echo "scale=4; $RIBO_28S/$TOTAL_RIBO" | bc -l`
 RIBO_18S=`echo "scale=4; $RIBO_18S/$TOTAL_RIBO" | bc -l`
 RIBO_58S=`echo "scale=4; $RIBO_58S/$TOTAL_RIBO" | bc -l`
 RIBO_5SDNA=`echo "scale=4; $RIBO_5SDNA/$TOTAL_RIBO" | bc -l`
 RIBO_5SrRNA=`echo "scale=4; $RIBO_5SrRNA/$TOTAL_RIBO" | bc -l`
   
-# get count of reads that did not align anywhere
-# first convert bam to sam if necessary, just check one file and assume all sam files exist if one does
-f=`find ${SAM_DIR}/${GENOME_DIRNAME} -type f -name ${SAMPLE_ID}_${GENOME_DIRNAME}_output.sam`
-if [ ! -f "$f" ]
-then
-  DO_CONVERT=true
-  echo "Did not find sam files, need to convert bam to sam for further processing"
-  f=`find ${SAM_DIR}/${GENOME_DIRNAME} -type f -name ${SAMPLE_ID}_${GENOME_DIRNAME}_output.bam`
-  # first convert to sam file for reading
-  samtools view ${f} > ${SAM_DIR}/${GENOME_DIRNAME}/${SAMPLE_ID}_${GENOME_DIRNAME}_output.sam
-  samtools view ${SAM_DIR}/${JUNC_DIRNAME}/${SAMPLE_ID}_${JUNC_DIRNAME}_output.bam > ${SAM_DIR}/${JUNC_DIRNAME}/${SAMPLE_ID}_${JUNC_DIRNAME}_output.sam
-  samtools view ${SAM_DIR}/${REG_DIRNAME}/${SAMPLE_ID}_${REG_DIRNAME}_output.bam > ${SAM_DIR}/${REG_DIRNAME}/${SAMPLE_ID}_${REG_DIRNAME}_output.sam
-  samtools view ${SAM_DIR}/${RIBO_DIRNAME}/${SAMPLE_ID}_${RIBO_DIRNAME}_output.bam > ${SAM_DIR}/${RIBO_DIRNAME}/${SAMPLE_ID}_${RIBO_DIRNAME}_output.sam
-fi
-  
+# get count of reads that did not align anywhere, bam files are read directly if there are no sam files
 UNALIGNED=`python getUnalignedReadCount.py -r ${READ_FILE} -n ${SAMPLE_ID} -a ${SAM_DIR} -t ${NTRIM}`
 PERCENT_UNALIGNED=`echo "scale=4; $UNALIGNED/$TOTAL_READS" | bc -l`
   
-if [ "$DO_CONVERT" = true ]
-then 
-  # and then remove the temp file
-  rm ${SAM_DIR}/${GENOME_DIRNAME}/${SAMPLE_ID}_${GENOME_DIRNAME}_output.sam
-  rm ${SAM_DIR}/${JUNC_DIRNAME}/${SAMPLE_ID}_${JUNC_DIRNAME}_output.sam
-  rm ${SAM_DIR}/${REG_DIRNAME}/${SAMPLE_ID}_${REG_DIRNAME}_output.sam
-  rm ${SAM_DIR}/${RIBO_DIRNAME}/${SAMPLE_ID}_${RIBO_DIRNAME}_output.sam
-fi
-
 outfile="${OUTDIR_NAME}/${SAMPLE_ID}${OUTF}"
 echo -e "$SAMPLE_ID\t$TOTAL_READS\t$UNALIGNED ($PERCENT_UNALIGNED)\t$TOTAL_GENOME ($PERCENT_GENOME)\t$GENOME_POS, $GENOME_NEG\t$TOTAL_REG ($PERCENT_REG)\t$REG_POS, $REG_NEG\t$TOTAL_JUNC ($PERCENT_JUNC)\t$JUNC_POS, $JUNC_NEG\t$TOTAL_RIBO ($PERCENT_RIBO)\t$RIBO_POS, $RIBO_NEG\t$RIBO_28S\t$RIBO_18S\t$RIBO_58S\t$RIBO_5SDNA\t$RIBO_5SrRNA\t$HBB_READS" > $outfile
 
@@ -7,9 +7,12 @@
 # pipelineDirectory: path to the circularRNApipeline directory. Created files will be placed inside the index directory.
 # outputDirectory: the output directory specified in the call to createExonDB.sh for this species
 # fileIdentifier: should be short String to help distinguish it from other genomes. This will be included in all of the fasta file names and bowtie index file names
-# primaryGeneName: field in gtf used to assign gene name, default: gene_name
-# secondaryGeneName: field in gtf used to assign gene name if primary does not exist, default: gene_id
 # windowSize: size of sliding window to include exon pairs in junction database, default: 1000000
+# primaryGeneName, secondaryGeneName: no longer used here, gene names are now assigned by makeExonDB.py. Still accepted
+#                                     so the later arguments keep their positions
+# numWorkers: number of chromosomes to create junctions for at once, default: 1
+# dedup: yes to only keep 1 junction for each distinct sequence in each index, default: no
+#        The junctions left out are listed in ${FILE_ID}_junctions_reg_duplicates.txt and ${FILE_ID}_junctions_scrambled_duplicates.txt
 
 # example usage: ./createJunctionIndex.sh /home/linda/circularRNApipeline
 #                                        /home/linda/index/pombe
@@ -17,6 +20,8 @@
 #                                        1000000
 #                                        gene_name
 #                                        gene_id
+#                                        8
+#                                        yes
  
 PIPELINE_DIR=$1
 OUT_DIR=$2
@@ -31,45 +36,45 @@ fi
 
 if [ $# -ge 5 ]
 then
-  GENE_NAME_1=${5}
-else
-  GENE_NAME_1=gene_name
+  echo "warning: primaryGeneName ${5} and secondaryGeneName ${6} are ignored, gene names are assigned by makeExonDB.py"
 fi
 
-if [ $# -ge 6 ]
+if [ $# -ge 7 ]
 then
-  GENE_NAME_2=${6}
+  NUM_WORKERS=${7}
 else
-  GENE_NAME_2=gene_id
+  NUM_WORKERS=1
 fi
 
-python makeJunctionsAndWriteFasta.py -w ${WINDOW} -e ${OUT_DIR}/exons -r ${OUT_DIR}/records -f ${OUT_DIR}/fastas -n1 ${GENE_NAME_1} -n2 ${GENE_NAME_2} -v
-
-# combine into single file, using xargs method to avoid argument list too long error in bash
-
-echo "find ${OUT_DIR}/fastas/ -size 0 -delete"
-find ${OUT_DIR}/fastas/ -size 0 -delete
-
-echo "cat ${OUT_DIR}/fastas/*.fa > ${OUT_DIR}/${FILE_ID}.fa"
-cat ${OUT_DIR}/fastas/*.fa > ${OUT_DIR}/${FILE_ID}.fa  # combine into single file
-
-#ls ${OUT_DIR}/fastas | xargs -n 32 -P 8 cat >> ${OUT_DIR}/${FILE_ID}.fa  
+if [ $# -ge 8 ] && [ "${8}" = "yes" ]
+then
+  DEDUP_FLAG=-u
+else
+  DEDUP_FLAG=
+fi
 
-# split the junctions into files containing only reg, only rev, and only dup junctions
-python limitFasta.py -s ${OUT_DIR}/${FILE_ID}.fa -o ${OUT_DIR}/fastas/ -t reg -p _junctions_reg
-python limitFasta.py -s ${OUT_DIR}/${FILE_ID}.fa -o ${OUT_DIR}/fastas/ -t dup -p _junctions_dup
-python limitFasta.py -s ${OUT_DIR}/${FILE_ID}.fa -o ${OUT_DIR}/fastas/ -t rev -p _junctions_rev
+# create the junctions for each chromosome and combine them into a single file ordered by chromosome.
+# The per-chromosome files are kept in ${OUT_DIR}/fastas, so when this is rerun after makeExonDB.py is run with
+# an updated annotation only the chromosomes whose exons changed are redone.
+python makeJunctionsAndWriteFasta.py -w ${WINDOW} -e ${OUT_DIR}/exons -r ${OUT_DIR}/records -f ${OUT_DIR}/fastas -p ${NUM_WORKERS} -m ${OUT_DIR}/${FILE_ID}.fa -i -v || exit 1
 
-# combine rev and dup junctions into scrambled fasta file and put in the pipeline index
-echo "cat ${OUT_DIR}/fastas/${FILE_ID}_junctions_rev.fa ${OUT_DIR}/fastas/${FILE_ID}_junctions_dup.fa > ${PIPELINE_DIR}/index/${FILE_ID}_junctions_scrambled.fa"
-cat ${OUT_DIR}/fastas/${FILE_ID}_junctions_rev.fa ${OUT_DIR}/fastas/${FILE_ID}_junctions_dup.fa > ${PIPELINE_DIR}/index/${FILE_ID}_junctions_scrambled.fa
+# split the junctions into files containing only reg junctions and only scrambled (rev and dup) junctions in a single pass,
+# along with the junction metadata tables used by the analysis code
+python limitFasta.py -s ${OUT_DIR}/${FILE_ID}.fa -o ${OUT_DIR}/fastas/ -t reg scrambled -p _junctions -m ${DEDUP_FLAG}
 
-# put the regular junction fasta file into the pipeline index directory
+# put the scrambled and regular junction fasta files into the pipeline index directory
+mv ${OUT_DIR}/fastas/${FILE_ID}_junctions_scrambled.fa ${PIPELINE_DIR}/index
 mv ${OUT_DIR}/fastas/${FILE_ID}_junctions_reg.fa ${PIPELINE_DIR}/index
+mv ${OUT_DIR}/fastas/${FILE_ID}_junctions_scrambled_metadata.npy ${OUT_DIR}/fastas/${FILE_ID}_junctions_scrambled_chromosomes.txt ${PIPELINE_DIR}/index
+mv ${OUT_DIR}/fastas/${FILE_ID}_junctions_reg_metadata.npy ${OUT_DIR}/fastas/${FILE_ID}_junctions_reg_chromosomes.txt ${PIPELINE_DIR}/index
+if [ -n "${DEDUP_FLAG}" ]
+then
+  mv ${OUT_DIR}/fastas/${FILE_ID}_junctions_scrambled_duplicates.txt ${PIPELINE_DIR}/index
+  mv ${OUT_DIR}/fastas/${FILE_ID}_junctions_reg_duplicates.txt ${PIPELINE_DIR}/index
+fi
 
-# remove the temp fastas created along the way 
+# remove the combined fasta, the per-chromosome fastas are kept for the next rebuild
 rm ${OUT_DIR}/${FILE_ID}.fa
-rm -r ${OUT_DIR}/fastas/
 
 # create scrambled junction bowtie2 index in index directory
 echo "bowtie2-build ${PIPELINE_DIR}/index/${FILE_ID}_junctions_scrambled.fa ${PIPELINE_DIR}/index/${FILE_ID}_junctions_scrambled"
@@ -1,7 +1,12 @@
 # given an existing comprehensive junction fasta file, limit it based on specified criteria.
-# Current options include limiting to only reg, dup, or rev and specifying only within gene,
-# all, or only when genes are different. Typically want to call for an entire directory, but
-# it is implemented so you can call on just a specific file too.
+# Current options include limiting to only reg, dup, rev, or scrambled (rev and dup together) and specifying
+# only within gene, all, or only when genes are different. Several types can be given at once, in which case
+# the file is only read once and each junction is routed to every output it belongs in. Records are copied
+# as raw text rather than parsed, so the output keeps the line layout of the input file.
+# With -u, junctions with the same sequence as one already written to an output are left out of it, and the
+# ids of the junctions they duplicate are listed in a file next to it (see limitedOutput).
+# With -m, a metadata table of the junctions written to each output is created next to it (see utils_juncMetadata).
+# Typically want to call for an entire directory, but it is implemented so you can call on just a specific file too.
 
 # usage 1: python limitFasta.py -d /srv/gsfs0/projects/salzman/Linda/junctionIndex/fastas/fasta1Mb
 #                 -o /srv/gsfs0/projects/salzman/Linda/junctionIndex/fastas/fasta1Mb_scrambled
@@ -9,20 +14,29 @@
 # usage 2: python limitFasta.py -s /srv/gsfs0/projects/salzman/Linda/junctionIndex/fasta1Mb/chr10_junctions.fa
 #                 -o /srv/gsfs0/projects/salzman/Linda/junctionIndex/fasta1Mb_reg_inGene
 #                 -t reg -b within -p _reg_inGene -v
+# usage 3: python limitFasta.py -s /srv/gsfs0/projects/salzman/Linda/junctionIndex/hg19.fa
+#                 -o /srv/gsfs0/projects/salzman/Linda/junctionIndex/fastas
+#                 -t reg scrambled -p _junctions
+#          creates hg19_junctions_reg.fa and hg19_junctions_scrambled.fa
+#          add -u to also remove duplicate sequences, creating hg19_junctions_reg_duplicates.txt and hg19_junctions_scrambled_duplicates.txt
+#          add -m to also create hg19_junctions_reg_metadata.npy, hg19_junctions_reg_chromosomes.txt, and the same for scrambled
 
-from Bio import SeqIO
 import argparse
+import hashlib
 import re
 import os
+import sys
 import utils_os
+from utils_juncMetadata import metadataWriter
+
+# junction types included in each output type
+OUTPUT_TYPES = {'reg': ['reg'], 'rev': ['rev'], 'dup': ['dup'], 'scrambled': ['rev', 'dup']}
 
 # we are basing whether we include the junction on
-# whether the 2 sides of the junctions are within the same gene
-# and whether it is a dup, reg, or rev junction
+# whether the 2 sides of the junctions are within the same gene.
+# The junction type (dup, reg, or rev) is used to pick which output files it is written to.
 # return True if the junction meets criteria and should be included in the output
 def inBounds(match):
-    if args.juncType != match.group(3):
-        return False
     if args.bounds == 'all':
         return True
     if args.bounds == 'within':
@@ -30,7 +44,72 @@ def inBounds(match):
     else:
         return match.group(1) != match.group(2)
 
+# read fasta records without parsing them
+# param handle: open fasta file
+#
+# yield: (header line, list of sequence lines) for each record, lines include the newline
+def readRawFasta(handle):
+    header = None
+    seqLines = []
+    
+    for line in handle:
+        if line.startswith(">"):
+            if header is not None:
+                yield header, seqLines
+            header = line
+            seqLines = []
+        elif header is not None:
+            seqLines.append(line)
     
+    if header is not None:
+        yield header, seqLines
+
+# An output fasta file. If dedup is True, only the first junction with each sequence is written. Each junction
+# left out is written as a line "kept junction id<tab>left out junction id" to <output file>_duplicates.txt so
+# reads aligned to the kept junction can be traced back to all of the junctions with the same sequence.
+# Sequences are compared ignoring case since bowtie2 does.
+# If metadata is True, the junctions written are also added to a metadata table for the output file.
+class limitedOutput:
+    def __init__(self, fileName, dedup, metadata):
+        self.handle = open(fileName, "wb")
+        self.seen = None
+        self.dupHandle = None
+        self.metadata = None
+        if dedup:
+            self.seen = {}  # md5 of sequence: id of the junction written with that sequence
+            self.dupHandle = open(os.path.splitext(fileName)[0] + "_duplicates.txt", "wb")
+        if metadata:
+            self.metadata = metadataWriter(fileName)
+    
+    # param juncId: junction id from the header
+    # param record: header and sequence lines as they will be written
+    # param seqLines: sequence lines of the record
+    def write(self, juncId, record, seqLines):
+        if self.seen is not None:
+            seqHash = hashlib.md5("".join([line.strip() for line in seqLines]).upper()).digest()
+            if seqHash in self.seen:
+                self.dupHandle.write(self.seen[seqHash] + "\t" + juncId + "\n")
+                return
+            self.seen[seqHash] = juncId
+        
+        self.handle.write(record)
+        if self.metadata:
+            self.metadata.add(juncId)
+    
+    def close(self):
+        self.handle.close()
+        if self.dupHandle:
+            self.dupHandle.close()
+        if self.metadata:
+            self.metadata.close()
+
+# name of the output file for a junction type. If only 1 type was requested the postpend is used as is,
+# otherwise the type is added after it so each output gets its own file
+def outputFileName(fileBase, outputType):
+    if len(args.juncType) == 1:
+        return args.outDir + "/" + fileBase + args.postpend + ".fa"
+    else:
+        return args.outDir + "/" + fileBase + args.postpend + "_" + outputType + ".fa"
     
 # param fileName: full path to template fasta file  
 def writeLimitedFasta(fileName):
@@ -40,18 +119,34 @@ def writeLimitedFasta(fileName):
     if args.verbose:
         print fileName
         print fileBase
-        print args.outDir + "/" + fileBase + args.postpend
+    
+    # junction type: list of limitedOutputs that junction type is written to
+    typeHandles = {'reg': [], 'rev': [], 'dup': []}
+    out_handles = []
+    for outputType in args.juncType:
+        outFileName = outputFileName(fileBase, outputType)
+        if args.verbose:
+            print outFileName
+        out_handle = limitedOutput(outFileName, args.dedup, args.metadata)
+        out_handles.append(out_handle)
+        for juncType in OUTPUT_TYPES[outputType]:
+            typeHandles[juncType].append(out_handle)
     
     in_handle = open(fileName, "rU")
-    out_handle = open(args.outDir + "/" + fileBase + args.postpend + ".fa", "wb")
     
-    fasta_sequences = SeqIO.parse(in_handle,"fasta")
-    for fasta in fasta_sequences:
-        match = id_patt.search(fasta.id)
-        if match and inBounds(match):
-            SeqIO.write(fasta, out_handle, "fasta")
+    for header, seqLines in readRawFasta(in_handle):
+        # match on the id, which is everything up to the first whitespace in the header
+        juncId = header[1:].split(None, 1)[0]
+        match = id_patt.search(juncId)
+        if match and typeHandles.get(match.group(3)) and inBounds(match):
+            record = header + "".join(seqLines)
+            if not record.endswith("\n"):
+                record += "\n"
+            for out_handle in typeHandles[match.group(3)]:
+                out_handle.write(juncId, record, seqLines)
     
-    out_handle.close()
+    for out_handle in out_handles:
+        out_handle.close()
     in_handle.close()
 
 if __name__  == "__main__":
@@ -60,9 +155,12 @@ if __name__  == "__main__":
     parser.add_argument('-d', '--fastaDir', help='directory containing fasta files to limit. Either -d or -s required.')
     parser.add_argument('-s', '--singleFile', help='fasta file to limit. Either -d or -s required.')
     parser.add_argument('-o', '--outDir', help='directory to output files. Will be created if it does not exist.', required=True)
-    parser.add_argument('-t', '--juncType', help='type of junction to limit to', choices=['reg', 'rev', 'dup'], required=True)
+    parser.add_argument('-t', '--juncType', help='type(s) of junction to limit to. If more than 1 is given, each is written to its own file with the type added after the postpend',
+                        choices=['reg', 'rev', 'dup', 'scrambled'], nargs='+', required=True)
     parser.add_argument('-b', '--bounds', help='type of junction to limit to', choices=['all', 'within', 'between'], default='all')
     parser.add_argument('-p', '--postpend', help='text to add to end of output file names', required=True)
+    parser.add_argument('-u', '--dedup', help='only write the first junction with each sequence to each output, listing the rest in a _duplicates.txt file', action='store_true')
+    parser.add_argument('-m', '--metadata', help='also write a junction metadata table for each output, used by the analysis code to look up junction info', action='store_true')
     parser.add_argument('-v', '--verbose', help='print info about data obtained', action='store_true')
     
     args = parser.parse_args()
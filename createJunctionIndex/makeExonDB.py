@@ -1,8 +1,13 @@
-# Given a gtf genome annotation file and a genome fasta file, create and pickle
-# dicts of exon objects. 1 file is created with a dict for each chromosome, and
-# each dict contains 2 lists, 1 for forward strand exons on this chromosome
-# and one for reverse strand exons. These can then be used to create junction objects
-# and junction fasta files.
+# Given a gtf genome annotation file and a genome fasta file, create a table of
+# exons for each chromosome (see utils_exon) holding the start, end, strand, and
+# gene name of every forward and reverse strand exon on this chromosome. These can
+# then be used to create junction objects and junction fasta files.
+# Gene names are taken from the -n1 field, or the -n2 field if there is no -n1 field. The sequence for each chromosome is written in 2-bit format
+# (see utils_genome) to the records directory.
+#
+# The gtf is streamed for exon coordinates first, then the genome fasta is read 1 chromosome
+# at a time, so the whole genome is never held in memory. The exon tables are written once the
+# chromosome ids in the fasta are known, since only exons on those chromosomes are used (see orderExons).
 
 # Output directories will be created if they do not exist, and default values
 # are provided. The genes, exons, and records directories will be created as
@@ -21,10 +26,15 @@
 
 import argparse
 from Bio import SeqIO
-from BCBio import GFF
+from Bio.SeqFeature import SeqFeature, FeatureLocation
 import cPickle as pickle
 import utils_os
+import utils_genome
+import utils_exon
 import sys
+import urllib
+
+STRAND_MAP = {'+': 1, '-': -1}  # anything else, like '.', is treated as unknown strand
 
 # not currently using genes, but figured it may be useful to have these objects
 # around for future analysis if necessary. Each gene contains a chromosome id
@@ -41,95 +51,209 @@ class gene:
         msg += " feature: " + str(self.feature)
         return msg
 
-# tries getting primary gene name, if that doesn't exist tries getting secondary gene name.
-# if neither primary or secondary gene name fields exist, an exception will be thrown
-# which is caught and handled in the calling function
-def getGeneName(use_feature):
-    if args.name1 in use_feature.qualifiers:
-        use_name = args.name1
-    else: 
-        use_name = args.name2
-        
-    return use_feature.qualifiers[use_name][0]
-    
-# the workhorse function.
-# param chrSeqRecord: a SeqRecord for 1 chromosome
-def parseChrFeatures(chrSeqRecord):
-    chrExonsByDirection = [] # each element will be a (chrID, strand, dict with (exon start, stop):SeqFeature, 2 per chromosome (1 per strand)
-    exonsPos = {}  # all positive strand exons
-    exonsNeg = {}  # all neg strand exons
-    geneExons = {}  # gene_name: RecFeature. don't actually use these right now, but may be useful at some point
+# split the attributes of a gtf line into field name: list of values, the same way bcbio-gff did when it was used
+# to read the gtf. Quotes are removed, unquoted values are split on commas, and a field without a value is "true".
+# param attrField: 9th column of a gtf line, like gene_id "ENSG00000223972"; gene_name "DDX11L1";
+def parseAttributes(attrField):
+    attrs = {}
+    if attrField.endswith(";"):
+        attrField = attrField[:-1]
+    parts = attrField.split(" ; ")
+    if len(parts) == 1:
+        parts = [x.strip() for x in attrField.split(";")]
     
+    for part in parts:
+        if part and part[0] == ";":
+            part = part[1:]
+        pieces = part.strip().split(" ")
+        key, val = pieces[0], " ".join(pieces[1:])
+        if len(val) > 0 and val[0] == '"' and val[-1] == '"':
+            vals = [val[1:-1]] if len(val) > 2 else []
+        else:
+            vals = [v for v in val.split(",") if v]
+        if not vals:
+            vals = ["true"]
+        attrs.setdefault(key, []).extend(urllib.unquote(v) for v in vals)
     
-    for ftr in chrSeqRecord.features: # this is 1 entire gene
+    return attrs
+
+# tries getting primary gene name, if that doesn't exist tries getting secondary gene name.
+# For a field listed more than once, the first value is used.
+# param attrs: attributes of a gtf line, from parseAttributes
+#
+# return: gene name, or None if neither primary or secondary gene name fields exist
+def getGeneName(attrs):
+    if args.name1 in attrs:
+        return intern(attrs[args.name1][0])
+    elif args.name2 in attrs:
+        return intern(attrs[args.name2][0])
+    return None
+
+# return: ids of the transcripts an exon belongs to, or [] if it is not part of a transcript
+# param attrs: attributes of a gtf line, from parseAttributes
+def getTranscriptIds(attrs):
+    transcriptIds = attrs.get("Parent", [])
+    for idField in ["transcript_id", "transcriptId", "proteinId"]:
+        if idField in attrs:
+            transcriptIds = attrs[idField]
+            break
+    # WormBase labels the transcript with a Transcript or CDS field
+    for idField in ["Transcript", "CDS"]:
+        if idField in attrs:
+            transcriptIds = attrs[idField]
+            break
+    return transcriptIds
+
+# Stream through the gtf file and collect the exon coordinates, strand, and gene name from each exon line.
+# No sequence is read here, and only light-weight tuples are kept until the exon tables are written.
+#
+# param annotationFile: path to gtf file
+#
+# return: (dict of chromosome id: list of (exon start, exon end, strand, gene name) for exons that are not part of a
+#         transcript, in gtf order, dict of transcript id: list of (position in the gtf, chromosome id, exon start,
+#         exon end, strand, gene name) for its exons, in gtf order)
+def readGtfExons(annotationFile):
+    singleExons = {}
+    transcripts = {}
+    handle = open(annotationFile, "rU")
+    for lineNum, line in enumerate(handle):
+        if line.startswith("#"):
+            continue
+        vals = line.strip().split("\t")
+        if len(vals) < 8 or vals[2] != "exon":
+            continue
         try:
-            sftr = None # genes with a single exon are at the top level ftr
-            for sftr in ftr.sub_features:
-                # add exon to the exon dict for the current chr
-                # keeping in separate dicts for now so we are only looking at 1 direction with 100kb
-                if sftr.strand == 1:
-                    exonsPos[(int(sftr.location.start), int(sftr.location.end))] = sftr
-                else:
-                    exonsNeg[(int(sftr.location.start), int(sftr.location.end))] = sftr
-    
-            # gene names are tied to the subrecords, and chromosome to SeqRecords, so need to track this info with the feature object 
-            if sftr:
-                geneExons[getGeneName(sftr)] = gene(chrSeqRecord.id, ftr)
-            else:
-                # this is a single exon gene so gene name is in the feature instead of subfeatures
-                if args.verbose:
-                    print "single exon gene " + str(getGeneName(ftr))
-                geneExons[getGeneName(ftr)] = gene(chrSeqRecord.id, ftr)
-                # and need to add the feature to the appropriate exonDict
-                if ftr.strand == 1:
-                    exonsPos[(int(ftr.location.start), int(ftr.location.end))] = ftr
-                else:
-                    exonsNeg[(int(ftr.location.start), int(ftr.location.end))] = ftr
+            strand = STRAND_MAP.get(vals[6])
+            attrs = parseAttributes(vals[8]) if len(vals) > 8 and vals[8] != "." else {}
+            start = int(vals[3]) - 1  # gtf is 1-based and inclusive
+            end = int(vals[4])
+            geneName = getGeneName(attrs)
+            
+            transcriptIds = getTranscriptIds(attrs)
+            if not transcriptIds:
+                singleExons.setdefault(vals[0], []).append((start, end, strand, geneName))
+            for i, transcriptId in enumerate(transcriptIds):
+                transcripts.setdefault(transcriptId, []).append(((lineNum, i), vals[0], start, end, strand, geneName))
         except Exception as e:
             print "Exception"
             print e
             print "error:", sys.exc_info()[0]
-            print "parsing features for", ftr
-            
+            print "parsing exon line", line
+    handle.close()
+    
+    return singleExons, transcripts
+
+# When several lines list the same exon (same start and end, and both on the + strand or both not), the line that
+# supplies its strand and gene name is picked the way it was when bcbio-gff was used to read the gtf, so the junctions
+# are the same as before. bcbio-gff only read lines for chromosomes in the fasta, and returned for each chromosome:
+#   - the exons that are not part of a transcript, in gtf order
+#   - then the transcripts, in the order of a dict of transcript id: exons in which each transcript id was added when its
+#     first exon was read. A transcript with 1 exon is returned as a single exon. A transcript with exons on several
+#     chromosomes is returned with all of its exons on 1 of them.
+# Each exon replaced any exon listed before it with the same start and end, and a single exon without a gene name was
+# dropped.
+#
+# param singleExons, transcripts: as returned by readGtfExons
+# param chrIds: ids of the chromosomes in the fasta
+#
+# return: dict of chromosome id: {1: + strand exons, -1: - strand exons} where each is a dict
+#         of (exon start, exon end): (strand, gene name). - strand exons include exons with unknown strand.
+def orderExons(singleExons, transcripts, chrIds):
+    exonsByChr = {}
+    
+    def addExon(chrId, start, end, strand, geneName):
+        chrExons = exonsByChr.setdefault(chrId, {1: {}, -1: {}})
+        exons = chrExons[1] if strand == 1 else chrExons[-1]
+        exons[(start, end)] = (strand, geneName)
+    
+    for chrId, exons in singleExons.iteritems():
+        if chrId in chrIds:
+            for start, end, strand, geneName in exons:
+                if geneName is not None:
+                    addExon(chrId, start, end, strand, geneName)
+    
+    # the transcript ids are added to the dict in the same order, so its order is the same as bcbio-gff's
+    firstExons = []
+    for transcriptId, exons in transcripts.iteritems():
+        exons = [x for x in exons if x[1] in chrIds]
+        if exons:
+            firstExons.append((exons[0][0], transcriptId, exons))
+    firstExons.sort()
+    exonsByTranscript = {}
+    for firstExon, transcriptId, exons in firstExons:
+        exonsByTranscript[transcriptId] = exons
+    exonsByTranscript = dict(exonsByTranscript)
+    
+    for transcriptId in exonsByTranscript:
+        exons = exonsByTranscript[transcriptId]
+        if len(exons) == 1:
+            pos, chrId, start, end, strand, geneName = exons[0]
+            if geneName is not None:
+                addExon(chrId, start, end, strand, geneName)
+        else:
+            chrId = list(set(x[1] for x in exons))[0]
+            for pos, exonChrId, start, end, strand, geneName in exons:
+                addExon(chrId, start, end, strand, geneName)
     
-    if len(exonsPos) > 0:
-        chrExonsByDirection.append((chrSeqRecord.id, 1, exonsPos))  # chrSeqRecord.id is chr1 for example, 1 indicates pos strand
-    if len(exonsNeg) > 0:
-        chrExonsByDirection.append((chrSeqRecord.id, -1, exonsNeg))  # -1 indicates neg strand
+    return exonsByChr
+    
+# the workhorse function.
+# param chrId: id of 1 chromosome
+# param chrExons: exons for this chromosome as returned by orderExons
+def parseChrFeatures(chrId, chrExons):
+    allExons = []  # (exon start, exon end, strand, gene name) for the exon table
+    geneExons = {}  # gene_name: gene. don't actually use these right now, but may be useful at some point
+    
+    for strand in [1, -1]:
+        # junctions are created from the exons in the order they came out of the exon pickles this script used to
+        # write, which is the order of a dict the exons are added to 1 at a time. When several exon pairs make the
+        # same junction, the first pair is the one written, so this keeps the junctions the same as before.
+        for pos in dict((x, None) for x in chrExons[strand]):
+            exonStrand, geneName = chrExons[strand][pos]
+            allExons.append((pos[0], pos[1], exonStrand, geneName))
+        
+        for pos in sorted(chrExons[strand]):
+            exonStrand, geneName = chrExons[strand][pos]
+            # gene-level feature spanning all exons with the same gene name
+            if geneName is None:
+                if args.verbose:
+                    print "no gene name for exon", chrId, pos
+                continue
+            exonFeature = SeqFeature(FeatureLocation(pos[0], pos[1], strand=exonStrand), type="exon")
+            if geneName not in geneExons:
+                geneFeature = SeqFeature(FeatureLocation(pos[0], pos[1], strand=exonStrand), type="gene", qualifiers={'gene_name': [geneName]})
+                geneFeature.sub_features = []
+                geneExons[geneName] = gene(chrId, geneFeature)
+            geneFeature = geneExons[geneName].feature
+            geneFeature.location = FeatureLocation(min(geneFeature.location.start, pos[0]), max(geneFeature.location.end, pos[1]), strand=geneFeature.strand)
+            geneFeature.sub_features.append(exonFeature)
+        
+        if args.verbose:
+            print "chromosome:" + str(chrId)
+            print "strand: " + str(strand)
+            print "number of exons: " + str(len(chrExons[strand]))
         
     ########### save these objects for future use #############
-    pk_geneExons = open(geneOutFullPath + '/geneExons_' + chrSeqRecord.id + '.pkl', 'wb')
+    pk_geneExons = open(geneOutFullPath + '/geneExons_' + chrId + '.pkl', 'wb')
     pickle.dump(geneExons, pk_geneExons)
     pk_geneExons.close()
     
     if args.verbose:
         print "num genes: " + str(len(geneExons))
     
-    pk_exonsByDirection = open(exonOutFullPath + '/exonsByStrand_' + chrSeqRecord.id + '.pkl', 'wb')
-    pickle.dump(chrExonsByDirection, pk_exonsByDirection)
-    pk_exonsByDirection.close()
-    
-    if args.verbose:
-        for elem in chrExonsByDirection:
-            print "chromosome:" + str(elem[0])
-            print "strand: " + str(elem[1])
-            print "number of exons: " + str(len(elem[2]))
-            
-    pk_rec = open(recOutFullPath + '/rec_' + chrSeqRecord.id + '.pkl', 'wb')
-    pickle.dump(chrSeqRecord, pk_rec)
-    pk_rec.close()
+    utils_exon.writeExonTable(exonOutFullPath, chrId, allExons)
 
 if __name__  == "__main__":
     
     parser = argparse.ArgumentParser()
     parser.add_argument('-f', '--fastaFile', required=True, help='path to fasta file with chromosome sequences')
-    parser.add_argument('-a', '--annotationFile', required=True, help='path to gff file with exon annotations')
+    parser.add_argument('-a', '--annotationFile', required=True, help='path to gtf file with exon annotations')
     parser.add_argument('-o', '--outDir', help='directory to output files, will be created if it does not exist', default='output')
     parser.add_argument('-n1', '--name1', help='name of field in gtf to use for gene names', default='gene_name')
     parser.add_argument('-n2', '--name2', help='name of field in gtf to use for gene names if n1 does not exist', default='gene_id')
-    parser.add_argument('-e', '--exonOutDir', help='directory to output exon pickle files, will be created within outDir if it does not exist', default='exons')
+    parser.add_argument('-e', '--exonOutDir', help='directory to output exon table files, will be created within outDir if it does not exist', default='exons')
     parser.add_argument('-g', '--geneOutDir', help='directory to output gene pickle files, will be created within outDir if it does not exist', default='genes')
-    parser.add_argument('-r', '--recOutDir', help='directory to output seq record pickle files, will be created within outDir if it does not exist', default='records')
+    parser.add_argument('-r', '--recOutDir', help='directory to output 2-bit chromosome sequence files, will be created within outDir if it does not exist', default='records')
     parser.add_argument('-v', '--verbose', help='print info about data obtained', action='store_true')
     args = parser.parse_args()
     
@@ -143,29 +267,34 @@ if __name__  == "__main__":
     utils_os.createDirectory(geneOutFullPath)
     utils_os.createDirectory(recOutFullPath)
     
-    # read in the sequences 
+    ########### read in the exon coordinates from the annotations, no sequence is needed for this
+    if args.verbose:
+        print "opening annotation file", args.annotationFile
+    singleExons, transcripts = readGtfExons(args.annotationFile)
+    annotatedChrIds = set(singleExons)
+    for exons in transcripts.itervalues():
+        annotatedChrIds.update(x[1] for x in exons)
+    
+    if args.verbose:
+        print "chromosomes with exons in annotation file: " + str(len(annotatedChrIds))
+    
+    ########### then read the genome 1 chromosome at a time, so only 1 chromosome sequence is ever in memory
+    chrIds = set()
     f_handle = open(args.fastaFile, "rU")
-    f_dict = SeqIO.to_dict(SeqIO.parse(f_handle, "fasta"))
+    for rec in SeqIO.parse(f_handle, "fasta"): # each rec is a SeqRecord (for 1 chromosome)
+        chrIds.add(rec.id)
+        # only want chromosomes that have exons annotated. Only the sequence is needed to create junctions,
+        # and it is stored compactly so it can be memory mapped
+        if rec.id in annotatedChrIds:
+            utils_genome.writeTwoBit(recOutFullPath + '/seq_' + rec.id + '.2bit', str(rec.seq))
     f_handle.close()
     
-    # only want exons for now. unfortunately can't limit by strand so have to do that after the fact
-    # we can speed things up a bit by limiting to just the chromosomes we have sequences for
-    limit_info = dict(
-        gff_id = f_dict.keys(),
-        gff_type = ["exon"])
+    if args.verbose and len(annotatedChrIds - chrIds) > 0:
+        print "no sequence found for annotated chromosomes: " + ", ".join(sorted(annotatedChrIds - chrIds))
     
-    if args.verbose:
-        print "data we are searching for in gff: " + str(limit_info)
-    
-    ########### read in the annotations, adding annotations to the sequences 
-    a_handle = open(args.annotationFile, "rU")
-    if args.verbose:
-            print "opening annotation file", args.annotationFile
-    for rec in GFF.parse(a_handle, base_dict=f_dict, limit_info=limit_info): # each rec is a SeqRecord (for 1 chromosome)
+    ########### populate the data structures with genes and exons for each chromosome and write them out
+    exonsByChr = orderExons(singleExons, transcripts, chrIds)
+    for chrId in sorted(exonsByChr):
         if args.verbose:
-            print "####### starting new chromosome: " + str(rec.id)
-        # populate the data structures with genes and exons from this chromosome and pickle the objects
-        parseChrFeatures(rec)
-    a_handle.close()
-    
-    
\ No newline at end of file
+            print "####### starting new chromosome: " + str(chrId)
+        parseChrFeatures(chrId, exonsByChr[chrId])
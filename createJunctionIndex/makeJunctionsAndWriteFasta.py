@@ -1,4 +1,4 @@
-# Takes a pickled exon dictionary and creates a fasta file containing all of the 
+# Takes an exon table (see utils_exon) and creates a fasta file containing all of the 
 # possible exon pair junctions (x-x, x-y, y-x) within a sliding window. Default
 # window size is 100Kb.
 #
@@ -7,13 +7,24 @@
 # by just keeping track of keys and writing out the junction object to file if it
 # does not exist in list of keys already. Also sped it up significantly by using
 # a dictionary instead of a list for keeping track of previously seen junctions.
+# Keys are now packed into a single int and dropped once the sliding window has moved past
+# the point where they could be created again, so memory depends on how many exons fall within
+# a window rather than on the size of the chromosome.
 #
 # By default it loops through all files in a directory, but if you pass -s filename
-# then it will just run for that single file. In general, I recommend using it in
-# single mode, then you can get the files for the entire genome in just a few hours.
+# then it will just run for that single file. In directory mode, pass -p to create the
+# junctions for several chromosomes at once in a pool of worker processes. Chromosomes are
+# started largest first so the whole genome takes about as long as the longest chromosome.
+# Each chromosome is written to its own file, and -m combines them into a single fasta file
+# ordered by chromosome id once they are all done.
+#
+# In directory mode a manifest is kept in the fasta directory recording, for each chromosome, the window
+# size and a hash of the exon table, gene names, and sequence its junctions were created from. With -i,
+# chromosomes whose inputs match the manifest keep their existing junction fasta file, so after an
+# annotation update only the chromosomes whose exons changed are redone.
 
-# usage 1 (whole directory): python makeJunctionsAndWriteFasta.py -w 2000 -e output/exons -r output/records -f output/fasta -v
-# usage 2 (single file): python makeJunctionsAndWriteFasta.py -w 2000 -s exon.pkl -r output/records -f output/fasta -v
+# usage 1 (whole directory): python makeJunctionsAndWriteFasta.py -w 2000 -e output/exons -r output/records -f output/fasta -p 8 -m output/all_junctions.fa -i -v
+# usage 2 (single file): python makeJunctionsAndWriteFasta.py -w 2000 -s exonsByStrand_chr1.npy -r output/records -f output/fasta -v
 
 #        all arguments are optional
 
@@ -24,59 +35,177 @@
 
 import argparse
 from Bio import SeqIO
-from itertools import product
-import cPickle as pickle
+import hashlib
+from collections import deque
+from bisect import bisect_left, insort
+from heapq import heappush, heappop
+from multiprocessing import Pool
 import os
+import shutil
 import utils_os
 import re
 import sys
+import utils_junction
 from utils_junction import junction
+from utils_genome import twoBitSeq
+import utils_exon
 
 EMPTY_SEQUENCE = "NOSEQUENCE" # to indicate junction sequence contains all Ns so do not include in fasta output
         
-# pattern like exonsByStrand_chr1.pkl
+# pattern like exonsByStrand_chr1.npy
 # where we are interested in chr1 as the file id
-patt_exonfilename = re.compile(".*exonsByStrand_(.+?)\.pkl")
+patt_exonfilename = re.compile(".*exonsByStrand_(.+?)\.npy")
+
+# file name like exonsByStrand_chr1.npy
+patt_exonfile = re.compile("exonsByStrand_.+\.npy")
+
+BATCH_SIZE = 10000  # most junctions to look up sequences for at once
+MAX_BATCH_SPAN = 10000000  # most bases of the chromosome a batch should cover, since that region is decoded at once
+
+MANIFEST_NAME = "manifest.txt"  # kept in the fasta directory
+MANIFEST_VERSION = "4"  # increase when a change to this code changes the junctions created from the same input
 
-# file name like exonsByStrand_chr1.pkl
-patt_exonfile = re.compile("exonsByStrand_.+\.pkl")
+# Write a batch of junctions to the fasta file. Sequences for the whole batch are looked up at once
+# and all of the records are written in a single block.
+#
+# param curSeqRec: twoBitSeq object that contains the sequence for this chromosome
+# param id: something like chr# used to identify the current chromosome and all related files
+# param batch: list of (exon, exon) pairs whose junctions have not been written yet
+# param handle: open file handle to write fasta entries to
+def writeBatch(curSeqRec, id, batch, handle):
+    records = []
+    for (exonA, exonB), seq in zip(batch, utils_junction.pairSeqs(curSeqRec, batch)):
+        if seq != EMPTY_SEQUENCE:
+            try:
+                curJunc = junction(curSeqRec, id, exonA, exonB, seq)
+                records.append(curJunc.printHeader())  # junction fasta header
+                records.append(str(curJunc))  # the sequence
+            except Exception as e:
+                print "Exception"
+                print e
+                print "error:", sys.exc_info()[0]
+                print "parsing features for", (exonA.start, exonA.end), (exonB.start, exonB.end)
+    
+    handle.write("".join(records))
 
 # Helper function called to actually do the writing of the junction sequence to
 # the fasta file. First checks to make sure this junction has not already been written.
+# New junctions are collected into batches of up to BATCH_SIZE, which are cut short if the
+# region of the chromosome they cover gets longer than MAX_BATCH_SPAN, and written by writeBatch.
 #
-# param curSeqRec: sequenceRecord object that contains the sequence for this chromosome
+# param curSeqRec: twoBitSeq object that contains the sequence for this chromosome
 # param id: something like chr# used to identify the current chromosome and all related files
-# param allExons: master dictionary of all exons for this chromosome 
-# param curExons: list of exon keys for the exons within the current window
-# param junctions: running dict of all junction ids already observed
+# param allExons: master dictionary of (exon start, exon end): exon for all exons on this strand
+# The junction id is (end of exonA, start of exonB) on the + strand and (start of exonA, end of exonB)
+# on the - strand, packed into a single int. windowPairs only creates a pair in a window whose start
+# (in its flipped coordinates for the - strand) is at or before the start of both exons, so once the window
+# has moved past the smaller coordinate in the id, no pair with that id can come up again and it is dropped.
+# The window each pair came from is at or after the farther end of its exons minus the window size,
+# which is used as the position of the window.
+#
+# param pairs: iterable of (exon key, exon key) pairs to write, as generated by windowPairs
+# param strand: 1 or -1, the strand the pairs were generated for
+# param window: sliding window size the pairs were generated with
 # param handle: open file handle to write fasta entries to
 #
-# return: junctions dict with the new junction ids written in this round appended
-def writeAllPairs(curSeqRec, id, allExons, curExons, junctions, handle):
-    allPairs = product(curExons, repeat=2)  # create all exon pairs including x-x, x-y, y-x
-    for a,b in allPairs:
-        try:
-            exonA = allExons[a] 
-            exonB = allExons[b]
-            if exonA.strand == 1:
-                curJuncId = (exonA.location.end, exonB.location.start)
-            else:
-                curJuncId = (exonA.location.start, exonB.location.end)
+# return: number of distinct junction ids observed
+def writeAllPairs(curSeqRec, id, allExons, pairs, strand, window, handle):
+    junctions = set()  # ids of junctions already observed that could still come up again
+    expiries = []  # heap of (last window start the id could come up in, id)
+    numJunctions = 0
+    batch = []
+    batchStart = batchEnd = None
+    
+    for a,b in pairs:
+        exonA = allExons[a] 
+        exonB = allExons[b]
+        if strand == 1:
+            curJuncId = (exonA.end << 32) | exonB.start
+            expiry = min(exonA.end, exonB.start)
+            windowStart = max(exonA.end, exonB.end) - window
+        else:
+            curJuncId = (exonA.start << 32) | exonB.end
+            expiry = min(-exonA.start, -exonB.end)
+            windowStart = -min(exonA.start, exonB.start) - window
+        
+        while expiries and expiries[0][0] < windowStart:
+            junctions.discard(heappop(expiries)[1])
+        
+        # if this junction is not already accounted for, write it to the file
+        if not curJuncId in junctions:
+            junctions.add(curJuncId)
+            heappush(expiries, (expiry, curJuncId))
+            numJunctions += 1
+            
+            pairStart = min(exonA.start, exonB.start)
+            pairEnd = max(exonA.end, exonB.end)
+            if batch and (len(batch) == BATCH_SIZE or max(batchEnd, pairEnd) - min(batchStart, pairStart) > MAX_BATCH_SPAN):
+                writeBatch(curSeqRec, id, batch, handle)
+                batch = []
             
-            # if this junction is not already accounted for, write it to the file
-            if not curJuncId in junctions:
-                curJunc = junction(curSeqRec, id, exonA, exonB)
-                junctions[curJuncId] = None  # don't need to store anything in the dictionary, just need the keys hashed
-                if str(curJunc) != EMPTY_SEQUENCE:
-                    handle.write(str(curJunc.printHeader(args.name1, args.name2)))  # junction fasta header
-                    handle.write(str(curJunc))  # prints out the sequence
-        except Exception as e:
-            print "Exception"
-            print e
-            print "error:", sys.exc_info()[0]
-            print "parsing features for", a, b
+            if not batch:
+                batchStart, batchEnd = pairStart, pairEnd
+            batch.append((exonA, exonB))
+            batchStart = min(batchStart, pairStart)
+            batchEnd = max(batchEnd, pairEnd)
+    
+    if batch:
+        writeBatch(curSeqRec, id, batch, handle)
             
-    return junctions
+    return numJunctions
+
+# Generate every exon pair (x-x, x-y, y-x) that falls within the sliding window, only once each.
+#
+# There is one window per distinct exon start (+ strand) or end (- strand), and an exon is in the window
+# anchored at s if it starts at or after s and ends within s + window. Each exon is therefore in a
+# contiguous run of windows, so instead of rebuilding the window at every step we sweep along the strand:
+# exons are admitted in order of their far coordinate and evicted in order of their near coordinate, and at each
+# step we only generate the pairs that include a newly admitted exon, since all other pairs in the window
+# were generated in an earlier window.
+#
+# Within a window, pairs are generated in the order of the exon keys passed in, which is the same order
+# the full product over each window used to produce. That keeps the choice of which pair gets written
+# when several exon pairs share a junction id identical to the original implementation.
+#
+# param exonKeys: list of (exon start, exon end) keys for all exons on this strand
+# param strand: 1 or -1, - strand windows slide from the end of the chromosome towards the start
+# param window: sliding window size
+def windowPairs(exonKeys, strand, window):
+    # flip - strand coordinates so both strands can be swept from low to high
+    if strand == 1:
+        near = [x[0] for x in exonKeys]
+        far = [x[1] for x in exonKeys]
+    else:
+        near = [-x[1] for x in exonKeys]
+        far = [-x[0] for x in exonKeys]
+    
+    toEvict = deque(sorted(xrange(len(exonKeys)), key=lambda i: near[i]))  # leave the window in this order
+    toAdmit = deque(sorted(xrange(len(exonKeys)), key=lambda i: far[i]))  # enter the window in this order
+    inWindow = []  # indexes into exonKeys of exons in the current window, kept sorted
+    
+    for windowStart in sorted(set(near)):
+        # drop exons that start before this window
+        while toEvict and near[toEvict[0]] < windowStart:
+            i = toEvict.popleft()
+            pos = bisect_left(inWindow, i)
+            if pos < len(inWindow) and inWindow[pos] == i:
+                del inWindow[pos]
+        
+        # add exons that now end within the window. Any exon that ends within the window
+        # but starts before it was never entirely within a window, so it is skipped
+        newExons = []
+        while toAdmit and far[toAdmit[0]] <= windowStart + window:
+            i = toAdmit.popleft()
+            if near[i] >= windowStart:
+                insort(inWindow, i)
+                newExons.append(i)
+        
+        if newExons:
+            newExons.sort()
+            isNew = set(newExons)
+            for a in inWindow:
+                for b in (inWindow if a in isNew else newExons):
+                    yield exonKeys[a], exonKeys[b]
 
 # Move along the sliding window, get all exons within the window, write out all of those
 # junctions, then move along the chromosome by 1 exon and repeat until you make it
@@ -89,85 +218,125 @@ def writeAllPairs(curSeqRec, id, allExons, curExons, junctions, handle):
 # the same fasta file though.
 # 
 # param fileId: something like chr# which is contained in names of all related files for this chromosome
-# param exonFile: name of the exon file for this chromosome
+# param exonFile: path to the exon table file for this chromosome
 def createJunctions(fileId, exonFile):
     if args.verbose:
         print fileId
     
-    # get the sequence record for this chromosome (exons just contain annotation data)
-    exonSeqRec = pickle.load(open(args.recordDir + '/rec_' + fileId + '.pkl', 'rb'))
+    # get the sequence for this chromosome (exons just contain annotation data). It is memory mapped,
+    # so only the parts of the chromosome that are used for junctions are actually read
+    exonSeqRec = twoBitSeq(args.recordDir + '/seq_' + fileId + '.2bit')
     
     # and get the exons that belong to this sequence
-    chrExonsByDirection = pickle.load(open(args.exonDir + '/' + exonFile, 'rb'))
+    exonTable, geneNames = utils_exon.loadExonTable(os.path.dirname(exonFile), fileId)
     
-    allJunctions = {} # (endExon1, startExon2) identifier to keep track of which junctions we have done already 
+    numJunctions = 0
     
     if args.verbose:
-        print len(chrExonsByDirection)
+        print len(exonTable)
     
     outf = open(args.fastaDir + '/' + fileId + '_junctions.fa', 'wb')
     
-    # there should be 2 elems in each file, 1 for + strand exons and 1 for - strand exons
-    for elem in chrExonsByDirection:
-        chrId, strand, exons = elem
+    # + strand exons and - strand exons are handled separately
+    for strand in [1, -1]:
+        # in the order makeExonDB wrote them, which decides the pair written for a junction id (see windowPairs)
+        strandExons = utils_exon.getStrandExons(exonTable, geneNames, strand)
+        exonKeys = [(x.start, x.end) for x in strandExons]
+        exons = dict(zip(exonKeys, strandExons))
         
-        exonsInRange = exons.keys()
-        
-        if len(exonsInRange) > 0:
-            if strand == 1:
-                # start from begining and work forward for + strand
-                startPos = min(x[0] for x in exonsInRange)
-                # when we are looking at a set of exons including this last one, we are done with the sliding window
-                endPos = max(x[1] for x in exonsInRange)
-                
-                while True:
-                    # the starting point was already established, now limit to those within window
-                    exonsInRange = [x for x in exonsInRange if x[1] <= startPos + args.window]
-                    
-                    if len(exonsInRange) > 0:
-                        # write these junctions to file if they haven't already been written
-                        allJunctions = writeAllPairs(exonSeqRec, chrId, exons, exonsInRange, allJunctions, outf)
-                        
-                        # if max in exonsInRange is endPos then we're done
-                        if max(x[1] for x in exonsInRange) == endPos:
-                            break
-                        # otherwise move over 1 exon and repeat
-                        exonsInRange = [x for x in exons.keys() if x[0] > startPos]
-                        startPos = min(x[0] for x in exonsInRange)   
-            else:
-                # start from end and work backwards for - strand
-                startPos = max(x[1] for x in exonsInRange)
-                endPos = min(x[0] for x in exonsInRange)
-                
-                while True:
-                    # the starting point was already established, now limit to those within window
-                    exonsInRange = [x for x in exonsInRange if x[0] >= startPos - args.window]
-                    if len(exonsInRange) > 0:
-                        allJunctions = writeAllPairs(exonSeqRec, chrId, exons, exonsInRange, allJunctions, outf)
-                        
-                        # if min in exonsInRange is endPos then we're done
-                        if min(x[0] for x in exonsInRange) == endPos:
-                            break
-                        # otherwise move over 1 exon and repeat
-                        exonsInRange = [x for x in exons.keys() if x[1] < startPos]
-                        startPos = max(x[1] for x in exonsInRange)
+        # + strand windows start from begining and work forward, - strand from the end and work backwards
+        numJunctions += writeAllPairs(exonSeqRec, fileId, exons, windowPairs(exonKeys, strand, args.window), strand, args.window, outf)
                 
     outf.close()
+    exonSeqRec.close()
     
     if args.verbose:
-        print len(allJunctions)
+        print numJunctions
+
+
+# wrapper so createJunctions can be called from the process pool, which passes a single argument
+# param exonFileInfo: (fileId, exonFile) as passed to createJunctions
+#
+# return: (fileId, True if the junctions were created) so the caller knows which chromosome just finished
+def createJunctionsInPool(exonFileInfo):
+    fileId, exonFile = exonFileInfo
+    try:
+        createJunctions(fileId, exonFile)
+    except Exception as e:
+        print "Exception"
+        print e
+        print "error:", sys.exc_info()[0]
+        print "creating junctions for", fileId
+        return fileId, False
+        
+    return fileId, True
+
+# hash of all of the input the junctions for a chromosome are created from
+# param fileId: something like chr# which is contained in names of all related files for this chromosome
+# param exonFile: path to the exon table file for this chromosome
+def inputHash(fileId, exonFile):
+    md5 = hashlib.md5()
+    for fileName in [exonFile, utils_exon.geneNamesPath(os.path.dirname(exonFile), fileId), args.recordDir + '/seq_' + fileId + '.2bit']:
+        handle = open(fileName, 'rb')
+        for chunk in iter(lambda: handle.read(1 << 20), ''):
+            md5.update(chunk)
+        handle.close()
+    return md5.hexdigest()
+
+# the manifest has the version on the 1st line then fileId, window, input hash (tab separated) for each chromosome
+# whose junction fasta file is complete. A manifest from a different version is ignored.
+#
+# return: dict of fileId: (window, input hash)
+def readManifest():
+    manifest = {}
+    fileName = args.fastaDir + '/' + MANIFEST_NAME
+    if not os.path.exists(fileName):
+        return manifest
+    
+    handle = open(fileName, 'rU')
+    if handle.readline().rstrip("\n") == MANIFEST_VERSION:
+        for line in handle:
+            fileId, window, fileHash = line.rstrip("\n").split("\t")
+            manifest[fileId] = (int(window), fileHash)
+    handle.close()
+    
+    return manifest
+
+# written to a temp file first so an interrupted run never leaves a partial manifest
+def writeManifest(manifest):
+    fileName = args.fastaDir + '/' + MANIFEST_NAME
+    handle = open(fileName + '.tmp', 'wb')
+    handle.write(MANIFEST_VERSION + "\n")
+    for fileId in sorted(manifest):
+        handle.write("\t".join([fileId, str(manifest[fileId][0]), manifest[fileId][1]]) + "\n")
+    handle.close()
+    os.rename(fileName + '.tmp', fileName)
+
+# concatenate the per-chromosome junction fasta files into a single file. Files are combined in
+# order of chromosome id so the output does not depend on the order the chromosomes finished in.
+#
+# param fileIds: list of chromosome ids whose junction fasta files should be combined
+# param mergedFile: path to the combined fasta file
+def mergeJunctionFastas(fileIds, mergedFile):
+    out_handle = open(mergedFile, 'wb')
+    for fileId in sorted(fileIds):
+        in_handle = open(args.fastaDir + '/' + fileId + '_junctions.fa', 'rb')
+        shutil.copyfileobj(in_handle, out_handle)
+        in_handle.close()
+    out_handle.close()
 
 
 if __name__  == "__main__":
     
     parser = argparse.ArgumentParser()
     parser.add_argument('-w', '--window', help='sliding window size to create junctions', default=1000000, type=int)
-    parser.add_argument('-e', '--exonDir', help='directory containing exon pickle files', default='output/exons')
+    parser.add_argument('-e', '--exonDir', help='directory containing exon table files', default='output/exons')
     parser.add_argument('-s', '--singleFile', help='path to single exon file that should be parsed for junctions')
-    parser.add_argument('-r', '--recordDir', help='directory containing seq record pickle files', default='output/records')
+    parser.add_argument('-r', '--recordDir', help='directory containing 2-bit chromosome sequence files', default='output/records')
     parser.add_argument('-f', '--fastaDir', help='directory to output junction fasta files, will be created if does not exist', default='output/fasta')
-    parser.add_argument('-n1', '--name1', help='name of field in gtf to use for gene names', default='gene_name')
-    parser.add_argument('-n2', '--name2', help='name of field in gtf to use for gene names if n1 does not exist', default='gene_id')
+    parser.add_argument('-p', '--workers', help='number of chromosomes to create junctions for at once in directory mode', default=1, type=int)
+    parser.add_argument('-m', '--mergedFile', help='path to single fasta file combining the junctions for all chromosomes in directory mode')
+    parser.add_argument('-i', '--incremental', help='in directory mode, reuse junction fasta files for chromosomes whose exons, sequence, and window are unchanged since the last run', action='store_true')
     parser.add_argument('-v', '--verbose', help='print extra debugging info', action='store_true')
     args = parser.parse_args()
 
@@ -178,24 +347,74 @@ if __name__  == "__main__":
     if args.singleFile:
         if args.verbose:
             print "running for single file", args.singleFile
-        exonObj = os.path.basename(args.singleFile)
         fileId = utils_os.getFileId(patt_exonfilename, 1, args.singleFile)  # usually something like chr# which is in the name of each created file
-        createJunctions(fileId, exonObj)
+        
+        # the file for this chromosome is being replaced, so it can no longer be reused in directory mode
+        manifest = readManifest()
+        if fileId in manifest:
+            del manifest[fileId]
+            writeManifest(manifest)
+        
+        createJunctions(fileId, args.singleFile)
     else:
         if args.verbose:
             print "running for directory", args.exonDir
         # or loop through files in exonDir to create junction file for each
+        exonFiles = []
         for exonObj in os.listdir(args.exonDir):
-            if patt_exonfile.search(exonObj): # only parse if this is an exon pickled file
+            if patt_exonfile.search(exonObj): # only parse if this is an exon table file
                 fileId = utils_os.getFileId(patt_exonfilename, 1, exonObj)  # usually something like chr# which is in the name of each created file
-                createJunctions(fileId, exonObj)
-    
-
-    
-    
-    
-
-    
-    
- 
-
+                exonFiles.append((fileId, args.exonDir + '/' + exonObj))
+        
+        # start with the largest chromosomes so a long one is not left running on its own at the end
+        exonFiles.sort(key=lambda x: os.path.getsize(x[1]), reverse=True)
+        
+        manifest = readManifest()
+        fileHashes = dict((fileId, inputHash(fileId, exonFile)) for fileId, exonFile in exonFiles)
+        
+        # chromosomes that are no longer in the exon directory
+        for fileId in set(manifest) - set(fileHashes):
+            if args.verbose:
+                print "removing", fileId
+            if os.path.exists(args.fastaDir + '/' + fileId + '_junctions.fa'):
+                os.remove(args.fastaDir + '/' + fileId + '_junctions.fa')
+            del manifest[fileId]
+        
+        toCreate = []
+        for fileId, exonFile in exonFiles:
+            if args.incremental and manifest.get(fileId) == (args.window, fileHashes[fileId]) and os.path.exists(args.fastaDir + '/' + fileId + '_junctions.fa'):
+                if args.verbose:
+                    print "reusing", fileId
+            else:
+                toCreate.append((fileId, exonFile))
+                manifest.pop(fileId, None)
+        
+        # chromosomes being redone are out of the manifest until they finish
+        writeManifest(manifest)
+        
+        if args.workers > 1:
+            # 1 chromosome per worker process so memory is released after each chromosome
+            pool = Pool(args.workers, maxtasksperchild=1)
+            results = pool.imap_unordered(createJunctionsInPool, toCreate)
+        else:
+            results = (createJunctionsInPool(x) for x in toCreate)
+        
+        failed = []
+        for fileId, created in results:
+            if created:
+                manifest[fileId] = (args.window, fileHashes[fileId])
+                writeManifest(manifest)
+                if args.verbose:
+                    print "finished", fileId
+            else:
+                failed.append(fileId)
+        
+        if args.workers > 1:
+            pool.close()
+            pool.join()
+        
+        if failed:
+            sys.exit("junctions could not be created for: " + ", ".join(sorted(failed)))
+        
+        if args.mergedFile:
+            mergeJunctionFastas([x[0] for x in exonFiles], args.mergedFile)
@@ -0,0 +1,81 @@
+# Compact per-chromosome exon tables written by makeExonDB and read by makeJunctionsAndWriteFasta.
+#
+# Creating junctions only needs the start, end, strand, and gene name of each exon, so instead of pickling
+# SeqFeature objects each chromosome is stored as a numpy structured array, sorted by start and end,
+# plus a text file with the gene names the array refers to (1 per line, referenced by line number).
+# The array can be loaded with np.load(mmap_mode='r') so reading it costs almost nothing.
+#
+# exonsByStrand_<chr>.npy: start (0-based), end, strand (1, -1, or 0 if unknown), gene (index into the names file or -1),
+#                          order (position of the exon in the list passed to writeExonTable)
+# geneNames_<chr>.txt: gene names
+
+import numpy as np
+from collections import namedtuple
+
+EXON_DTYPE = np.dtype([('start', '<i4'), ('end', '<i4'), ('strand', 'i1'), ('gene', '<i4'), ('order', '<i4')])
+UNKNOWN_STRAND = 0  # stored for exons annotated without a strand, these are handled with the - strand exons
+NO_GENE = -1  # stored for exons without a gene name
+
+# exon as used to create junctions. gene is the gene name, or None if the exon does not have one
+exon = namedtuple('exon', ['start', 'end', 'strand', 'gene'])
+
+def exonTablePath(exonDir, chrId):
+    return exonDir + '/exonsByStrand_' + chrId + '.npy'
+
+def geneNamesPath(exonDir, chrId):
+    return exonDir + '/geneNames_' + chrId + '.txt'
+
+# param exonDir: directory to write the table to
+# param chrId: chromosome id used in the file names
+# param exons: list of (start, end, strand, gene name) where strand is 1, -1, or None and gene name may be None.
+#              The list order is kept in the order field and is the order getStrandExons returns the exons in.
+def writeExonTable(exonDir, chrId, exons):
+    geneIndex = {}  # gene name: line in gene names file
+    geneNames = []
+    table = np.zeros(len(exons), dtype=EXON_DTYPE)
+
+    sortedExons = sorted((x, order) for order, x in enumerate(exons))
+    for i, ((start, end, strand, geneName), order) in enumerate(sortedExons):
+        if geneName is None:
+            geneId = NO_GENE
+        else:
+            if geneName not in geneIndex:
+                geneIndex[geneName] = len(geneNames)
+                geneNames.append(geneName)
+            geneId = geneIndex[geneName]
+
+        if strand is None:
+            strand = UNKNOWN_STRAND
+        table[i] = (start, end, strand, geneId, order)
+
+    np.save(exonTablePath(exonDir, chrId), table)
+
+    handle = open(geneNamesPath(exonDir, chrId), 'wb')
+    for geneName in geneNames:
+        handle.write(geneName + "\n")
+    handle.close()
+
+# return: (exon table memory mapped from disk, list of gene names)
+def loadExonTable(exonDir, chrId):
+    table = np.load(exonTablePath(exonDir, chrId), mmap_mode='r')
+
+    handle = open(geneNamesPath(exonDir, chrId), 'rU')
+    geneNames = [line.rstrip("\n") for line in handle]
+    handle.close()
+
+    return table, geneNames
+
+# get the exons from the table that are handled together when creating junctions.
+# param strand: 1 for + strand exons, -1 for - strand exons and those with unknown strand
+#
+# return: list of exons in the order they were passed to writeExonTable
+def getStrandExons(table, geneNames, strand):
+    if strand == 1:
+        rows = table[table['strand'] == 1]
+    else:
+        rows = table[table['strand'] != 1]
+    rows = rows[np.argsort(rows['order'], kind='mergesort')]
+
+    names = [geneNames[g] if g != NO_GENE else None for g in rows['gene'].tolist()]
+
+    return [exon(*x) for x in zip(rows['start'].tolist(), rows['end'].tolist(), rows['strand'].tolist(), names)]
@@ -0,0 +1,141 @@
+# Compact on-disk storage for chromosome sequences so junction sequences can be pulled out
+# of the genome without holding a whole chromosome in memory.
+#
+# Each chromosome is stored in its own file using 2 bits per base, with the exceptions
+# kept in small tables alongside:
+#   - runs of any character other than A, C, G, T (usually N, but also IUPAC codes)
+#   - runs of lowercase (soft-masked) bases
+# so the sequence read back is identical to the one in the genome fasta file.
+#
+# File layout (all integers little-endian):
+#   header: magic, sequence length, number of exception runs, number of lowercase runs
+#   exception run starts, exception run ends (uint64 each), exception run characters (1 byte each)
+#   lowercase run starts, lowercase run ends (uint64 each)
+#   packed bases, 4 per byte with the first base in the 2 highest bits
+
+import mmap
+import re
+import struct
+import numpy as np
+
+MAGIC = "KN2B"
+HEADER = struct.Struct("<4sQQQ")
+
+BASES = "ACGT"
+ENCODE_TABLE = "".join(chr(BASES.index(chr(i))) if chr(i) in BASES else "\x00" for i in xrange(256))
+BASE_CODES = np.frombuffer(BASES, dtype=np.uint8)  # 2-bit code: character code
+SHIFTS = np.array([6, 4, 2, 0], dtype=np.uint8)  # where each of the 4 bases is in a packed byte
+
+# runs of a single character that can not be stored in 2 bits, like NNNNNNNN
+patt_exception = re.compile(r"([^ACGT])\1*")
+
+# runs of soft-masked bases
+patt_lowercase = re.compile("[a-z]+")
+
+# write a chromosome sequence to a 2-bit file
+# param fileName: path to the file to create
+# param seq: string containing the full chromosome sequence
+def writeTwoBit(fileName, seq):
+    upperSeq = seq.upper()
+
+    excStarts = []
+    excEnds = []
+    excChars = []
+    for match in patt_exception.finditer(upperSeq):
+        excStarts.append(match.start())
+        excEnds.append(match.end())
+        excChars.append(match.group(1))
+
+    maskStarts = []
+    maskEnds = []
+    for match in patt_lowercase.finditer(seq):
+        maskStarts.append(match.start())
+        maskEnds.append(match.end())
+
+    # pad to a multiple of 4 so every byte holds 4 bases
+    codes = np.frombuffer(upperSeq.translate(ENCODE_TABLE) + "\x00" * (-len(seq) % 4), dtype=np.uint8)
+    packed = (codes[0::4] << 6) | (codes[1::4] << 4) | (codes[2::4] << 2) | codes[3::4]
+
+    handle = open(fileName, "wb")
+    handle.write(HEADER.pack(MAGIC, len(seq), len(excStarts), len(maskStarts)))
+    handle.write(np.array(excStarts, dtype="<u8").tostring())
+    handle.write(np.array(excEnds, dtype="<u8").tostring())
+    handle.write("".join(excChars))
+    handle.write(np.array(maskStarts, dtype="<u8").tostring())
+    handle.write(np.array(maskEnds, dtype="<u8").tostring())
+    handle.write(packed.astype(np.uint8).tostring())
+    handle.close()
+
+# Read-only view of a chromosome stored by writeTwoBit. The file is memory mapped, so opening it
+# does not read the sequence, and fetch only touches the pages holding the requested bases.
+class twoBitSeq:
+
+    def __init__(self, fileName):
+        self.fileName = fileName
+        handle = open(fileName, "rb")
+        self.mm = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        handle.close()  # the map stays valid after the file is closed
+
+        magic, self.length, numExc, numMask = HEADER.unpack(self.mm[:HEADER.size])
+        if magic != MAGIC:
+            raise ValueError("not a 2-bit sequence file: " + fileName)
+
+        offset = HEADER.size
+        self.excStarts = np.frombuffer(self.mm, dtype="<u8", count=numExc, offset=offset)
+        offset += 8 * numExc
+        self.excEnds = np.frombuffer(self.mm, dtype="<u8", count=numExc, offset=offset)
+        offset += 8 * numExc
+        self.excChars = self.mm[offset:offset + numExc]
+        offset += numExc
+        self.maskStarts = np.frombuffer(self.mm, dtype="<u8", count=numMask, offset=offset)
+        offset += 8 * numMask
+        self.maskEnds = np.frombuffer(self.mm, dtype="<u8", count=numMask, offset=offset)
+        offset += 8 * numMask
+        self.baseOffset = offset
+
+    def __len__(self):
+        return self.length
+
+    def __str__(self):
+        return "twoBitSeq: " + self.fileName + " length: " + str(self.length)
+
+    # return the + strand sequence from start up to but not including end (0-based, like a python slice).
+    # Positions outside of the chromosome are dropped, just as slicing a string would.
+    def fetch(self, start, end):
+        return self.fetchArray(start, end).tostring()
+
+    # same as fetch, but returns the sequence as a numpy array of character codes (uint8) so it can be
+    # indexed to pull out many pieces of the region at once
+    def fetchArray(self, start, end):
+        start = max(start, 0)
+        end = min(end, self.length)
+        if end <= start:
+            return np.zeros(0, dtype=np.uint8)
+
+        firstByte = start >> 2
+        lastByte = (end + 3) >> 2
+        packed = np.frombuffer(self.mm, dtype=np.uint8, count=lastByte - firstByte, offset=self.baseOffset + firstByte)
+        trim = start - (firstByte << 2)
+        codes = ((packed[:, None] >> SHIFTS) & 3).ravel()[trim:trim + end - start]
+        seq = BASE_CODES[codes]
+
+        # runs are sorted and do not overlap, so the ones overlapping this region are contiguous
+        first = np.searchsorted(self.excEnds, start, side="right")
+        last = np.searchsorted(self.excStarts, end, side="left")
+        for i in xrange(first, last):
+            runStart = max(int(self.excStarts[i]), start) - start
+            runEnd = min(int(self.excEnds[i]), end) - start
+            seq[runStart:runEnd] = ord(self.excChars[i])
+
+        first = np.searchsorted(self.maskEnds, start, side="right")
+        last = np.searchsorted(self.maskStarts, end, side="left")
+        for i in xrange(first, last):
+            runStart = max(int(self.maskStarts[i]), start) - start
+            runEnd = min(int(self.maskEnds[i]), end) - start
+            run = seq[runStart:runEnd]
+            run[(run >= ord("A")) & (run <= ord("Z"))] += ord("a") - ord("A")
+
+        return seq
+
+    def close(self):
+        self.mm.close()
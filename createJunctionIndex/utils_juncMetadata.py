@@ -0,0 +1,83 @@
+# Junction metadata tables written next to a junction fasta file so the analysis code can look up the
+# chromosome, positions, type, and strand of a junction from its id without running a regex on the id
+# for every read (see getJuncInfo in analysis/utils_juncReads_minimal.py, which reads these tables).
+#
+# <fasta name>_metadata.npy: numpy structured array with 1 row per junction, sorted by key1 then key2
+#     key1, key2: the 2 halves of the md5 of the junction id, used to find the row for a junction id
+#     id: order of the junction in the fasta file
+#     chr: line of the chromosome in the chromosomes file
+#     minPos, maxPos: smaller and larger of the 2 positions in the junction id
+#     type: index into JUNC_TYPES
+#     strand: 1 or -1
+#     numGenes: 1 if both sides of the junction are in the same gene, otherwise 2
+# <fasta name>_chromosomes.txt: chromosome names, 1 per line
+
+import hashlib
+import os
+import re
+import struct
+import numpy as np
+
+METADATA_DTYPE = np.dtype([('key1', '<u8'), ('key2', '<u8'), ('id', '<i4'), ('chr', '<i4'), ('minPos', '<i4'), ('maxPos', '<i4'),
+                           ('type', 'i1'), ('strand', 'i1'), ('numGenes', 'i1')])
+JUNC_TYPES = ["reg", "rev", "dup"]
+STRANDS = {"+": 1, "-": -1}
+CHUNK_SIZE = 1000000  # rows collected in a list before they are moved into a numpy array
+
+# junction ids look like chr10|TTC40:134751179|MYC1:134722640|reg|-
+# same pattern the analysis code uses, so the table holds exactly what it would have parsed
+id_patt = re.compile("(.+?)\|(.+?):(.+?)\|(.+?):(.+?)\|(.+?)\|(\-|\+)")
+
+def metadataPath(fastaFile):
+    return os.path.splitext(fastaFile)[0] + "_metadata.npy"
+
+def chromosomesPath(fastaFile):
+    return os.path.splitext(fastaFile)[0] + "_chromosomes.txt"
+
+# return: (key1, key2) for a junction id
+def juncKeys(juncId):
+    return struct.unpack("<QQ", hashlib.md5(juncId).digest())
+
+# Collects the junctions written to a fasta file and writes the metadata table for it on close.
+# Junction ids that do not fit the pattern are left out, so they are parsed by the analysis code as before.
+class metadataWriter:
+    def __init__(self, fastaFile):
+        self.fastaFile = fastaFile
+        self.numJunctions = 0  # junctions added so far, including any left out of the table
+        self.chrIndex = {}  # chromosome name: line in chromosomes file
+        self.chrNames = []
+        self.rows = []
+        self.chunks = []
+
+    def add(self, juncId):
+        match = id_patt.search(juncId)
+        if match and match.group(6) in JUNC_TYPES:
+            if match.group(1) not in self.chrIndex:
+                self.chrIndex[match.group(1)] = len(self.chrNames)
+                self.chrNames.append(match.group(1))
+
+            if match.group(2) == match.group(4):
+                numGenes = 1
+            else:
+                numGenes = 2
+
+            pos1 = int(match.group(3))
+            pos2 = int(match.group(5))
+            self.rows.append(juncKeys(juncId) + (self.numJunctions, self.chrIndex[match.group(1)], min(pos1, pos2), max(pos1, pos2),
+                                                 JUNC_TYPES.index(match.group(6)), STRANDS[match.group(7)], numGenes))
+            if len(self.rows) == CHUNK_SIZE:
+                self.chunks.append(np.array(self.rows, dtype=METADATA_DTYPE))
+                self.rows = []
+
+        self.numJunctions += 1
+
+    def close(self):
+        self.chunks.append(np.array(self.rows, dtype=METADATA_DTYPE))
+        table = np.concatenate(self.chunks)
+        table = table[np.lexsort((table['key2'], table['key1']))]
+        np.save(metadataPath(self.fastaFile), table)
+
+        handle = open(chromosomesPath(self.fastaFile), "wb")
+        for chrName in self.chrNames:
+            handle.write(chrName + "\n")
+        handle.close()
@@ -1,23 +1,97 @@
-from Bio import SeqIO
+import numpy as np
+from Bio.Data.IUPACData import ambiguous_dna_complement
 
 EMPTY_SEQUENCE = "NOSEQUENCE" # to indicate junction sequence contains all Ns so do not include in fasta output
+SIDE_LENGTH = 150  # bases taken from each exon
+PADDING = ord("N")  # used when an exon is shorter than SIDE_LENGTH
+
+# character code: code of its complement, for upper and lower case IUPAC codes as Biopython complements them.
+# Other characters are left as they are.
+COMPLEMENT = np.arange(256, dtype=np.uint8)
+for base, comp in ambiguous_dna_complement.items():
+    COMPLEMENT[ord(base)] = ord(comp)
+    COMPLEMENT[ord(base.lower())] = ord(comp.lower())
+
+# get the sequences for many exon pairs at once. The positions of all of the bases needed are laid out in
+# a (pairs x 300) array and pulled out of a single region of the chromosome with one numpy index, which is
+# much faster than fetching and padding strings for each pair.
+#
+# Each exon is read on its own strand, so a - strand exon is reverse complemented and an exon with unknown strand
+# is not. For a junction whose 1st exon is on the - strand, both sides are then reverse complemented and swapped
+# to get the + strand. When both exons are on the same strand this is just the + strand sequence of each exon, but
+# when a - strand exon is paired with an exon with unknown strand, the side from the exon with unknown strand is
+# reverse complemented.
+#
+# param rec: twoBitSeq for the chromosome
+# param pairs: list of (exon1, exon2) utils_exon.exon pairs. Pairs should be close together on the chromosome
+#              since the whole region covering them is decoded at once.
+#
+# return: list with the 300 base sequence for each pair, or EMPTY_SEQUENCE if it would be all Ns
+def pairSeqs(rec, pairs):
+    if not pairs:
+        return []
+    
+    # always want the + strand to simplify analysis downstream, so for - strand genes
+    # the 2nd exon is on the left side of the junction
+    rcLeft = np.array([a.strand == -1 and b.strand != -1 for a, b in pairs], dtype=bool)[:, None]
+    rcRight = np.array([a.strand != -1 and b.strand == -1 for a, b in pairs], dtype=bool)[:, None]
+    leftStarts = np.array([b.start if a.strand == -1 else a.start for a, b in pairs], dtype=np.int64)
+    leftEnds = np.array([b.end if a.strand == -1 else a.end for a, b in pairs], dtype=np.int64)
+    rightStarts = np.array([a.start if a.strand == -1 else b.start for a, b in pairs], dtype=np.int64)
+    rightEnds = np.array([a.end if a.strand == -1 else b.end for a, b in pairs], dtype=np.int64)
+    
+    # exons hanging off the ends of the chromosome only use the part on the chromosome
+    leftStarts = np.maximum(leftStarts, 0)
+    leftEnds = np.minimum(leftEnds, len(rec))
+    rightStarts = np.maximum(rightStarts, 0)
+    rightEnds = np.minimum(rightEnds, len(rec))
+    
+    # last SIDE_LENGTH bases of the left exon and first SIDE_LENGTH bases of the right exon, or of their reverse
+    # complements, positions outside of the exon are padded with N
+    offsets = np.arange(SIDE_LENGTH)
+    leftPos = np.where(rcLeft, leftStarts[:, None] + SIDE_LENGTH - 1 - offsets, leftEnds[:, None] - SIDE_LENGTH + offsets)
+    rightPos = np.where(rcRight, rightEnds[:, None] - 1 - offsets, rightStarts[:, None] + offsets)
+    positions = np.hstack([leftPos, rightPos])
+    inExon = np.hstack([(leftPos >= leftStarts[:, None]) & (leftPos < leftEnds[:, None]),
+                        (rightPos >= rightStarts[:, None]) & (rightPos < rightEnds[:, None])])
+    
+    seqs = np.empty(positions.shape, dtype=np.uint8)
+    seqs.fill(PADDING)
+    if inExon.any():
+        used = positions[inExon]
+        regionStart = used.min()
+        region = rec.fetchArray(regionStart, used.max() + 1)
+        seqs[inExon] = region[used - regionStart]
+        
+        reverse = inExon & np.hstack([np.repeat(rcLeft, SIDE_LENGTH, axis=1), np.repeat(rcRight, SIDE_LENGTH, axis=1)])
+        seqs[reverse] = COMPLEMENT[seqs[reverse]]
+    
+    # for less well-annotated genomes, sometimes we get an entire junction of Ns which is not useful
+    allPadding = (seqs == PADDING).all(axis=1)
+    
+    rowLength = 2 * SIDE_LENGTH
+    seqString = seqs.tostring()
+    return [EMPTY_SEQUENCE if allPadding[i] else seqString[i * rowLength:(i + 1) * rowLength] for i in xrange(len(pairs))]
 
 class junction: 
-    def __init__(self, rec, chr, exon1, exon2):
+    # param seq: sequence for the junction if it has already been looked up with pairSeqs
+    def __init__(self, rec, chr, exon1, exon2, seq=None):
         self.chr = chr  # string chromosome id  
-        self.exons = [exon1, exon2] # SeqFeatures
+        self.exons = [exon1, exon2] # utils_exon.exon
         self.type = self.setType(exon1, exon2) # reg, rev, dup
         self.strand = exon1.strand # 1 or -1 
-        self.seq = self.setSeq(rec, exon1, exon2) # 150 from each exon
+        if seq is None:
+            seq = self.setSeq(rec, exon1, exon2)
+        self.seq = seq # 150 from each exon
         
     def __str__(self):
         return str(self.seq) + "\n"
     
     def setType(self, exon1, exon2):
-        if exon1.location == exon2.location:
+        if (exon1.start, exon1.end) == (exon2.start, exon2.end):
             return "dup"
         # exon1 comes before exon2
-        elif exon1.location.start < exon2.location.start:
+        elif exon1.start < exon2.start:
             if exon1.strand == 1:
                 return "reg"
             else:
@@ -29,58 +103,32 @@ class junction:
             else:
                 return "reg"
             
+    # param rec: twoBitSeq for the chromosome
     def setSeq(self, rec, exon1, exon2):
-        leftSide = exon1.extract(rec.seq)
-        rightSide = exon2.extract(rec.seq)
-        
-        # SeqRecord features automatically give you the reverse complement for - strand genes
-        # but I want the + strand to simplify analysis downstream
-        if self.strand == -1:
-            rSide = leftSide.reverse_complement()
-            lSide = rightSide.reverse_complement()
-            rightSide = rSide
-            leftSide = lSide
-            
-        padding = "N" * 150  # excessive padding so we know we always have 150 bases
-        
-        leftSide = padding + leftSide
-        rightSide = rightSide + padding
-        
-        # take 150 from each side
-        completeJuncSeq = leftSide[-150:] + rightSide[:150]
-        
-        # for less well-annotated genomes, sometimes we get an entire junction of Ns which is not useful
-        if completeJuncSeq != padding*2:
-            return completeJuncSeq
-        
-        return EMPTY_SEQUENCE
+        return pairSeqs(rec, [(exon1, exon2)])[0]
     
-    # tries getting primary gene name, if that doesn't exist tries getting secondary gene name.
-    # if neither primary or secondary gene name fields exist, an exception will be thrown
-    # which is caught and handled in the calling function
-    def getGeneName(self, use_feature, use_n1, use_n2):
-        if use_n1 in use_feature.qualifiers:
-            use_name = use_n1
-        else: 
-            use_name = use_n2
+    # gene names are looked up when the exon table is created. If the exon did not have
+    # a gene name, an exception will be thrown which is caught and handled in the calling function
+    def getGeneName(self, exon):
+        if exon.gene is None:
+            raise ValueError("no gene name for exon " + str(exon.start) + "-" + str(exon.end))
             
-        return use_feature.qualifiers[use_name][0]
+        return exon.gene
     
-    # the SeqRecord features switch the start and end apparently for genes on the minus strand
-    # So I need to switch them back since I want to print the coordinates of the junction
-    # n1 is primary name field to use, n2 is backup name field to use 
-    def printHeader(self, n1, n2):
+    # exon coordinates are 0-based with exclusive ends, but I want to print the 1-based coordinates
+    # of the last base of exon 1 and first base of exon 2 of the junction
+    def printHeader(self):
         msg = ">" + str(self.chr)
-        msg += "|" + str(self.getGeneName(self.exons[0], n1, n2))
+        msg += "|" + str(self.getGeneName(self.exons[0]))
         if self.strand == 1:
-            msg += ":" + str(self.exons[0].location.end)
+            msg += ":" + str(self.exons[0].end)
         else:
-            msg += ":" + str(self.exons[0].location.start + 1)
-        msg += "|" + str(self.getGeneName(self.exons[1], n1, n2))
+            msg += ":" + str(self.exons[0].start + 1)
+        msg += "|" + str(self.getGeneName(self.exons[1]))
         if self.strand == 1:
-            msg += ":" + str(self.exons[1].location.start + 1)
+            msg += ":" + str(self.exons[1].start + 1)
         else:
-            msg += ":" + str(self.exons[1].location.end )
+            msg += ":" + str(self.exons[1].end )
         msg += "|" + str(self.type)
         if self.strand == 1:
             msg += "|+"
@@ -88,4 +136,3 @@ class junction:
             msg += "|-"
         msg += "\n"
         return msg
-